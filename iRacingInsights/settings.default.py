@@ -9,8 +9,53 @@ INTERVAL = 3000
 
 FILE_FOLDER = "archive\\json"
 
+# Compressed archive of the downloaded iRacing data. Remove to keep writing JSON files to FILE_FOLDER.
+ARCHIVE_DATABASE = "archive\\archive.sqlite3"
+
+# Retention of the archive, see manage.py archive.  The size budget in bytes for everything archived, the least
+# recently used entries are evicted beyond it, how many seconds each kind of data is kept and the kinds never evicted.
+ARCHIVE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+ARCHIVE_TTLS = {
+    "result_search_hosted": 7 * 24 * 3600,
+    "member_chart_data": 30 * 24 * 3600,
+    "league_season_sessions": 30 * 24 * 3600,
+    "league_season_standings": 30 * 24 * 3600,
+}
+ARCHIVE_KEEP = ["cars_assets", "track_assets", "series_assets"]
+
 CACHE_FOLDER = "archive\\f1cache"
 
+# Saved iRacing login cookies so restarted workers do not need to log in again.
+COOKIE_FOLDER = "archive\\cookies"
+
+# Progress of long running backfills, kept out of FILE_FOLDER as everything in there belongs to the archive.
+CHECKPOINT_FOLDER = "archive\\checkpoints"
+
+# Disk tier of the iRacing API response cache and its size budget in bytes, and the budget of the memory tier.
+API_CACHE_FOLDER = "archive\\apicache"
+API_CACHE_MAX_BYTES = 256 * 1024 * 1024
+API_CACHE_MEMORY_BYTES = 32 * 1024 * 1024
+
+# The iRacing data API. Set to the address of manage.py fakeapi to run against recorded data instead of members-ng.
+IRACING_API_URL = "https://members-ng.iracing.com"
+
+# Longest time in seconds a page view will wait on the iRacing API before giving up.
+API_DEADLINE = 30
+
+# After this many failed calls in a row pages stop calling iRacing and show what is stored, marked as stale,
+# trying again every API_BREAKER_OPEN_SECONDS.  Errors, timeouts and 5xx answers count as failures.
+API_BREAKER_FAILURES = 5
+API_BREAKER_OPEN_SECONDS = 30
+
+# Shortest time in seconds between incremental searches for a league's hosted results.
+HOSTED_SCRAPE_INTERVAL = 300
+
+# Fetch the cars, tracks and series in the background when the server starts, see also manage.py warmup.
+WARMUP_ON_STARTUP = False
+
+# Lap data calls made at once by manage.py fieldlaps, which stores the laps of every driver in your races.
+FIELD_LAPS_WORKERS = 4
+
 #####  NOTHING BELOW SHOULD NEED EDITING - ITS JUST DJANGO STUFF #####
 
 """
@@ -83,6 +128,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'irstats.middleware.PageMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'iRacingInsights.urls'
@@ -99,6 +145,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'irstats.context_processors.api_status',
             ],
         },
     },
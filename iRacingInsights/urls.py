@@ -29,6 +29,7 @@ urlpatterns = [
     path('member/', include('irstats.urls')),
     path('race/<int:subsession_id>/', views.race, name='race'),
     path('docs/', views.docs, name='docs'),
+    path('metrics/', views.metrics, name='metrics'),
     path('series/', views.series, name='series'),
     path('series/<int:series_id>/', views.serie_details, name='serie_details'),
     path('tracks/', views.tracks, name='tracks'),
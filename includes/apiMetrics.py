@@ -0,0 +1,155 @@
+"""
+In process metrics for the iRacing API hot paths, rendered in the Prometheus text format.
+
+iRacingClient records call counts, latency histograms, bytes, chunk counts, retries, cache hits and logins here, and
+the page middleware records how long each view spent in total, in the database and waiting on iRacing.  The staff only
+/metrics view renders the lot so it can be scraped, or just read, to see which endpoints are slow or busy.  Each
+process keeps its own numbers, so with several workers every one needs scraping.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+
+class apiMetrics():
+
+    # Upper bounds in seconds of the latency histogram buckets.
+    default_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    # Metric name: (type, help).
+    metrics = {
+        "iracing_api_calls_total": ("counter", "API resource calls by endpoint and outcome"),
+        "iracing_api_call_seconds": ("histogram", "Time to fetch an API resource, cache misses only"),
+        "iracing_api_bytes_total": ("counter", "Decoded response bytes downloaded by endpoint"),
+        "iracing_api_wire_bytes_total": ("counter", "Response bytes received by host and content encoding"),
+        "iracing_api_decoded_bytes_total": ("counter", "Response bytes once decoded by host"),
+        "iracing_api_chunks_total": ("counter", "Chunk files downloaded by endpoint"),
+        "iracing_api_chunk_seconds": ("histogram", "Time to download one chunk file"),
+        "iracing_api_requests_total": ("counter", "HTTP requests sent by kind and status"),
+        "iracing_api_retries_total": ("counter", "HTTP requests retried by kind and reason"),
+        "iracing_api_logins_total": ("counter", "Logins by outcome"),
+        "iracing_api_login_seconds": ("histogram", "Time taken by a login"),
+        "irstats_view_seconds": ("histogram", "Time taken by a page view"),
+        "irstats_view_db_seconds": ("histogram", "Time a page view spent on database queries"),
+        "irstats_view_api_seconds": ("histogram", "Time a page view spent waiting on the iRacing API"),
+    }
+
+    def __init__(self, _buckets=None):
+        """
+        :param _buckets: tuple upper bounds in seconds of the histogram buckets
+        """
+        self.buckets = tuple(_buckets or self.default_buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def inc(self, name, labels=None, value=1):
+        """ Adds value to the counter with the labels. """
+        key = (name, self._labelKey(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=None):
+        """ Records one observation in the histogram with the labels. """
+        key = (name, self._labelKey(labels))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            if index < len(self.buckets):
+                histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    def gauge(self, name, value, labels=None, help=""):
+        """ Sets a gauge, used for the stats of the shared cache, limiter and archive when rendering. """
+        with self._lock:
+            self._gauges[(name, self._labelKey(labels))] = (value, help)
+
+    @contextlib.contextmanager
+    def timer(self, name, labels=None):
+        """ Times the with block into the histogram, or only towards the page when name is None.
+        The outermost timed block on a thread adds its time to the thread's API time, see pageApiSeconds.
+        """
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self._local.depth = depth
+            if name is not None:
+                self.observe(name, elapsed, labels)
+            if depth == 0:
+                self._local.api_seconds = getattr(self._local, "api_seconds", 0.0) + elapsed
+
+    def resetPage(self):
+        """ Starts counting API time for a new page on this thread. """
+        self._local.api_seconds = 0.0
+
+    def pageApiSeconds(self):
+        return getattr(self._local, "api_seconds", 0.0)
+
+    def render(self):
+        """ Returns every metric in the Prometheus text exposition format. """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {"buckets": list(x["buckets"]), "count": x["count"], "sum": x["sum"]}
+                          for key, x in self._histograms.items()}
+            gauges = dict(self._gauges)
+
+        lines = []
+        for name, (type, help) in self.metrics.items():
+            series = [x for x in (counters if type == "counter" else histograms) if x[0] == name]
+            if not series:
+                continue
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, type))
+            for key in sorted(series):
+                labels = key[1]
+                if type == "counter":
+                    lines.append("%s%s %s" % (name, self._labelText(labels), self._number(counters[key])))
+                    continue
+                histogram = histograms[key]
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (name, self._labelText(labels + (("le", self._number(bound)),)),
+                                                     cumulative))
+                lines.append("%s_bucket%s %d" % (name, self._labelText(labels + (("le", "+Inf"),)), histogram["count"]))
+                lines.append("%s_sum%s %s" % (name, self._labelText(labels), self._number(histogram["sum"])))
+                lines.append("%s_count%s %d" % (name, self._labelText(labels), histogram["count"]))
+
+        described = set()
+        for (name, labels), (value, help) in sorted(gauges.items(), key=lambda x: x[0]):
+            if name not in described:
+                described.add(name)
+                lines.append("# HELP %s %s" % (name, help or name))
+                lines.append("# TYPE %s gauge" % name)
+            lines.append("%s%s %s" % (name, self._labelText(labels), self._number(value)))
+
+        return "\n".join(lines) + "\n"
+
+    ##### PRIVATE #####
+
+    def _labelKey(self, labels):
+        return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+    def _labelText(self, labels):
+        if not labels:
+            return ""
+        escaped = ['%s="%s"' % (k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+                   for k, v in labels]
+        return "{" + ",".join(escaped) + "}"
+
+    def _number(self, value):
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        if isinstance(value, float):
+            return repr(value)
+        return str(value)
@@ -0,0 +1,454 @@
+"""
+Archive of the raw iRacing data we keep, results, event logs, lap charts, assets and so on.
+
+Payloads are stored as gzipped compact JSON in a single SQLite table keyed by (kind, id), which replaces thousands of
+pretty printed files in FILE_FOLDER.  The kind and id come from the export file names the rest of the code already
+uses, result_123.json is ("result", "123") and cars_assets.json is ("cars_assets", "").  Files written before the
+archive existed are still found; they are moved into the archive the first time they are read.  Without a database
+path the store keeps writing plain JSON files as before.
+
+Retention: the store keeps an in memory index of every entry, in the database and in the file folder, so existence
+checks for stored entries never touch the disk.  A key missing from the index is looked up once in case another process
+has stored it since the index was loaded.  Each kind can have a TTL and the whole archive a byte budget.  Once the budget
+is exceeded the least recently used entries are evicted down to a low water mark below it, so the next sweep is not due
+on the very next store.  Kinds listed as kept, such as the assets the views read, are never evicted.
+"""
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+
+class archiveStore():
+
+    def __init__(self, _path=None, _legacy_folder=None, _compress_level=6, _max_bytes=None, _ttls=None, _keep=(),
+                 _sweep_interval=3600, _low_water=0.9):
+        """
+        :param _path: string SQLite file holding the archive, None keeps plain JSON files in the legacy folder
+        :param _legacy_folder: string folder of JSON files from before the archive, also used when there is no path
+        :param _compress_level: int gzip level for stored payloads
+        :param _max_bytes: int size budget for the archive and legacy files together, None for no limit
+        :param _ttls: dict of kind: seconds an entry of that kind is kept after it was stored
+        :param _keep: list of kinds that are never evicted to meet the budget
+        :param _sweep_interval: int seconds between retention sweeps made while storing
+        :param _low_water: float fraction of max_bytes an over budget archive is evicted down to
+        """
+        self.path = _path
+        self.legacy_folder = _legacy_folder
+        self.compress_level = _compress_level
+        self.max_bytes = _max_bytes
+        self.ttls = dict(_ttls or {})
+        self.keep = set(_keep)
+        self.sweep_interval = _sweep_interval
+        self.low_water = _low_water
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._files = {}
+        # Bytes of everything in _entries and _files, kept up to date as they change.
+        self._bytes = 0
+        self._touched = {}
+        self._last_sweep = time.time()
+        self._stats = {"expired": 0, "evicted": 0, "freed_bytes": 0}
+
+        if self.path:
+            Path(os.path.dirname(self.path) or ".").mkdir(parents=True, exist_ok=True)
+            with self._connection() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS archive ("
+                             "kind TEXT NOT NULL, id TEXT NOT NULL, data BLOB NOT NULL, raw_bytes INTEGER NOT NULL, "
+                             "stored_bytes INTEGER NOT NULL, created REAL NOT NULL, PRIMARY KEY (kind, id))")
+                columns = [x[1] for x in conn.execute("PRAGMA table_info(archive)")]
+                if "accessed" not in columns:
+                    conn.execute("ALTER TABLE archive ADD COLUMN accessed REAL")
+        self._loadIndex()
+
+    ##### NAMES #####
+
+    @staticmethod
+    def splitName(file_name):
+        """ Turns an export file name into its (kind, id) key, result_event_log_123.json is ("result_event_log", "123"). """
+        name = os.path.basename(str(file_name))
+        if name.endswith(".json"):
+            name = name[:-5]
+        match = re.match(r"^(.*?)_(\d[\w\-]*)$", name)
+        if match:
+            return match.group(1), match.group(2)
+        return name, ""
+
+    @staticmethod
+    def fileName(kind, id=""):
+        """ The export file name for the key, the reverse of splitName. """
+        id = str(id)
+        return kind + ("_" + id if id else "") + ".json"
+
+    ##### ACCESS #####
+
+    def get(self, kind, id=""):
+        """ Returns the payload stored under the key, or None if there is none. """
+        key = (kind, str(id))
+        if self.path:
+            # Keys missing from the index are looked up too, another process may have stored them.
+            row = self._connection().execute("SELECT data, stored_bytes, created, accessed FROM archive "
+                                             "WHERE kind = ? AND id = ?", key).fetchone()
+            if row is not None:
+                self._indexEntry(key, row[1:])
+                self._touch(key)
+                return json.loads(gzip.decompress(row[0]).decode('utf-8'))
+            # Removed by another process since the index was loaded.
+            with self._lock:
+                self._indexPop(self._entries, key)
+
+        if key not in self._files and not self._indexFile(key):
+            return None
+        data = self._legacyGet(*key)
+        if data is not None:
+            self._touch(key)
+            if self.path:
+                self.put(kind, key[1], data)
+                self._removeFile(key)
+        return data
+
+    def exists(self, kind, id=""):
+        """ Answered from the index when the key is in it, otherwise from one lookup of the key. """
+        key = (kind, str(id))
+        if key in self._entries or key in self._files:
+            return True
+        if self.path:
+            row = self._connection().execute("SELECT stored_bytes, created, accessed FROM archive "
+                                             "WHERE kind = ? AND id = ?", key).fetchone()
+            if row is not None:
+                self._indexEntry(key, row)
+                return True
+        return self._indexFile(key)
+
+    def put(self, kind, id, data):
+        """ Stores the payload under the key, replacing anything already there. """
+        id = str(id)
+        if not self.path:
+            self._legacyPut(kind, id, data)
+            return
+
+        raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._store(kind, id, gzip.compress(raw, compresslevel=self.compress_level), len(raw))
+
+    def putStream(self, kind, id, records):
+        """ Passes the records straight through while archiving them as a JSON array.
+        Only the compressed bytes are held, and nothing is stored unless every record is read.
+        :return: generator of the same records
+        """
+        id = str(id)
+        if not self.path:
+            yield from self._legacyPutStream(kind, id, records)
+            return
+
+        # wbits of 31 gives a gzip stream, the same format gzip.compress writes.
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, 31)
+        parts = []
+        raw_bytes = 0
+        separator = "["
+        for record in records:
+            raw = (separator + json.dumps(record, ensure_ascii=False, separators=(',', ':'))).encode('utf-8')
+            raw_bytes += len(raw)
+            parts.append(compressor.compress(raw))
+            separator = ","
+            yield record
+
+        raw = ("[]" if separator == "[" else "]").encode('utf-8')
+        parts.append(compressor.compress(raw))
+        parts.append(compressor.flush())
+        self._store(kind, id, b"".join(parts), raw_bytes + len(raw))
+
+    def delete(self, kind, id=""):
+        key = (kind, str(id))
+        self._deleteEntries([key])
+        self._removeFile(key)
+
+    ##### RETENTION #####
+
+    def enforce(self):
+        """ Applies the retention policy.  Entries past their kind's TTL go first, then the least recently used are
+        evicted until the archive is within the low water mark of max_bytes.
+        :return: dict of expired and evicted entry counts and the bytes freed
+        """
+        self._flushTouched()
+        self._loadIndex()
+        now = time.time()
+
+        # [where, key, size, created, last used] for every entry, in the database or in a file.
+        with self._lock:
+            entries = [["archive", key] + list(x) for key, x in self._entries.items()]
+            entries += [["file", key] + list(x) for key, x in self._files.items()]
+
+        expired = [x for x in entries if x[1][0] in self.ttls and x[3] < now - self.ttls[x[1][0]]]
+        evicted = []
+        if self.max_bytes is not None:
+            total = sum(x[2] for x in entries) - sum(x[2] for x in expired)
+            expired_keys = set((x[0], x[1]) for x in expired)
+            candidates = [x for x in entries if x[1][0] not in self.keep and (x[0], x[1]) not in expired_keys]
+            target = self.max_bytes * self.low_water if total > self.max_bytes else self.max_bytes
+            for entry in sorted(candidates, key=lambda x: x[4]):
+                if total <= target:
+                    break
+                evicted.append(entry)
+                total -= entry[2]
+
+        removed = expired + evicted
+        self._deleteEntries([x[1] for x in removed if x[0] == "archive"])
+        for entry in removed:
+            if entry[0] == "file":
+                self._removeFile(entry[1])
+
+        result = {"expired": len(expired), "evicted": len(evicted), "freed_bytes": sum(x[2] for x in removed)}
+        with self._lock:
+            for name, value in result.items():
+                self._stats[name] += value
+            self._last_sweep = now
+        return result
+
+    def report(self):
+        """ Returns the usage of each kind along with the policy that applies to it and the archive totals. """
+        self._flushTouched()
+        kinds = {}
+        with self._lock:
+            entries = [(key, x, "archive") for key, x in self._entries.items()]
+            entries += [(key, x, "file") for key, x in self._files.items()]
+        for (kind, id), (size, created, used), where in entries:
+            usage = kinds.setdefault(kind, {"entries": 0, "files": 0, "bytes": 0, "oldest": created,
+                                            "last_used": used, "ttl": self.ttls.get(kind), "kept": kind in self.keep})
+            usage["entries"] += 1
+            usage["files"] += 1 if where == "file" else 0
+            usage["bytes"] += size
+            usage["oldest"] = min(usage["oldest"], created)
+            usage["last_used"] = max(usage["last_used"], used)
+
+        if self.path:
+            rows = self._connection().execute("SELECT kind, SUM(raw_bytes) FROM archive GROUP BY kind").fetchall()
+            for kind, raw_bytes in rows:
+                if kind in kinds:
+                    kinds[kind]["raw_bytes"] = raw_bytes
+
+        with self._lock:
+            report = dict(self._stats)
+        report["kinds"] = kinds
+        report["entries"] = sum(x["entries"] for x in kinds.values())
+        report["bytes"] = sum(x["bytes"] for x in kinds.values())
+        report["max_bytes"] = self.max_bytes
+        return report
+
+    def importLegacy(self):
+        """ Moves every JSON file in the legacy folder into the archive.
+        :return: int files moved
+        """
+        if not self.path:
+            return 0
+        moved = 0
+        for key in list(self._files.keys()):
+            if self.get(*key) is not None:
+                moved += 1
+        return moved
+
+    ##### INDEX #####
+
+    def _loadIndex(self):
+        """ Reads the keys, sizes and times of everything stored, one query and one folder scan. """
+        entries = {}
+        if self.path:
+            rows = self._connection().execute("SELECT kind, id, stored_bytes, created, accessed FROM archive")
+            for kind, id, size, created, accessed in rows:
+                entries[(kind, id)] = [size, created, accessed or created]
+
+        files = {}
+        if self.legacy_folder and os.path.isdir(self.legacy_folder):
+            for entry in os.scandir(self.legacy_folder):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    files[self.splitName(entry.name)] = [stat.st_size, stat.st_mtime, stat.st_mtime]
+
+        with self._lock:
+            # Uses not yet written back are kept so they still count towards recency.
+            for key, used in self._touched.items():
+                for index in (entries, files):
+                    if key in index:
+                        index[key][2] = max(index[key][2], used)
+            self._entries = entries
+            self._files = files
+            self._bytes = sum(x[0] for x in entries.values()) + sum(x[0] for x in files.values())
+
+    def _indexEntry(self, key, row):
+        """ Adds a row stored by another process to the index.
+        :param row: tuple stored_bytes, created, accessed
+        """
+        size, created, accessed = row
+        with self._lock:
+            if key not in self._entries:
+                self._indexSet(self._entries, key, [size, created, accessed or created])
+
+    def _indexFile(self, key):
+        """ Adds a file written by another process to the index.
+        :return: boolean True if the file is there
+        """
+        path = self._legacyPath(*key)
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        if stat is None:
+            return False
+        with self._lock:
+            if key not in self._files:
+                self._indexSet(self._files, key, [stat.st_size, stat.st_mtime, stat.st_mtime])
+        return True
+
+    def _indexSet(self, index, key, value):
+        """ Adds or replaces an entry of _entries or _files, keeping the byte total.  Called with the lock held. """
+        previous = index.get(key)
+        self._bytes += value[0] - (previous[0] if previous is not None else 0)
+        index[key] = value
+
+    def _indexPop(self, index, key):
+        """ Removes an entry of _entries or _files, keeping the byte total.  Called with the lock held. """
+        previous = index.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[0]
+
+    def _touch(self, key):
+        now = time.time()
+        with self._lock:
+            for index in (self._entries, self._files):
+                if key in index:
+                    index[key][2] = now
+            if key in self._entries:
+                self._touched[key] = now
+            flush = len(self._touched) >= 100
+        if flush:
+            self._flushTouched()
+
+    def _flushTouched(self):
+        """ Writes the access times back in one go rather than one write per read. """
+        with self._lock:
+            touched = self._touched
+            self._touched = {}
+        if touched and self.path:
+            with self._connection() as conn:
+                conn.executemany("UPDATE archive SET accessed = ? WHERE kind = ? AND id = ?",
+                                 [(used, kind, id) for (kind, id), used in touched.items()])
+
+    ##### DATABASE #####
+
+    def _connection(self):
+        """ One connection per thread, SQLite connections cannot be shared between threads. """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _store(self, kind, id, blob, raw_bytes):
+        # The replace happens in one transaction so readers see the old payload or the new one, never part of one.
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO archive (kind, id, data, raw_bytes, stored_bytes, created, accessed) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (kind, id, blob, raw_bytes, len(blob), now, now))
+        with self._lock:
+            self._indexSet(self._entries, (kind, id), [len(blob), now, now])
+        self._checkRetention()
+
+    def _deleteEntries(self, keys):
+        if not keys or not self.path:
+            return
+        with self._connection() as conn:
+            conn.executemany("DELETE FROM archive WHERE kind = ? AND id = ?", keys)
+        with self._lock:
+            for key in keys:
+                self._indexPop(self._entries, key)
+                self._touched.pop(key, None)
+
+    def _checkRetention(self):
+        """ Sweeps once the budget is exceeded, or when the sweep interval has passed and there are TTLs to apply. """
+        with self._lock:
+            over_budget = self.max_bytes is not None and self._bytes > self.max_bytes
+            sweep_due = bool(self.ttls) and time.time() - self._last_sweep > self.sweep_interval
+        if over_budget or sweep_due:
+            self.enforce()
+
+    ##### LEGACY FILES #####
+
+    def _legacyPath(self, kind, id):
+        if not self.legacy_folder:
+            return None
+        return os.path.join(self.legacy_folder, self.fileName(kind, id))
+
+    def _legacyGet(self, kind, id):
+        path = self._legacyPath(kind, id)
+        if path is None:
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            with self._lock:
+                self._indexPop(self._files, (kind, id))
+            return None
+        except (OSError, ValueError) as e:
+            print("archiveStore - Unreadable file", path, e)
+            return None
+
+    def _legacyPut(self, kind, id, data):
+        path = self._legacyPath(kind, id)
+        if path is None:
+            return
+        Path(self.legacy_folder).mkdir(parents=True, exist_ok=True)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+        except UnicodeEncodeError as uee:
+            print("rawToJson - UnicodeEncodeError", uee)
+            print(path)
+        except PermissionError as pe:
+            print("rawToJson - PermissionError", pe)
+            print(path)
+        self._fileStored(kind, id, path)
+
+    def _legacyPutStream(self, kind, id, records):
+        path = self._legacyPath(kind, id)
+        if path is None:
+            yield from records
+            return
+        Path(self.legacy_folder).mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("[")
+            separator = "\n"
+            for record in records:
+                f.write(separator + json.dumps(record, ensure_ascii=False))
+                separator = ",\n"
+                yield record
+            f.write("\n]")
+        self._fileStored(kind, id, path)
+
+    def _fileStored(self, kind, id, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        now = time.time()
+        with self._lock:
+            self._indexSet(self._files, (kind, id), [size, now, now])
+        self._checkRetention()
+
+    def _removeFile(self, key):
+        path = self._legacyPath(*key)
+        with self._lock:
+            self._indexPop(self._files, key)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
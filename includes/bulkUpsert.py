@@ -0,0 +1,128 @@
+"""
+Batched insert-or-update of model rows on a natural key.
+
+update_or_create costs a SELECT and an INSERT or UPDATE for every row, each committed on its own.  A bulkUpsert writes
+the rows in batches with bulk_create(update_conflicts=True), which is one INSERT ... ON CONFLICT DO UPDATE statement per
+batch, all inside one transaction.  The natural key fields need a unique constraint in the database for the conflict
+clause to work.  Each batch first reads which of its keys are already stored, so the caller is told how many rows were
+inserted and how many updated.
+
+Given a hash field, a hash of each row's values is stored alongside it, and rows whose hash matches the stored one are
+not written at all.  Reference data mostly comes back unchanged, so a sync then only touches the rows iRacing changed.
+"""
+import hashlib
+import json
+import time
+
+from django.db import transaction
+
+
+class bulkUpsert():
+
+    def __init__(self, _model, _unique_fields, _update_fields=None, _batch_size=500, _hash_field=None):
+        """
+        :param _model: Django model class the rows are written to
+        :param _unique_fields: list natural key fields, e.g. ['car_id']
+        :param _update_fields: list fields overwritten when the key exists, by default the fields given in the rows
+        :param _batch_size: int rows written per statement
+        :param _hash_field: string field holding the content hash, rows whose hash is unchanged are skipped
+        """
+        self.model = _model
+        self.unique_fields = list(_unique_fields)
+        self.update_fields = list(_update_fields) if _update_fields is not None else None
+        self.batch_size = _batch_size
+        self.hash_field = _hash_field
+
+    def run(self, rows):
+        """ Inserts the rows whose key is new and updates the others.
+        :param rows: iterable of model instances, or of dicts of field values
+        :return: dict inserted, updated, unchanged, the keys of the inserted and updated rows, and seconds
+        """
+        start = time.monotonic()
+        rows = list(rows)
+        update_fields = self._updateFields(rows)
+        objs = [x if isinstance(x, self.model) else self.model(**x) for x in rows]
+
+        # The API sometimes lists a record twice, the last one wins as it would with update_or_create.
+        unique = {}
+        for obj in objs:
+            unique[self._key(obj)] = obj
+        objs = list(unique.values())
+
+        if self.hash_field is not None:
+            # Every field goes into the hash, not just those given in this batch, so a row hashes the same whatever
+            # the other rows it is written with.
+            hashed = [x for x in self.model._meta.concrete_fields
+                      if not x.primary_key and x.name != self.hash_field and not getattr(x, "auto_now", False)]
+            for obj in objs:
+                setattr(obj, self.hash_field, self._hash(obj, hashed))
+
+        result = {"inserted": 0, "updated": 0, "unchanged": 0, "inserted_keys": [], "updated_keys": []}
+        with transaction.atomic():
+            for offset in range(0, len(objs), self.batch_size):
+                batch = objs[offset:offset + self.batch_size]
+                existing = self._existing([self._key(x) for x in batch])
+                write = []
+                for obj in batch:
+                    key = self._key(obj)
+                    if key not in existing:
+                        result["inserted_keys"].append(key)
+                    elif self.hash_field is None or existing[key] != getattr(obj, self.hash_field):
+                        result["updated_keys"].append(key)
+                    else:
+                        result["unchanged"] += 1
+                        continue
+                    write.append(obj)
+                if write:
+                    self.model.objects.bulk_create(write, update_conflicts=True, unique_fields=self.unique_fields,
+                                                   update_fields=update_fields)
+
+        result["inserted"] = len(result["inserted_keys"])
+        result["updated"] = len(result["updated_keys"])
+        result["seconds"] = time.monotonic() - start
+        return result
+
+    ##### PRIVATE #####
+
+    def _updateFields(self, rows):
+        """ The fields to overwrite.  Fields the rows leave out keep their stored value, as with update_or_create,
+        and auto_now fields such as date_modified are always refreshed.
+        """
+        if self.update_fields is not None:
+            fields = list(self.update_fields)
+        else:
+            given = set()
+            for row in rows:
+                if isinstance(row, dict):
+                    given.update(row)
+            fields = []
+            for field in self.model._meta.concrete_fields:
+                if field.primary_key or field.name in self.unique_fields:
+                    continue
+                if not given or field.name in given or field.attname in given or getattr(field, "auto_now", False):
+                    fields.append(field.name)
+        if self.hash_field is not None and self.hash_field not in fields:
+            fields.append(self.hash_field)
+        return fields
+
+    def _hash(self, obj, fields):
+        values = [getattr(obj, x.attname) for x in fields]
+        text = json.dumps(values, sort_keys=True, default=str, separators=(",", ":"))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _key(self, obj):
+        return tuple(getattr(obj, self.model._meta.get_field(x).attname) for x in self.unique_fields)
+
+    def _existing(self, keys):
+        """ Returns the given keys that are already stored, mapped to their stored hash. """
+        attnames = [self.model._meta.get_field(x).attname for x in self.unique_fields]
+        columns = attnames + [self.model._meta.get_field(self.hash_field).attname] if self.hash_field else attnames
+        # Filtering on the first key field narrows it down, the full key is compared here.
+        first = {x[0] for x in keys}
+        wanted = set(keys)
+        existing = {}
+        for stored in self.model.objects.filter(**{attnames[0] + "__in": first}).values_list(*columns):
+            key = tuple(stored[:len(attnames)])
+            if key in wanted:
+                existing[key] = stored[len(attnames)] if self.hash_field else None
+        return existing
@@ -0,0 +1,177 @@
+"""
+Lazy handle on a chunked iRacing response.
+
+The event log, lap chart and lap data endpoints answer with a chunk_info block listing the chunk files that hold the
+rows.  A chunkedResult is made from that block alone, so the row count and the response metadata are there straight
+away, and a chunk file is downloaded only when a row in it is indexed or iteration reaches it.  Downloaded chunks are
+kept, and once every chunk has been read the rows go into the response cache like an eager call's would.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class chunkedResult():
+
+    def __init__(self, _client, _endpoint, _payload=None, _response=None, _info_keys=("chunk_info",), _cache_key=None,
+                 _rows=None):
+        """
+        :param _client: iRacingClient that downloads the chunks
+        :param _endpoint: string api endpoint the response came from
+        :param _payload: dict query parameters of the request, used to ask again when the chunk links have expired
+        :param _response: dict the response holding the chunk_info block
+        :param _info_keys: tuple path to the chunk_info block inside the response
+        :param _cache_key: string response cache key the rows are stored under once all are read
+        :param _rows: list all the rows, for a result that came from the cache
+        """
+        self.client = _client
+        self.endpoint = _endpoint
+        self.payload = _payload
+        self.info_keys = _info_keys
+        self.cache_key = _cache_key
+
+        self._lock = threading.Lock()
+        self._chunks = {}
+        self._refreshed = False
+        self._setResponse(_response)
+        if _rows is not None:
+            self.chunk_info = {"rows": len(_rows), "chunk_size": max(len(_rows), 1), "chunk_file_names": ["cached"]}
+            self._chunks[0] = _rows
+
+    ##### METADATA #####
+
+    @property
+    def rows(self):
+        """ The number of rows, from chunk_info, or by reading every chunk if it is not given. """
+        if self.chunk_info.get("rows") is not None:
+            return self.chunk_info["rows"]
+        return sum(len(self.chunk(x)) for x in range(self.num_chunks))
+
+    @property
+    def chunk_size(self):
+        return self.chunk_info.get("chunk_size")
+
+    @property
+    def num_chunks(self):
+        return len(self.chunk_info.get("chunk_file_names") or [])
+
+    def loaded(self):
+        """ The number of chunks downloaded so far. """
+        with self._lock:
+            return len(self._chunks)
+
+    ##### SEQUENCE #####
+
+    def __len__(self):
+        return self.rows
+
+    def __bool__(self):
+        return self.rows > 0
+
+    def __iter__(self):
+        for number in range(self.num_chunks):
+            yield from self.chunk(number)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0:
+            raise IndexError("chunkedResult index out of range")
+
+        # Straight to the right chunk when the chunks are full sized, otherwise walk them in order.
+        if self.chunk_size:
+            number, offset = divmod(index, self.chunk_size)
+            if number < self.num_chunks:
+                rows = self.chunk(number)
+                if offset < len(rows):
+                    return rows[offset]
+            raise IndexError("chunkedResult index out of range")
+        for number in range(self.num_chunks):
+            rows = self.chunk(number)
+            if index < len(rows):
+                return rows[index]
+            index -= len(rows)
+        raise IndexError("chunkedResult index out of range")
+
+    def __repr__(self):
+        return "<chunkedResult %s rows=%s chunks=%d/%d>" % (self.endpoint, self.chunk_info.get("rows"), self.loaded(),
+                                                            self.num_chunks)
+
+    ##### CHUNKS #####
+
+    def chunk(self, number):
+        """ The rows of one chunk file, downloaded on first use. """
+        with self._lock:
+            rows = self._chunks.get(number)
+        if rows is not None:
+            return rows
+
+        rows = self._download(number)
+        with self._lock:
+            self._chunks[number] = rows
+            complete = len(self._chunks) == self.num_chunks
+        if complete:
+            self._store()
+        return rows
+
+    def load(self, max_workers=None):
+        """ Downloads every chunk not yet read, in parallel.
+        :return: list all the rows
+        """
+        with self._lock:
+            missing = [x for x in range(self.num_chunks) if x not in self._chunks]
+        if missing:
+            workers = max(1, min(max_workers or self.client.chunk_workers, len(missing)))
+            download = self.client.carry_context(self.chunk)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(download, missing))
+        return list(self)
+
+    ##### PRIVATE #####
+
+    def _setResponse(self, response):
+        self.response = response
+        chunk_info = response or {}
+        for info_key in self.info_keys:
+            chunk_info = chunk_info.get(info_key) or {}
+        self.chunk_info = chunk_info
+
+    def _download(self, number):
+        base_url = self.chunk_info["base_download_url"]
+        url = base_url + self.chunk_info["chunk_file_names"][number]
+        deadline = self.client._current_deadline()
+        try:
+            return self.client._get_chunk(url, deadline, self.endpoint)
+        except (RuntimeError, requests.RequestException, ValueError) as e:
+            self.client.printData("Chunk %d failed %s" % (number, str(e)))
+
+        # The links may have been renewed by now, here or by another chunk.
+        self._refresh()
+        url = self.chunk_info["base_download_url"] + self.chunk_info["chunk_file_names"][number]
+        return self.client._retry_chunk(url, deadline, self.endpoint)
+
+    def _refresh(self):
+        """ Asks for the response again, once, as the chunk links expire a while after they are handed out.
+        :return: boolean True if new links were fetched
+        """
+        with self._lock:
+            if self._refreshed or self.payload is None:
+                return False
+            self._refreshed = True
+        try:
+            response = self.client._get_resource(self.endpoint, payload=self.payload, use_cache=False)
+        except RuntimeError:
+            return False
+        with self._lock:
+            self._setResponse(response)
+        return True
+
+    def _store(self):
+        if self.cache_key is None:
+            return
+        with self._lock:
+            rows = [row for number in range(self.num_chunks) for row in self._chunks[number]]
+        self.client._cache_store(self.cache_key, self.endpoint, rows)
@@ -0,0 +1,112 @@
+"""
+Circuit breaker for the iRacing API.
+
+Every request the client sends is reported here with its outcome.  After failure_threshold failures in a row, where a
+connection error, a timeout or a 5xx counts as a failure, the circuit opens.  A slow answer is not a failure, large
+chunk and link downloads take a while, and a request that is too slow already ends in a timeout.  While it is open calls fail straight away instead of waiting on a service that is down,
+so pages render from the database and the archive.  Once open_seconds have passed a single call is let through as a
+probe; if it succeeds the circuit closes, otherwise it opens again for twice as long, up to max_open_seconds.
+"""
+import threading
+import time
+
+
+class circuitBreaker():
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, _failure_threshold=5, _open_seconds=30, _max_open_seconds=300):
+        """
+        :param _failure_threshold: int failures in a row that open the circuit
+        :param _open_seconds: float seconds the circuit stays open before the first probe
+        :param _max_open_seconds: float longest wait between probes as failed probes double it
+        """
+        self.failure_threshold = _failure_threshold
+        self.open_seconds = _open_seconds
+        self.max_open_seconds = _max_open_seconds
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.retry_at = None
+        self.wait = _open_seconds
+        self.last_error = None
+
+        self._probing = False
+        self._lock = threading.Lock()
+        self._stats = {"trips": 0, "rejected": 0, "probes": 0, "failures": 0}
+
+    def allow(self):
+        """ Whether a request may be sent now.  The first caller after the open period becomes the probe.
+        :return: boolean
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() >= self.retry_at:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                self._stats["probes"] += 1
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def available(self):
+        """ Whether calls would be let through, without taking the probe.  Views use it to skip updates. """
+        with self._lock:
+            return self.state == self.CLOSED or (not self._probing and time.time() >= self.retry_at)
+
+    def isClosed(self):
+        with self._lock:
+            return self.state == self.CLOSED
+
+    def record(self, success, error=None):
+        """ Reports the outcome of a request let through by allow().
+        :param success: boolean the service answered properly, 4xx answers count as success
+        :param error: string what went wrong, kept for stats()
+        """
+        with self._lock:
+            probe = self._probing
+            self._probing = False
+            if success:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    print("circuitBreaker - iRacing API recovered, closing the circuit")
+                self.state = self.CLOSED
+                self.wait = self.open_seconds
+                return
+
+            self.failures += 1
+            self._stats["failures"] += 1
+            self.last_error = error
+
+            if probe or self.state == self.HALF_OPEN:
+                self.wait = min(self.wait * 2, self.max_open_seconds)
+                self._open()
+            elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                self._stats["trips"] += 1
+                self._open()
+
+    def stats(self):
+        """ Returns the state, the counts of trips, rejected calls and probes, and the last error. """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = self.state != self.CLOSED
+            stats["state"] = self.state
+            stats["consecutive_failures"] = self.failures
+            stats["retry_in"] = max(self.retry_at - time.time(), 0) if self.retry_at and self.state != self.CLOSED else 0
+            stats["last_error"] = self.last_error
+        return stats
+
+    ##### PRIVATE #####
+
+    def _open(self):
+        """ Opens the circuit. Called with the lock held. """
+        if self.state == self.CLOSED:
+            print("circuitBreaker - iRacing API failing, opening the circuit", self.last_error)
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self.retry_at = self.opened_at + self.wait
@@ -0,0 +1,398 @@
+"""
+Local stand in for the iRacing data API, for tests, load tests and benchmarks that must not touch members-ng.
+
+The server answers from fixture files, one JSON file per recorded request holding the path, the query parameters,
+the data and, for chunked endpoints, the rows of each chunk file.  Responses are shaped like the real thing: /auth
+sets a cookie, data calls answer with a link to the payload unless the fixture says otherwise, and chunk_info points
+at chunk files the server also serves.  Latency, error injection and the x-ratelimit headers can be set to exercise
+the client's retries, rate limiting and concurrency.
+
+In record mode every request is passed on to members-ng, and the answer, with its link and chunks followed, is saved
+as a fixture before being served.  Pointing the app at a recording server and clicking around captures a session.
+
+Point a client at it with iRacingClient(_base_url=server.url) or the IRACING_API_URL setting.
+"""
+import copy
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+
+class fakeApiServer():
+
+    upstream_url = "https://members-ng.iracing.com"
+
+    def __init__(self, _fixture_folder, _host="127.0.0.1", _port=0, _latency=0.0, _jitter=0.0, _error_rate=0.0,
+                 _error_status=503, _rate_limit=None, _rate_window=60, _session_lifetime=None, _record=False,
+                 _compress=True):
+        """
+        :param _fixture_folder: string folder of the fixture files
+        :param _host: string interface to listen on
+        :param _port: int port to listen on, 0 picks a free one
+        :param _latency: float seconds added to every response
+        :param _jitter: float up to this many random seconds more
+        :param _error_rate: float share of data and chunk requests answered with _error_status
+        :param _error_status: int status of the injected errors
+        :param _rate_limit: int requests allowed per window, reported in the x-ratelimit headers, None for no limit
+        :param _rate_window: int seconds in a rate limit window
+        :param _session_lifetime: int seconds a login lasts before data calls get a 401, None for no expiry
+        :param _record: boolean pass requests on to members-ng and save the answers as fixtures
+        :param _compress: boolean gzip responses over 1KB for clients that accept it
+        """
+        self.fixture_folder = _fixture_folder
+        self.host = _host
+        self.port = _port
+        self.latency = _latency
+        self.jitter = _jitter
+        self.error_rate = _error_rate
+        self.error_status = _error_status
+        self.rate_limit = _rate_limit
+        self.rate_window = _rate_window
+        self.session_lifetime = _session_lifetime
+        self.record = _record
+        self.compress = _compress
+
+        self._lock = threading.Lock()
+        self._fixtures = {}
+        self._paths = {}
+        self._tokens = {}
+        self._remaining = _rate_limit
+        self._reset = None
+        self._stats = {}
+        self._server = None
+        self._thread = None
+        self._upstream = requests.Session() if _record else None
+
+        Path(self.fixture_folder).mkdir(parents=True, exist_ok=True)
+        self.loadFixtures()
+
+    ##### SERVER #####
+
+    @property
+    def url(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    def start(self):
+        """ Starts serving in a background thread. """
+        server = self
+
+        class Handler(fakeApiHandler):
+            fake = server
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-iracing-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def serveForever(self):
+        """ Serves on this thread until interrupted, used by manage.py fakeapi. """
+        self.start()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(1)
+        finally:
+            self.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self):
+        """ Returns the request counts by kind of request and status. """
+        with self._lock:
+            return dict(self._stats)
+
+    ##### FIXTURES #####
+
+    @staticmethod
+    def fixtureId(path, params=None):
+        """ The name a recorded request is saved under, the same for the same path and parameters in any order. """
+        params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        return hashlib.sha1((path + "?" + json.dumps(params)).encode('utf-8')).hexdigest()
+
+    def loadFixtures(self):
+        """ Reads every fixture file in the folder. """
+        fixtures = {}
+        paths = {}
+        for entry in sorted(os.scandir(self.fixture_folder), key=lambda x: x.name):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, encoding='utf-8') as f:
+                    fixture = json.load(f)
+            except (OSError, ValueError) as e:
+                print("fakeApiServer - Unreadable fixture", entry.path, e)
+                continue
+            id = self.fixtureId(fixture["path"], fixture.get("params"))
+            fixtures[id] = fixture
+            if not fixture.get("params"):
+                paths[fixture["path"]] = id
+        with self._lock:
+            self._fixtures = fixtures
+            self._paths = paths
+        return len(fixtures)
+
+    def addFixture(self, path, data, params=None, chunks=None, link=True):
+        """ Saves a fixture and serves it straight away.
+        :param path: string endpoint path, e.g. /data/car/get
+        :param data: the response data, for chunked endpoints the response holding chunk_info
+        :param params: dict the query parameters it answers, None for any call to the path without its own fixture
+        :param chunks: list of lists, the rows of each chunk file
+        :param link: boolean answer with a link to the data, as members-ng does, rather than the data itself
+        :return: string fixture id
+        """
+        fixture = {"path": path, "params": {str(k): str(v) for k, v in (params or {}).items()}, "link": link,
+                   "data": data}
+        if chunks is not None:
+            fixture["chunks"] = chunks
+        id = self.fixtureId(path, fixture["params"])
+        with open(os.path.join(self.fixture_folder, id + ".json"), 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, ensure_ascii=False)
+        with self._lock:
+            self._fixtures[id] = fixture
+            if not fixture["params"]:
+                self._paths[path] = id
+        return id
+
+    def findFixture(self, path, params):
+        """ The fixture recorded for exactly these parameters, otherwise the one recorded for the path without any.
+        A fixture recorded for other parameters is never served, subsession A's result would be archived as B's.
+        """
+        with self._lock:
+            id = self.fixtureId(path, params)
+            if id not in self._fixtures:
+                id = self._paths.get(path)
+            return (id, self._fixtures[id]) if id is not None else (None, None)
+
+    ##### RECORDING #####
+
+    def recordAuth(self, body):
+        """ Logs in upstream with the credentials the client sent. """
+        r = self._upstream.post(self.upstream_url + "/auth", json=body, timeout=30)
+        try:
+            return r.status_code, r.json()
+        except ValueError:
+            return r.status_code, {"error": r.text[:200]}
+
+    def recordRequest(self, path, params):
+        """ Fetches the request from members-ng, following its link and chunk files, and saves it as a fixture. """
+        r = self._upstream.get(self.upstream_url + path, params=params, timeout=60)
+        if r.status_code != 200:
+            return r.status_code, None
+        data = r.json()
+        link = isinstance(data, dict) and "link" in data
+        if link:
+            data = self._upstream.get(data["link"], timeout=60).json()
+
+        chunks = None
+        chunk_info = self._chunkInfo(data)
+        if chunk_info is not None:
+            chunks = [self._upstream.get(chunk_info["base_download_url"] + x, timeout=60).json()
+                      for x in chunk_info.get("chunk_file_names") or []]
+
+        id = self.addFixture(path, data, params, chunks, link)
+        print("fakeApiServer - Recorded", path, params, "as", id)
+        return 200, id
+
+    ##### RESPONSES #####
+
+    def count(self, kind, status):
+        with self._lock:
+            name = "%s_%s" % (kind, status)
+            self._stats[name] = self._stats.get(name, 0) + 1
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def injectError(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def takeRateLimit(self):
+        """ Uses one request of the budget.
+        :return: tuple (allowed, headers) where headers are the x-ratelimit headers to send
+        """
+        if self.rate_limit is None:
+            return True, {}
+        now = time.time()
+        with self._lock:
+            if self._reset is None or now >= self._reset:
+                self._remaining = self.rate_limit
+                self._reset = now + self.rate_window
+            allowed = self._remaining > 0
+            if allowed:
+                self._remaining -= 1
+            headers = {"x-ratelimit-limit": str(self.rate_limit), "x-ratelimit-remaining": str(self._remaining),
+                       "x-ratelimit-reset": str(int(self._reset))}
+        return allowed, headers
+
+    def login(self):
+        """ Issues a session token, returned as the cookie value. """
+        token = uuid.uuid4().hex
+        expires = time.time() + self.session_lifetime if self.session_lifetime else None
+        with self._lock:
+            self._tokens[token] = expires
+        return token, expires
+
+    def validToken(self, token):
+        with self._lock:
+            if token not in self._tokens:
+                return False
+            expires = self._tokens[token]
+        return expires is None or expires > time.time()
+
+    def servedData(self, id, fixture):
+        """ The fixture's data with any chunk_info pointing at this server's chunk files. """
+        data = fixture["data"]
+        if "chunks" not in fixture:
+            return data
+        data = copy.deepcopy(data)
+        chunk_info = self._chunkInfo(data)
+        chunk_info["base_download_url"] = "%s/chunks/%s/" % (self.url, id)
+        chunk_info["chunk_file_names"] = ["%d.json" % x for x in range(len(fixture["chunks"]))]
+        return data
+
+    def fixtureById(self, id):
+        with self._lock:
+            return self._fixtures.get(id)
+
+    def _chunkInfo(self, data):
+        """ Finds the chunk_info block, at the top of the data or one level down as in search_hosted. """
+        if not isinstance(data, dict):
+            return None
+        if isinstance(data.get("chunk_info"), dict):
+            return data["chunk_info"]
+        for value in data.values():
+            if isinstance(value, dict) and isinstance(value.get("chunk_info"), dict):
+                return value["chunk_info"]
+        return None
+
+
+class fakeApiHandler(BaseHTTPRequestHandler):
+    """ Request handler for fakeApiServer, the server instance is set on a subclass as fake. """
+
+    fake = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.fake.delay()
+        if urlsplit(self.path).path != "/auth":
+            return self.reply(404, {"error": "Not found"}, "other")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self.reply(400, {"error": "Bad json"}, "auth")
+
+        allowed, headers = self.fake.takeRateLimit()
+        if not allowed:
+            return self.reply(429, {"error": "Rate limited"}, "auth", headers)
+        if self.fake.record:
+            status, data = self.fake.recordAuth(body)
+            if status != 200 or not data.get("authcode"):
+                return self.reply(status, data, "auth", headers)
+
+        token, expires = self.fake.login()
+        cookie = "authtoken_members=%s; Path=/" % token
+        if expires is not None:
+            cookie += "; Expires=" + time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(expires))
+        headers["Set-Cookie"] = cookie
+        self.reply(200, {"authcode": token, "autoLoginSeries": None, "autoLoginToken": None, "custId": 0,
+                         "email": body.get("email"), "ssoCookieDomain": None}, "auth", headers)
+
+    def do_GET(self):
+        self.fake.delay()
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts[0] == "links" and len(parts) == 2:
+            fixture = self.fake.fixtureById(parts[1])
+            if fixture is None:
+                return self.reply(404, {"error": "Link expired"}, "link")
+            return self.reply(200, self.fake.servedData(parts[1], fixture), "link")
+
+        if parts[0] == "chunks" and len(parts) == 3:
+            if self.fake.injectError():
+                return self.reply(self.fake.error_status, {"error": "Injected error"}, "chunk")
+            fixture = self.fake.fixtureById(parts[1])
+            try:
+                rows = fixture["chunks"][int(parts[2].split(".")[0])]
+            except (TypeError, KeyError, IndexError, ValueError):
+                return self.reply(404, {"error": "No such chunk"}, "chunk")
+            return self.reply(200, rows, "chunk")
+
+        if parts[0] == "data":
+            return self.data(url.path, dict(parse_qsl(url.query, keep_blank_values=True)))
+
+        self.reply(404, {"error": "Not found"}, "other")
+
+    def data(self, path, params):
+        allowed, headers = self.fake.takeRateLimit()
+        if not allowed:
+            return self.reply(429, {"error": "Rate limited"}, "data", headers)
+        if not self.fake.validToken(self.cookie("authtoken_members")):
+            return self.reply(401, {"error": "Unauthorized"}, "data", headers)
+        if self.fake.injectError():
+            return self.reply(self.fake.error_status, {"error": "Injected error"}, "data", headers)
+
+        if self.fake.record:
+            status, id = self.fake.recordRequest(path, params)
+            if status != 200:
+                return self.reply(status, {"error": "Upstream error"}, "data", headers)
+
+        id, fixture = self.fake.findFixture(path, params)
+        if fixture is None:
+            return self.reply(404, {"error": "No fixture for " + path}, "data", headers)
+        if fixture.get("link", True):
+            expires = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(time.time() + 600))
+            return self.reply(200, {"link": "%s/links/%s" % (self.fake.url, id), "expires": expires}, "data",
+                              headers)
+        self.reply(200, self.fake.servedData(id, fixture), "data", headers)
+
+    def cookie(self, name):
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            key, _, value = part.strip().partition("=")
+            if key == name:
+                return value
+        return None
+
+    def reply(self, status, data, kind, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        compress = self.fake.compress and len(body) > 1024 and "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if compress:
+            body = gzip.compress(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.fake.count(kind, status)
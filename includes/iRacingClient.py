@@ -8,13 +8,28 @@
 #
 """Main entrance point for iracinginsight."""
 import base64
+import codecs
+import contextlib
+import functools
 import hashlib
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from http.cookiejar import LWPCookieJar
 from pathlib import Path
 import datetime
 import requests
 import json
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+from includes.apiMetrics import apiMetrics
+from includes.archiveStore import archiveStore
+from includes.chunkedResult import chunkedResult
+from includes.circuitBreaker import circuitBreaker
+from includes.singleFlight import singleFlight
 
 class iRacingClient():
     """
@@ -24,14 +39,149 @@ class iRacingClient():
     debug = False
     global_cust_id = None
 
-    def __init__(self, _username, _password, _cust_id, _hive_root=None, _files_folder=None):
+    # Results searches - longest range a single call may cover and windows searched at once by the range search.
+    search_window_days = 90
+    search_workers = 4
+
+    # member/get lookups - cust_ids per call and calls in flight at once.
+    member_get_batch_size = 50
+    member_get_workers = 4
+
+    # Chunked downloads - parallel workers per call and sequential retries per failed chunk.
+    chunk_workers = 8
+    chunk_retries = 2
+
+    # Request policy - connect/read timeouts, retries with jittered exponential backoff for these statuses.
+    connect_timeout = 5.0
+    read_timeout = 30.0
+    max_retries = 3
+    backoff_base = 0.5
+    backoff_max = 8.0
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    # Link and chunk downloads go to the data host on their own session - pooled connections kept per host and the
+    # encodings offered.  Brotli is only offered when urllib3 can decode it.
+    data_pool_hosts = 4
+    data_pool_size = 32
+    data_encodings = "gzip, deflate"
+
+    # Markers for endpoint parameters that must be supplied or that fall back on the client's cust_id.
+    _REQUIRED = object()
+    _CUST_ID = object()
+
+    # Endpoint table used by fetch and fetch_many, keyed by the name of the matching method.
+    # path: data API path. params: parameters and their defaults, None is not sent.
+    # expiry: cache lifetime in seconds when it differs from default_cache_ttl, None never expires.
+    # chunk_info: keys leading to the chunk_info block for endpoints whose rows come back in chunk files.
+    # export: file name for rawToJson, formatted with the payload. export_key: export only that part of the data.
+    # Results of a finished subsession never change so they are kept until evicted.
+    endpoints = {
+        "get_cars_assets": {"path": "/data/car/assets", "export": "cars_assets.json"},
+        "get_cars": {"path": "/data/car/get", "export": "cars.json"},
+        "get_carclass": {"path": "/data/carclass/get", "export": "carclass.json"},
+        "league_cust_league_sessions": {"path": "/data/league/cust_league_sessions",
+                                        "params": {"mine": False, "package_id": None},
+                                        "export": "league_cust_league_sessions.json"},
+        "get_league_directory": {"path": "/data/league/directory",
+                                 "params": {"search": "", "tag": "", "restrict_to_member": False,
+                                            "restrict_to_recruiting": False, "restrict_to_friends": False,
+                                            "restrict_to_watched": False, "minimum_roster_count": 0,
+                                            "maximum_roster_count": 999, "lowerbound": 1, "upperbound": None,
+                                            "sort": None, "order": "asc"},
+                                 "export": "league_directory.json"},
+        "league_get": {"path": "/data/league/get", "params": {"league_id": _REQUIRED, "include_licenses": False},
+                       "export": "league_{league_id}.json"},
+        "league_get_points_systems": {"path": "/data/league/get_points_systems",
+                                      "params": {"league_id": _REQUIRED, "season_id": None},
+                                      "export": "league_points_systems_{league_id}.json"},
+        "league_seasons": {"path": "/data/league/seasons", "params": {"league_id": _REQUIRED, "retired": False},
+                           "export": "league_seasons_{league_id}.json"},
+        "league_season_standings": {"path": "/data/league/season_standings",
+                                    "params": {"league_id": _REQUIRED, "season_id": _REQUIRED, "car_class_id": None,
+                                               "car_id": None},
+                                    "export": "league_season_standings_{league_id}_{season_id}.json"},
+        "league_season_sessions": {"path": "/data/league/season_sessions",
+                                   "params": {"league_id": _REQUIRED, "season_id": _REQUIRED, "results_only": False},
+                                   "export": "league_season_sessions_{league_id}_{season_id}.json"},
+        "member_chart_data": {"path": "/data/member/chart_data",
+                              "params": {"cust_id": _CUST_ID, "category_id": 2, "chart_type": 1},
+                              "export": "member_chart_data_{cust_id}_cat{category_id}_chart{chart_type}.json",
+                              "export_key": "data"},
+        "member_get": {"path": "/data/member/get", "params": {"cust_ids": _CUST_ID, "include_licenses": False},
+                       "export": "member_{cust_ids}.json"},
+        "member_info": {"path": "/data/member/info", "params": {"cust_id": _CUST_ID},
+                        "export": "member_info_{cust_id}.json"},
+        "member_profile": {"path": "/data/member/profile", "params": {"cust_id": _CUST_ID},
+                           "export": "member_profile_{cust_id}.json"},
+        "result": {"path": "/data/results/get", "params": {"subsession_id": _REQUIRED, "include_licenses": False},
+                   "expiry": None, "export": "result_{subsession_id}.json"},
+        "result_event_log": {"path": "/data/results/event_log",
+                             "params": {"subsession_id": _REQUIRED, "simsession_number": 0},
+                             "expiry": None, "chunk_info": ("chunk_info",),
+                             "export": "result_event_log_{subsession_id}_{simsession_number}.json"},
+        "result_lap_chart_data": {"path": "/data/results/lap_chart_data",
+                                  "params": {"subsession_id": _REQUIRED, "simsession_number": 0},
+                                  "expiry": None, "chunk_info": ("chunk_info",),
+                                  "export": "result_lap_chart_data_{subsession_id}.json"},
+        "result_lap_data": {"path": "/data/results/lap_data",
+                            "params": {"subsession_id": _REQUIRED, "simsession_number": 0, "cust_id": None,
+                                       "team_id": None},
+                            "expiry": None, "chunk_info": ("chunk_info",),
+                            "export": "result_lap_data_{subsession_id}.json"},
+        "result_search_hosted": {"path": "/data/results/search_hosted",
+                                 "params": {"start_range_begin": None, "start_range_end": None,
+                                            "finish_range_begin": None, "finish_range_end": None, "cust_id": None,
+                                            "host_cust_id": None, "session_name": None, "league_id": None,
+                                            "league_season_id": None, "car_id": None, "track_id": None,
+                                            "category_ids": None},
+                                 "chunk_info": ("data", "chunk_info"), "export": "result_search_hosted.json"},
+        "get_season_list": {"path": "/data/season/list",
+                            "params": {"season_year": _REQUIRED, "season_quarter": _REQUIRED},
+                            "export": "season_list_{season_year}_{season_quarter}.json"},
+        "get_series_assets": {"path": "/data/series/assets", "export": "series_assets.json"},
+        "get_series": {"path": "/data/series/get", "export": "series.json"},
+        "series_seasons": {"path": "/data/series/seasons", "params": {"include_series": False},
+                           "export": "series_seasons.json"},
+        "stats_member_career": {"path": "/data/stats/member_career", "params": {"cust_id": _CUST_ID},
+                                "export": "member_stats_career_{cust_id}.json", "export_key": "stats"},
+        "member_recent_races": {"path": "/data/stats/member_recent_races", "params": {"cust_id": _CUST_ID},
+                                "export": "member_recent_races_{cust_id}.json", "export_key": "races"},
+        "stats_member_summary": {"path": "/data/stats/member_summary", "params": {"cust_id": _CUST_ID},
+                                 "export": "member_stats_summary_{cust_id}.json"},
+        "stats_member_yearly": {"path": "/data/stats/member_yearly", "params": {"cust_id": _CUST_ID},
+                                "export": "member_stats_yearly_{cust_id}.json", "export_key": "stats"},
+        "get_track_assets": {"path": "/data/track/assets", "export": "track_assets.json"},
+        "get_tracks": {"path": "/data/track/get", "export": "track_get.json"},
+    }
+
+    # Response cache lifetimes in seconds by path, taken from the endpoint table. 0 is never cached.
+    default_cache_ttl = 900
+    cache_ttl = {spec["path"]: spec["expiry"] for spec in endpoints.values() if "expiry" in spec}
+
+    # fetch_many - calls in flight at once.
+    fetch_workers = 6
+
+    def __init__(self, _username, _password, _cust_id, _hive_root=None, _files_folder=None, _cookie_file=None,
+                 _cache=None, _limiter=None, _flights=None, _archive=None, _metrics=None, _base_url=None,
+                 _breaker=None):
         """The init function sets up:
         :param None
         :return: None
         """
         self.authenticated = False
         self.session = requests.Session()
-        self.base_url = "https://members-ng.iracing.com"
+        self.data_session = self._data_session()
+        # members-ng, or a stand in such as includes.fakeApiServer.
+        self.base_url = (_base_url or "https://members-ng.iracing.com").rstrip("/")
+
+        # Login state. The generation moves on with every login so a stale 401 does not undo a newer login.
+        self.cookie_file = _cookie_file
+        self.auth_expires = None
+        self.auth_generation = 0
+        self._auth_lock = threading.Lock()
+
+        # Per thread call deadline, see deadline().
+        self._local = threading.local()
 
         self.username = _username
         self.encoded_password = self._encode_password(_username, _password)
@@ -40,17 +190,61 @@ class iRacingClient():
         self.hive_root = _hive_root
         self.files_folder = _files_folder
 
+        # Optional responseCache and rateLimiter shared between clients.
+        self.cache = _cache
+        self.limiter = _limiter
+
+        # Identical requests made at the same time share one call, across clients when a singleFlight is shared.
+        self.flights = _flights if _flights is not None else singleFlight()
+
+        # Exports go to the archiveStore when there is one, otherwise to JSON files in the files folder.
+        self.archive = _archive
+
+        # Call counts, latencies and bytes, shared between clients so the /metrics page covers them all.
+        self.metrics = _metrics if _metrics is not None else apiMetrics()
+
+        # Fails calls fast while iRacing is down or very slow, shared between clients so they all back off.
+        self.breaker = _breaker if _breaker is not None else circuitBreaker()
+
     ##### PRIVATE CLASS Functions #####
 
+    def _data_session(self):
+        """ Session for the link and chunk downloads.  It carries no members-ng cookies, the links are pre-signed,
+        and keeps enough pooled connections for a full set of concurrent chunk downloads.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.data_pool_hosts, pool_maxsize=self.data_pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        encodings = self.data_encodings
+        try:
+            import brotli  # noqa: F401
+            encodings += ", br"
+        except ImportError:
+            pass
+        session.headers["Accept-Encoding"] = encodings
+        return session
+
     # From iracing client api
     def _encode_password(self, username, password):
         initial_hash = hashlib.sha256((password + username.lower()).encode('utf-8')).digest()
         return base64.b64encode(initial_hash).decode('utf-8')
 
-    # From iracing client api
     def _login(self, cookie_file=None):
+        with self.metrics.timer("iracing_api_login_seconds"):
+            try:
+                result = self._authenticate(cookie_file)
+            except RuntimeError:
+                self.metrics.inc("iracing_api_logins_total", {"outcome": "failed"})
+                raise
+        self.metrics.inc("iracing_api_logins_total", {"outcome": "ok"})
+        return result
+
+    # From iracing client api
+    def _authenticate(self, cookie_file=None):
 
         self.printData("Authenticating with iRacing")
+        cookie_file = cookie_file or self.cookie_file
         if cookie_file:
             self.session.cookies = LWPCookieJar(cookie_file)
             if not os.path.exists(cookie_file):
@@ -61,65 +255,546 @@ class iRacingClient():
         data = {"email": self.username, "password": self.encoded_password}
 
         try:
-            r = self.session.post('https://members-ng.iracing.com/auth', headers=headers, json=data, timeout=5.0)
+            r = self._request('post', self._build_url("/auth"), rate_limited=True, kind="auth", headers=headers,
+                              json=data)
         except requests.Timeout:
             raise RuntimeError("Login timed out")
         except requests.ConnectionError:
             raise RuntimeError("Connection error")
         else:
-            response_data = r.json()
-            if r.status_code == 200 and response_data['authcode']:
+            response_data = self._response_body(r)
+            if r.status_code == 200 and isinstance(response_data, dict) and response_data.get('authcode'):
                 if cookie_file:
                     self.session.cookies.save(ignore_discard=True)
                 self.authenticated = True
+                self.auth_expires = self._cookie_expiry()
+                self.auth_generation += 1
                 return "Logged in"
             else:
                 raise RuntimeError("Error from iRacing: ", response_data)
 
+    def _cookie_expiry(self):
+        """ Returns the earliest expiry time of the session cookies or None if they are session only. """
+        expiries = [cookie.expires for cookie in self.session.cookies if cookie.expires]
+        return min(expiries) if expiries else None
+
+    def _auth_expired(self):
+        return self.auth_expires is not None and self.auth_expires <= time.time()
+
+    def _ensure_login(self):
+        """ Logs in unless another thread already has. Only one login runs at a time per client. """
+        with self._auth_lock:
+            if not self.authenticated or self._auth_expired():
+                self._login()
+
+    def _invalidate_login(self, generation):
+        """ Marks the login as stale after a 401, unless a newer login happened while the request was in flight. """
+        with self._auth_lock:
+            if generation == self.auth_generation:
+                self.authenticated = False
+
+    def _rate_limit(self, deadline=None):
+        if self.limiter is not None:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            self.limiter.acquire(timeout=timeout)
+
+    def _rate_update(self, r):
+        if self.limiter is not None:
+            self.limiter.update(r.headers, r.status_code)
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """ Gives every call this thread makes inside the with block a shared time budget.
+        Nested deadlines keep the earliest one.  Calls that run out raise RuntimeError("Deadline exceeded").
+        :param seconds: float the budget, None for no deadline
+        """
+        previous = getattr(self._local, "deadline", None)
+        if seconds is not None:
+            deadline = time.monotonic() + seconds
+            self._local.deadline = deadline if previous is None else min(previous, deadline)
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def _current_deadline(self):
+        return getattr(self._local, "deadline", None)
+
+    def _response_body(self, r):
+        """ The decoded json body or the raw text when an error page is not json. """
+        try:
+            return r.json()
+        except ValueError:
+            return r.text[:200]
+
+    def _count_bytes(self, r, decoded=None):
+        """ Counts a response's bytes by host, as sent on the wire and once decoded, labelled with its encoding.
+        :param r: requests.Response whose body has been read
+        :param decoded: int decoded bytes, for streamed responses whose content was not kept
+        :return: int the decoded bytes
+        """
+        if decoded is None:
+            decoded = len(r.content)
+        try:
+            wire = r.raw.tell()
+        except (AttributeError, OSError, ValueError):
+            wire = None
+        if not isinstance(wire, int) or (wire == 0 and decoded):
+            wire = int(r.headers.get("content-length") or decoded)
+        host = urlsplit(r.url or "").netloc or "unknown"
+        encoding = r.headers.get("content-encoding") or "identity"
+        self.metrics.inc("iracing_api_wire_bytes_total", {"host": host, "encoding": encoding}, wire)
+        self.metrics.inc("iracing_api_decoded_bytes_total", {"host": host}, decoded)
+        return decoded
+
+    def _backoff(self, attempt, r=None):
+        """ Seconds to wait before retry number attempt. Honours Retry-After and otherwise uses full jitter. """
+        if r is not None and r.headers.get("retry-after"):
+            try:
+                return min(float(r.headers.get("retry-after")), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _request(self, method, url, rate_limited=False, deadline=None, kind="api", **kwargs):
+        """ Sends a request with timeouts and retries transient failures.
+        Connection errors, timeouts and the retry_statuses are retried up to max_retries times with backoff.
+        Any other response, including a 401, is handed back to the caller.  While the circuit breaker is open
+        RuntimeError("iRacing API unavailable") is raised without sending anything.
+        :param method: string get or post
+        :param url: string full url
+        :param rate_limited: boolean wait on the rate limiter, true for members-ng calls
+        :param deadline: float monotonic deadline, defaults to the thread's deadline()
+        :param kind: string api, link, chunk or auth, the label the request is counted under
+        :return: requests.Response
+        """
+        if deadline is None:
+            deadline = self._current_deadline()
+
+        attempt = 0
+        while True:
+            timeout = (self.connect_timeout, self.read_timeout)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError("Deadline exceeded", url)
+                timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+
+            r = None
+            error = None
+            if rate_limited:
+                self._rate_limit(deadline)
+            if not self.breaker.allow():
+                self.metrics.inc("iracing_api_requests_total", {"kind": kind, "status": "circuit_open"})
+                raise RuntimeError("iRacing API unavailable", url)
+
+            try:
+                session = self.data_session if kind in ("link", "chunk") else self.session
+                r = session.request(method, url, timeout=timeout, **kwargs)
+                if rate_limited:
+                    self._rate_update(r)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = e
+            except Exception as e:
+                self.breaker.record(False, str(e))
+                raise
+            self.breaker.record(error is None and r.status_code < 500,
+                                str(error) if error is not None else "HTTP %d" % r.status_code)
+
+            status = type(error).__name__ if error is not None else str(r.status_code)
+            self.metrics.inc("iracing_api_requests_total", {"kind": kind, "status": status})
+
+            if error is None and r.status_code not in self.retry_statuses:
+                return r
+
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return r
+
+            delay = self._backoff(attempt, r)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise RuntimeError("Deadline exceeded", url)
+            self.printData("Retrying %s in %.2fs (%s)" % (url, delay, str(error) if error else r.status_code))
+            self.metrics.inc("iracing_api_retries_total", {"kind": kind, "reason": status})
+            time.sleep(delay)
+            attempt += 1
+
+    def carry_context(self, func):
+        """ Wraps func so that, run in another thread, it keeps this thread's deadline and rate limit priority. """
+        deadline = self._current_deadline()
+        priority = self.limiter.currentPriority() if self.limiter is not None else None
+
+        def wrapper(*args, **kwargs):
+            self._local.deadline = deadline
+            with self.limiter.priority(priority) if priority is not None else contextlib.nullcontext():
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._local.deadline = None
+        return wrapper
+
+    def background(self):
+        """ Context manager that queues this thread's calls behind interactive (view triggered) ones. """
+        if self.limiter is None:
+            return contextlib.nullcontext()
+        return self.limiter.priority(self.limiter.BACKGROUND)
+
+    def restore_session(self):
+        """ Loads a saved cookie jar so a restarted worker can skip the /auth call.
+        :return: boolean True if unexpired cookies were found.
+        """
+        if not self.cookie_file or not os.path.exists(self.cookie_file):
+            return False
+
+        jar = LWPCookieJar(self.cookie_file)
+        try:
+            jar.load(ignore_discard=True)
+        except (OSError, ValueError) as e:
+            print("restore_session - Unable to load cookies", e)
+            return False
+
+        if len(jar) == 0:
+            return False
+
+        with self._auth_lock:
+            self.session.cookies = jar
+            self.auth_expires = self._cookie_expiry()
+            self.authenticated = not self._auth_expired()
+            self.auth_generation += 1
+        return self.authenticated
+
     # From iracing client api
     def _build_url(self, endpoint):
         return self.base_url + endpoint
 
     # From iracing client api
-    def _get_resource_or_link(self, url, payload=None):
-        if not self.authenticated:
-            self._login()
-            return self._get_resource_or_link(url, payload=payload)
+    def _get_resource_or_link(self, url, payload=None, _replayed=False):
+        if not self.authenticated or self._auth_expired():
+            self._ensure_login()
 
-        r = self.session.get(url, params=payload)
+        generation = self.auth_generation
+        try:
+            r = self._request('get', url, rate_limited=True, params=payload)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise RuntimeError("Request failed", url, str(e))
 
-        if r.status_code == 401:
-            # unauthorised, likely due to a timeout, retry after a login
-            self.authenticated = False
+        if r.status_code == 401 and not _replayed:
+            # unauthorised, likely due to a timeout, log in again and replay the request once
+            self.metrics.inc("iracing_api_retries_total", {"kind": "api", "reason": "401"})
+            self._invalidate_login(generation)
+            return self._get_resource_or_link(url, payload=payload, _replayed=True)
 
         if r.status_code != 200:
-            raise RuntimeError(r.json())
+            raise RuntimeError(r.status_code, self._response_body(r))
+        self.metrics.inc("iracing_api_bytes_total", {"endpoint": self._endpoint_label(url)}, self._count_bytes(r))
         data = r.json()
         if not isinstance(data, list) and "link" in data.keys():
             return [data["link"], True]
         else:
             return [data, False]
 
+    def _cache_lookup(self, key_name, payload=None):
+        """ Checks the response cache for the endpoint and payload.
+        :return: tuple (key, found, data) where key is None when the endpoint is not cached.
+        """
+        if self.cache is None:
+            return None, False, None
+        endpoint = key_name.split("#")[0]
+        if self.cache_ttl.get(endpoint, self.default_cache_ttl) == 0:
+            return None, False, None
+        key = self.cache.makeKey(key_name, payload)
+        found, data = self.cache.get(key)
+        return key, found, data
+
+    def _cache_store(self, key, endpoint, data):
+        if key is not None and data is not None:
+            self.cache.set(key, data, self.cache_ttl.get(endpoint, self.default_cache_ttl))
+
     # From iracing client api
-    def _get_resource(self, endpoint, payload=None):
+    def _get_resource(self, endpoint, payload=None, use_cache=True):
+        key, found, data = self._cache_lookup(endpoint, payload) if use_cache else (None, False, None)
+        if found:
+            self.metrics.inc("iracing_api_calls_total", {"endpoint": endpoint, "outcome": "cache_hit"})
+            return data
+
+        # Time spent waiting on another caller's request counts towards the page too.
+        with self.metrics.timer(None):
+            if not use_cache:
+                return self._fetch_resource(endpoint, payload, key)
+            fetched = []
+
+            def fetch():
+                fetched.append(True)
+                return self._fetch_resource(endpoint, payload, key)
+
+            data = self._single_flight(endpoint, payload, key, fetch)
+        if not fetched:
+            self.metrics.inc("iracing_api_calls_total", {"endpoint": endpoint, "outcome": "shared"})
+        return data
+
+    def _fetch_resource(self, endpoint, payload, key):
+        labels = {"endpoint": endpoint}
+        with self.metrics.timer("iracing_api_call_seconds", labels):
+            try:
+                data = self._download_resource(endpoint, payload, key)
+            except RuntimeError:
+                self.metrics.inc("iracing_api_calls_total", {"endpoint": endpoint, "outcome": "error"})
+                raise
+        self.metrics.inc("iracing_api_calls_total", {"endpoint": endpoint, "outcome": "fetched"})
+        return data
+
+    def _download_resource(self, endpoint, payload, key):
         request_url = self._build_url(endpoint)
         resource_obj, is_link = self._get_resource_or_link(request_url, payload=payload)
         if not is_link:
+            self._cache_store(key, endpoint, resource_obj)
             return resource_obj
-        r = self.session.get(resource_obj)
+        try:
+            r = self._request('get', resource_obj, kind="link")
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise RuntimeError("Link download failed", str(e))
         if r.status_code != 200:
-            raise RuntimeError(r.json())
-        return r.json()
+            raise RuntimeError(r.status_code, self._response_body(r))
+        self.metrics.inc("iracing_api_bytes_total", {"endpoint": endpoint}, self._count_bytes(r))
+        data = r.json()
+        self._cache_store(key, endpoint, data)
+        return data
+
+    def _endpoint_label(self, url):
+        """ The endpoint path of a members-ng url, used to label its metrics. """
+        if url.startswith(self.base_url):
+            return url[len(self.base_url):].split("?")[0]
+        return url
+
+    def _get_chunked_resource(self, endpoint, payload=None, max_workers=None, info_keys=("chunk_info",)):
+        """ Gets a chunked resource and caches the downloaded rows rather than the chunk links, which expire.
+        :param endpoint: string api endpoint
+        :param payload: dict query parameters
+        :param max_workers: int parallel chunk downloads for this call.
+        :param info_keys: tuple path to the chunk_info block inside the response.
+        :return: list All chunk rows in order.
+        """
+        key, found, chunks = self._cache_lookup(endpoint + "#chunks", payload)
+        if found:
+            self.metrics.inc("iracing_api_calls_total", {"endpoint": endpoint, "outcome": "cache_hit"})
+            return chunks
+
+        def fetch():
+            chunk_info = self._get_resource(endpoint, payload=payload, use_cache=False)
+            for info_key in info_keys:
+                chunk_info = chunk_info[info_key]
+            chunks = self._get_chunks(chunk_info, max_workers=max_workers, endpoint=endpoint)
+            self._cache_store(key, endpoint, chunks)
+            return chunks
+
+        with self.metrics.timer(None):
+            return self._single_flight(endpoint + "#chunks", payload, key, fetch)
+
+    def _single_flight(self, key_name, payload, key, func):
+        """ Runs func once for every concurrent caller asking for the same endpoint and payload.
+        With a cache key the wait can span processes, the result being picked up from the shared cache.
+        """
+        if self.flights is None:
+            return func()
+        flight_key = key or key_name + "?" + json.dumps(payload or {}, sort_keys=True, default=str)
+        recheck = (lambda: self.cache.get(key)) if key is not None else None
+        deadline = self._current_deadline()
+        timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+        return self.flights.do(flight_key, func, recheck=recheck, timeout=timeout)
+
+    def _get_chunk(self, url, deadline=None, endpoint=None):
+        labels = {"endpoint": endpoint or "unknown"}
+        with self.metrics.timer("iracing_api_chunk_seconds", labels):
+            r = self._request('get', url, deadline=deadline, kind="chunk")
+            if r.status_code != 200:
+                raise RuntimeError("Chunk download failed", r.status_code, url)
+            self.metrics.inc("iracing_api_chunks_total", labels)
+            self.metrics.inc("iracing_api_bytes_total", labels, self._count_bytes(r))
+            return r.json()
+
+    def _retry_chunk(self, url, deadline=None, endpoint=None):
+        """ Retries a single chunk that failed during the parallel download.
+        :param url: string the full chunk url
+        :param deadline: float monotonic deadline of the calling thread
+        :param endpoint: string the endpoint the chunk belongs to, for its metrics
+        :return: list The chunk rows.
+        """
+        error = None
+        for attempt in range(self.chunk_retries):
+            self.metrics.inc("iracing_api_retries_total", {"kind": "chunk", "reason": "chunk_failed"})
+            try:
+                return self._get_chunk(url, deadline, endpoint)
+            except (RuntimeError, requests.RequestException, ValueError) as e:
+                self.printData("Chunk retry %d failed %s" % (attempt + 1, str(e)))
+                error = e
+        raise RuntimeError("Chunk download failed after retries", url, str(error))
 
     # From iracing client api
-    def _get_chunks(self, chunks):
+    def _get_chunks(self, chunks, max_workers=None, endpoint=None):
+        """ Downloads the chunk files in parallel and flattens them back together in chunk order.
+        :param chunks: dict The chunk_info block of a chunked response.
+        :param max_workers: int Concurrent downloads for this call, defaults to chunk_workers.
+        :param endpoint: string the endpoint the chunks belong to, for their metrics
+        :return: list All chunk rows in order.
+        """
         base_url = chunks["base_download_url"]
         urls = [base_url + x for x in chunks["chunk_file_names"]]
-        list_of_chunks = [self.session.get(url).json() for url in urls]
+        if not urls:
+            return []
+
+        workers = max(1, min(max_workers or self.chunk_workers, len(urls)))
+        list_of_chunks = [None] * len(urls)
+        failed = []
+
+        # The pool threads do not see this thread's deadline so it is handed over explicitly.
+        deadline = self._current_deadline()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._get_chunk, url, deadline, endpoint) for url in urls]
+            for idx, future in enumerate(futures):
+                try:
+                    list_of_chunks[idx] = future.result()
+                except (RuntimeError, requests.RequestException, ValueError) as e:
+                    self.printData("Chunk %d failed %s" % (idx, str(e)))
+                    failed.append(idx)
+
+        # Failed chunks are retried one at a time once the pool has drained.
+        for idx in failed:
+            list_of_chunks[idx] = self._retry_chunk(urls[idx], deadline, endpoint)
+
         output = [item for sublist in list_of_chunks for item in sublist]
 
         return output
 
+    def _iter_json_array(self, r, read_size=65536, read_bytes=None):
+        """ Parses a streamed json array response and yields its items one at a time.
+        Only the unparsed tail of the body is held in memory, never the whole chunk.
+        :param r: requests.Response opened with stream=True
+        :param read_size: int bytes read from the socket per step
+        :param read_bytes: list whose first item is added to with the decoded bytes read, None to not count them
+        :return: generator of the array items
+        """
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8')()
+        buffer = ""
+        started = False
+        finished = False
+        raw_iter = r.iter_content(chunk_size=read_size)
+
+        while True:
+            position = 0
+            length = len(buffer)
+            while True:
+                while position < length and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position >= length:
+                    break
+                if not started:
+                    if buffer[position] != "[":
+                        raise RuntimeError("Chunk is not a json array")
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # The item is split across reads.
+                    break
+                if not finished and (end == length or buffer[end] not in " \t\r\n,]"):
+                    # A number cut short by the read, as 1 from 1.5, is only complete once a delimiter follows.
+                    break
+                yield item
+                position = end
+            buffer = buffer[position:]
+
+            if finished:
+                if buffer.strip():
+                    raise RuntimeError("Chunk ended part way through an item")
+                raise RuntimeError("Chunk ended before the end of the array")
+            try:
+                raw = next(raw_iter)
+                if read_bytes is not None:
+                    read_bytes[0] += len(raw)
+                buffer += text_decoder.decode(raw)
+            except StopIteration:
+                buffer += text_decoder.decode(b"", final=True)
+                finished = True
+
+    def _iter_chunks(self, chunks, endpoint=None):
+        """ Streams the chunk files in order, yielding one row at a time so memory stays flat.
+        A chunk that fails is downloaded again up to chunk_retries times, skipping the rows already yielded from it.
+        :param chunks: dict The chunk_info block of a chunked response.
+        :param endpoint: string the endpoint the chunks belong to, for their metrics
+        :return: generator of the chunk rows
+        """
+        deadline = self._current_deadline()
+        for file_name in chunks["chunk_file_names"]:
+            url = chunks["base_download_url"] + file_name
+            done = 0
+            attempt = 0
+            while True:
+                try:
+                    for row in self._stream_chunk(url, deadline, endpoint, skip=done):
+                        done += 1
+                        yield row
+                    break
+                except (RuntimeError, requests.RequestException, ValueError) as e:
+                    if attempt >= self.chunk_retries:
+                        raise RuntimeError("Chunk download failed after retries", url, str(e))
+                    attempt += 1
+                    self.printData("Chunk retry %d after %d rows %s" % (attempt, done, str(e)))
+                    self.metrics.inc("iracing_api_retries_total", {"kind": "chunk", "reason": "chunk_failed"})
+
+    def _stream_chunk(self, url, deadline=None, endpoint=None, skip=0):
+        """ Streams the rows of one chunk file.
+        :param skip: int rows at the start of the chunk that are not yielded, already read on an earlier attempt
+        :return: generator of the chunk rows
+        """
+        labels = {"endpoint": endpoint or "unknown"}
+        r = self._request('get', url, deadline=deadline, kind="chunk", stream=True)
+        read_bytes = [0]
+        try:
+            if r.status_code != 200:
+                raise RuntimeError("Chunk download failed", r.status_code, url)
+            self.metrics.inc("iracing_api_chunks_total", labels)
+            for index, row in enumerate(self._iter_json_array(r, read_bytes=read_bytes)):
+                if index >= skip:
+                    yield row
+        finally:
+            if r.status_code == 200:
+                self.metrics.inc("iracing_api_bytes_total", labels, self._count_bytes(r, read_bytes[0]))
+            r.close()
+
+    def _stream_chunked_resource(self, endpoint, payload=None, info_keys=("chunk_info",)):
+        """ Streaming version of _get_chunked_resource. Cached rows are replayed but a miss is not cached.
+        The chunk_info request is made straight away so errors show up here; chunk errors raise during iteration.
+        :return: generator of the chunk rows
+        """
+        key, found, chunks = self._cache_lookup(endpoint + "#chunks", payload)
+        if found:
+            self.metrics.inc("iracing_api_calls_total", {"endpoint": endpoint, "outcome": "cache_hit"})
+            return iter(chunks)
+
+        chunk_info = self._get_resource(endpoint, payload=payload, use_cache=False)
+        for info_key in info_keys:
+            chunk_info = chunk_info[info_key]
+        return self._iter_chunks(chunk_info, endpoint=endpoint)
+
+    def _lazy_chunked_resource(self, endpoint, payload=None, info_keys=("chunk_info",)):
+        """ Lazy version of _get_chunked_resource. Only the chunk_info request is made here.
+        :return: chunkedResult that downloads each chunk when it is first read
+        """
+        key, found, chunks = self._cache_lookup(endpoint + "#chunks", payload)
+        if found:
+            self.metrics.inc("iracing_api_calls_total", {"endpoint": endpoint, "outcome": "cache_hit"})
+            return chunkedResult(self, endpoint, _rows=chunks)
+
+        response = self._get_resource(endpoint, payload=payload, use_cache=False)
+        return chunkedResult(self, endpoint, payload, response, info_keys, key)
+
     ##### BUILDER Functions #####
 
     # Tries to get a cust_id and falls back on self.cust_id.
@@ -140,6 +815,11 @@ class iRacingClient():
             print("printData", uee)
 
     def rawToJson(self, file_name, raw_data):
+        if self.archive is not None:
+            kind, id = archiveStore.splitName(file_name)
+            self.archive.put(kind, id, raw_data)
+            return
+
         export_path = os.path.join(self.hive_root, self.files_folder)
         Path(export_path).mkdir(parents=True, exist_ok=True)
         try:
@@ -153,6 +833,100 @@ class iRacingClient():
             print("rawToJson - PermissionError", pe)
             print(full_path)
 
+    def streamToJson(self, file_name, records):
+        """ Passes the records straight through while writing them to a JSON array file as they go.
+        :param file_name: string file name inside the export folder
+        :param records: iterable of json serialisable records
+        :return: generator of the same records
+        """
+        if self.archive is not None:
+            kind, id = archiveStore.splitName(file_name)
+            yield from self.archive.putStream(kind, id, records)
+            return
+
+        export_path = os.path.join(self.hive_root, self.files_folder)
+        Path(export_path).mkdir(parents=True, exist_ok=True)
+        full_path = os.path.join(self.hive_root, self.files_folder, file_name)
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write("[")
+            separator = "\n"
+            for record in records:
+                f.write(separator + json.dumps(record, ensure_ascii=False))
+                separator = ",\n"
+                yield record
+            f.write("\n]")
+
+    ##### ENDPOINT TABLE #####
+
+    def fetch(self, name, export=False, max_workers=None, **params):
+        """ Calls an endpoint from the endpoints table.
+        :param name: string key of the endpoints table, the same as the method name
+        :param export: boolean export to the table's file name, or a string file name to use instead
+        :param max_workers: int parallel chunk downloads for chunked endpoints
+        :param params: the endpoint's parameters, any not given take the table's default
+        :return: the response data, the rows for chunked endpoints, None if the call failed
+        """
+        spec = self.endpoints[name]
+        try:
+            payload = self._endpoint_payload(name, spec, params)
+            if "chunk_info" in spec:
+                raw_data = self._get_chunked_resource(spec["path"], payload=payload, max_workers=max_workers,
+                                                      info_keys=spec["chunk_info"])
+            else:
+                raw_data = self._get_resource(spec["path"], payload=payload)
+
+        except RuntimeError as e:
+            print("Check Resource call", name, str(e))
+            return None
+
+        if export and raw_data is not None:
+            file_name = export if isinstance(export, str) else spec["export"].format(**payload)
+            self.rawToJson(file_name, raw_data[spec["export_key"]] if "export_key" in spec else raw_data)
+        return raw_data
+
+    def fetch_many(self, calls, max_workers=None):
+        """ Runs a mixed set of endpoint calls concurrently.
+        :param calls: dict of key: endpoint name, or (endpoint name, dict of fetch parameters)
+        :param max_workers: int calls in flight at once, defaults to fetch_workers
+        :return: dict of key: response data, None for the calls that failed
+        """
+        if not calls:
+            return {}
+
+        def run(call):
+            if isinstance(call, str):
+                return self.fetch(call)
+            return self.fetch(call[0], **call[1])
+
+        run = self.carry_context(run)
+        workers = max(1, min(max_workers or self.fetch_workers, len(calls)))
+        with self.metrics.timer(None), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {key: executor.submit(run, call) for key, call in calls.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    def _endpoint_payload(self, name, spec, params):
+        """ Builds the query parameters for an endpoint from the call's parameters and the table defaults. """
+        defaults = spec.get("params", {})
+        unknown = [x for x in params if x not in defaults]
+        if unknown:
+            raise RuntimeError("Unknown parameters for " + name, unknown)
+
+        payload = {}
+        for param, default in defaults.items():
+            value = params.get(param)
+            if value is None:
+                value = default
+            if value is self._CUST_ID:
+                value = self.getCustID(None)
+            elif value is self._REQUIRED:
+                raise RuntimeError("Please supply a " + param)
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ",".join(str(x) for x in value)
+            payload[param] = value
+        return payload
+
     ##### API Query Functions #####
 
     ##### CARS #####
@@ -166,16 +940,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            raw_data = self._get_resource("/data/car/assets")
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('cars_assets.json', raw_data)
-        return raw_data
+        return self.fetch("get_cars_assets", export=export)
 
     # Car Get
     def get_cars(self, export=False):
@@ -185,16 +950,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            raw_data = self._get_resource("/data/car/get")
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('cars.json', raw_data)
-        return raw_data
+        return self.fetch("get_cars", export=export)
 
     # CarClass
     def get_carclass(self, export=False):
@@ -204,17 +960,7 @@ class iRacingClient():
          :param export: boolean should the file be exported to JSON
          :return: dict All data retrieved is returned.
          """
-        try:
-            raw_data = self._get_resource("/data/carclass/get")
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            export_path = os.path.join(self.hive_root, self.files_folder, 'carclass.json')
-            self.rawToJson(export_path, raw_data)
-        return raw_data
+        return self.fetch("get_carclass", export=export)
 
     ##### CONSTANTS #####
 
@@ -232,18 +978,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            payload = {"mine": mine}
-            if package_id:
-                payload["package_id"] = package_id
-            raw_data = self._get_resource("/data/league/cust_league_sessions", payload=payload)
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "league_cust_league_sessions.json"
-            self.rawToJson(filename, raw_data)
+        return self.fetch("league_cust_league_sessions", export=export, mine=mine, package_id=package_id)
 
     # directory
     def get_league_directory(self, search="", tag="", restrict_to_member=False, restrict_to_recruiting=False,
@@ -267,20 +1002,9 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            params = locals()
-            payload = {}
-            for x in params.keys():
-                if x != "self":
-                    payload[x] = params[x]
-            raw_data = self._get_resource("/data/league/directory", payload=payload)
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('league_directory.json', raw_data)
-        return raw_data
+        params = locals()
+        del params["self"], params["export"]
+        return self.fetch("get_league_directory", export=export, **params)
 
     # get
     def league_get(self, league_id=None, include_licenses=False, export=False):
@@ -292,19 +1016,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            if not league_id:
-                raise RuntimeError("Please supply a league_id")
-            payload = {"league_id": league_id, "include_licenses": include_licenses}
-            raw_data = self._get_resource("/data/league/get", payload=payload)
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "league_" + str(league_id) + ".json"
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("league_get", export=export, league_id=league_id, include_licenses=include_licenses)
 
     # get_points_systems
     def league_get_points_systems(self, league_id, season_id=None, export=False):
@@ -316,17 +1028,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            payload = {"league_id": league_id}
-            raw_data = self._get_resource("/data/league/get_points_systems", payload=payload)
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "league_points_systems_%d.json" % (league_id)
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("league_get_points_systems", export=export, league_id=league_id, season_id=season_id)
 
     # membership
 
@@ -339,17 +1041,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            payload = {"league_id": league_id, "retired": retired}
-            raw_data = self._get_resource("/data/league/seasons", payload=payload)
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "league_seasons_" + str(league_id) + ".json"
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("league_seasons", export=export, league_id=league_id, retired=retired)
 
     # season_standings
     def league_season_standings(self, league_id, season_id, car_class_id=None, car_id=None, export=False):
@@ -363,22 +1055,8 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            payload = {"league_id": league_id, "season_id": season_id}
-            if car_class_id:
-                payload["car_class_id"] = car_class_id
-            if car_id:
-                payload["car_id"] = car_id
-            raw_data = self._get_resource("/data/league/season_standings", payload=payload)
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "league_season_standings_%d_%d.json" % (league_id, season_id)
-            self.rawToJson(filename, raw_data)
-
-        return raw_data
+        return self.fetch("league_season_standings", export=export, league_id=league_id, season_id=season_id,
+                          car_class_id=car_class_id, car_id=car_id)
 
     # season_sessions
     def league_season_sessions(self, league_id, season_id, results_only=False, export=False):
@@ -391,21 +1069,8 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            payload = {
-                "league_id": league_id,
-                "season_id": season_id,
-                "results_only": results_only,
-            }
-            raw_data = self._get_resource("/data/league/season_sessions", payload=payload)
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "league_season_sessions_%d_%d.json" %(league_id, season_id)
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("league_season_sessions", export=export, league_id=league_id, season_id=season_id,
+                          results_only=results_only)
 
     ##### LOOKUP #####
 
@@ -423,49 +1088,51 @@ class iRacingClient():
         :return dictionary
         """
         cust_id = self.getCustID(cust_id)
-
-        try:
-
-            payload = {"category_id": category_id, "chart_type": chart_type}
-            if cust_id:
-                payload["cust_id"] = cust_id
-
-            raw_data = self._get_resource("/data/member/chart_data", payload=payload)
-
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
-
-        if export:
-            filename = 'member_chart_data_%d_cat%d_chart%d.json' % (cust_id, category_id, chart_type)
-            self.rawToJson(filename, raw_data['data'])
-        return raw_data
+        return self.fetch("member_chart_data", export=export, cust_id=cust_id, category_id=category_id,
+                          chart_type=chart_type)
 
     # get
     def member_get(self, cust_id=None, include_licenses=False, export=False):
         """
         :link - https://members-ng.iracing.com/data/member/get
         :expirationSeconds - 900
-        :param cust_id: number - required - note": "?cust_ids=2,3,4
+        :param cust_id: number or list of numbers - required - note": "?cust_ids=2,3,4
         :param include_licenses: boolean
         :param export: boolean - export to json
         :return:
         """
-
         cust_id = self.getCustID(cust_id)
+        if isinstance(cust_id, (list, tuple)):
+            file_id = "%s_%d" % (cust_id[0], len(cust_id))
+        else:
+            file_id = str(cust_id)
 
-        try:
-            payload = {"cust_ids": cust_id, "include_licenses": include_licenses}
-            raw_data = self._get_resource("/data/member/get", payload=payload)
-
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
+        filename = "member_" + file_id + ".json" if export else False
+        return self.fetch("member_get", export=filename, cust_ids=cust_id, include_licenses=include_licenses)
 
-        if export:
-            filename = "member_" + str(cust_id) + ".json"
-            self.rawToJson(filename, raw_data)
-        return raw_data
+    def member_get_batch(self, cust_ids, include_licenses=True, max_workers=None):
+        """
+        Looks up many members with as few member/get calls as possible, running the calls concurrently.
+        :param cust_ids: list of numbers
+        :param include_licenses: boolean
+        :param max_workers: int calls in flight at once, defaults to member_get_workers
+        :return: dict of member records keyed by cust_id. Members whose batch failed are left out.
+        """
+        cust_ids = list(dict.fromkeys(int(x) for x in cust_ids))
+        batches = [cust_ids[i:i + self.member_get_batch_size] for i in range(0, len(cust_ids), self.member_get_batch_size)]
+        if not batches:
+            return {}
+
+        members = {}
+        fetch = self.carry_context(lambda batch: self.member_get(batch, include_licenses=include_licenses))
+        workers = max(1, min(max_workers or self.member_get_workers, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for raw_data in executor.map(fetch, batches):
+                if raw_data is None:
+                    continue
+                for member in raw_data.get('members', []):
+                    members[member['cust_id']] = member
+        return members
 
     # info
     def member_info(self, cust_id=None, export=False):
@@ -480,20 +1147,8 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-
         cust_id = self.getCustID(cust_id)
-        try:
-            payload = {"cust_id": cust_id}
-            raw_data = self._get_resource("/data/member/info", payload=payload)
-
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
-
-        if export:
-            filename = "member_info_" + str(cust_id) + ".json"
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("member_info", export=export, cust_id=cust_id)
 
     # participation credits
     """
@@ -512,20 +1167,8 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-
         cust_id = self.getCustID(cust_id)
-        try:
-            payload = {"cust_id": cust_id}
-            raw_data = self._get_resource("/data/member/profile", payload=payload)
-
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
-
-        if export:
-            filename = "member_profile_" + str(cust_id) + ".json"
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("member_profile", export=export, cust_id=cust_id)
 
     ##### RESULTS #####
 
@@ -539,32 +1182,16 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-
         if not subsession_id:
             raise RuntimeError("Please supply a subsession_id")
 
-        try:
-            payload = {
-                "subsession_id": subsession_id,
-                "include_licenses": include_licenses}
-
-            raw_data = self._get_resource("/data/results/get", payload=payload)
-            self.printData(raw_data)
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "result_" + str(subsession_id) + ".json"
-            self.rawToJson(filename, raw_data)
-
+        raw_data = self.fetch("result", export=export, subsession_id=subsession_id, include_licenses=include_licenses)
+        self.printData(raw_data)
         return raw_data
 
-        # dictionary of the lap data for the given sub session id.
-
     # event_log
-    def result_event_log(self, subsession_id=None, simsession_number=0, export=False, result_file=None):
+    def result_event_log(self, subsession_id=None, simsession_number=0, export=False, result_file=None, max_workers=None,
+                         stream=False, lazy=False):
         """
         Returns a dictionary of the lap data for the given sub session id
         :link https://members-ng.iracing.com/data/results/event_log
@@ -572,6 +1199,9 @@ class iRacingClient():
         :param simsession_number: (number) The main event is 0; the preceding event is -1, and so on.
         :param export: boolean should the file be exported to JSON
         :param result_file: string
+        :param max_workers: int parallel chunk downloads for this call.
+        :param stream: boolean return a generator that parses the chunks one record at a time.
+        :param lazy: boolean return a chunkedResult that downloads each chunk only when it is read.
         :return: dict All data retrieved is returned.
         """
         """"""
@@ -585,26 +1215,36 @@ class iRacingClient():
                 "simsession_number": simsession_number,
             }
 
-            raw_data = self._get_resource("/data/results/event_log", payload=payload)
+            if stream:
+                chunks = self._stream_chunked_resource("/data/results/event_log", payload=payload)
+            elif lazy:
+                chunks = self._lazy_chunked_resource("/data/results/event_log", payload=payload)
+            else:
+                chunks = self._get_chunked_resource("/data/results/event_log", payload=payload, max_workers=max_workers)
 
         except RuntimeError as e:
             print("Check Resource call", str(e))
             return None
 
         if export and result_file:
-            chunks = self._get_chunks(raw_data["chunk_info"])
-            self.rawToJson(result_file, chunks)
+            if stream:
+                return self.streamToJson(result_file, chunks)
+            self.rawToJson(result_file, chunks.load(max_workers) if lazy else chunks)
 
         return chunks
 
     # lap_chart_data
-    def result_lap_chart_data(self, subsession_id=None, simsession_number=0, export=False):
+    def result_lap_chart_data(self, subsession_id=None, simsession_number=0, export=False, max_workers=None, stream=False,
+                              lazy=False):
         """
         Returns a dictionary of the lap data for the given sub session id
         :link https://members-ng.iracing.com/data/results/lap_chart_data
         :param subsession_id: (number)
         :param simsession_number: (number) The main event is 0; the preceding event is -1, and so on.
         :param export: boolean should the file be exported to JSON
+        :param max_workers: int parallel chunk downloads for this call.
+        :param stream: boolean return a generator that parses the chunks one record at a time.
+        :param lazy: boolean return a chunkedResult that downloads each chunk only when it is read.
         :return: dict All data retrieved is returned.
         """
 
@@ -617,8 +1257,13 @@ class iRacingClient():
                 "simsession_number": simsession_number,
             }
 
-            raw_data = self._get_resource("/data/results/lap_chart_data", payload=payload)
-            self.printData(raw_data)
+            if stream:
+                chunks = self._stream_chunked_resource("/data/results/lap_chart_data", payload=payload)
+            elif lazy:
+                chunks = self._lazy_chunked_resource("/data/results/lap_chart_data", payload=payload)
+            else:
+                chunks = self._get_chunked_resource("/data/results/lap_chart_data", payload=payload, max_workers=max_workers)
+                self.printData(chunks)
 
         except RuntimeError as e:
             print("Check Resource call", str(e))
@@ -626,15 +1271,17 @@ class iRacingClient():
 
         if export:
             filename = "result_lap_chart_data_" + str(subsession_id) + ".json"
-            chunks = self._get_chunks(raw_data["chunk_info"])
-            self.rawToJson(filename, chunks)
+            if stream:
+                return self.streamToJson(filename, chunks)
+            self.rawToJson(filename, chunks.load(max_workers) if lazy else chunks)
 
         return chunks
 
         # dictionary of the event/incident data for the given sub session id.
 
     # lap_data
-    def result_lap_data(self, subsession_id=None, simsession_number=0, cust_id=None, team_id=None, export=False):
+    def result_lap_data(self, subsession_id=None, simsession_number=0, cust_id=None, team_id=None, export=False, max_workers=None,
+                        stream=False, lazy=False):
         """
         Returns a dictionary of the lap data for the given sub session id
         :link https://members-ng.iracing.com/data/results/lap_data
@@ -644,6 +1291,9 @@ class iRacingClient():
             If omitted for a team event then the laps driven by all the team's drivers will be included.
         :param team_id: (number) Required if the subsession was a team event.
         :param export: boolean should the file be exported to JSON
+        :param max_workers: int parallel chunk downloads for this call.
+        :param stream: boolean return a generator that parses the chunks one record at a time.
+        :param lazy: boolean return a chunkedResult that downloads each chunk only when it is read.
         :return: dict All data retrieved is returned.
         """
 
@@ -660,8 +1310,12 @@ class iRacingClient():
             else:
                 payload["cust_id"] = self.getCustID(cust_id)
 
-            raw_data = self._get_resource("/data/results/lap_data", payload=payload)
-            chunks = self._get_chunks(raw_data["chunk_info"])
+            if stream:
+                chunks = self._stream_chunked_resource("/data/results/lap_data", payload=payload)
+            elif lazy:
+                chunks = self._lazy_chunked_resource("/data/results/lap_data", payload=payload)
+            else:
+                chunks = self._get_chunked_resource("/data/results/lap_data", payload=payload, max_workers=max_workers)
 
         except RuntimeError as e:
             print("Check Resource call", str(e))
@@ -669,14 +1323,17 @@ class iRacingClient():
 
         if export:
             filename = "result_lap_data_" + str(subsession_id) + ".json"
-            self.rawToJson(filename, chunks)
+            if stream:
+                return self.streamToJson(filename, chunks)
+            self.rawToJson(filename, chunks.load(max_workers) if lazy else chunks)
 
         return chunks
 
     # search_hosted
     def result_search_hosted(self, start_range_begin=None, start_range_end=None, finish_range_begin=None,
                              finish_range_end=None, cust_id=None, host_cust_id=None, session_name=None, league_id=None,
-                             league_season_id=None, car_id=None, track_id=None, category_ids=None, export=False):
+                             league_season_id=None, car_id=None, track_id=None, category_ids=None, export=False,
+                             max_workers=None):
 
         """
 
@@ -702,6 +1359,7 @@ class iRacingClient():
         :param track_id: number - The ID of the track used by the session.
         :param category_ids: numbers - Track categories to include in the search.  Defaults to all. ?category_ids=1,2,3,4
         :param export: boolean - export to json
+        :param max_workers: int - parallel chunk downloads for this call.
         :return:
         """
         try:
@@ -718,11 +1376,11 @@ class iRacingClient():
             params = locals()
             payload = {}
             for x in params.keys():
-                if x != "self" and params[x]:
+                if x not in ("self", "max_workers", "export", "tod", "d") and params[x]:
                     payload[x] = params[x]
 
-            raw_data = self._get_resource("/data/results/search_hosted", payload=payload)
-            chunks = self._get_chunks(raw_data["data"]["chunk_info"])
+            chunks = self._get_chunked_resource("/data/results/search_hosted", payload=payload,
+                                                max_workers=max_workers, info_keys=("data", "chunk_info"))
 
         except RuntimeError as e:
             print("Check Resource call", str(e))
@@ -734,6 +1392,124 @@ class iRacingClient():
 
         return chunks
 
+    # search_hosted over any range
+    def result_search_hosted_range(self, range_begin, range_end=None, by_finish=False, max_workers=None,
+                                   checkpoint_file=None, by_window=False, **filters):
+        """
+        Hosted and league sessions over a range longer than the 90 days a single search allows.
+        The range is split into windows that are searched concurrently, results come back in window order with any
+        subsession seen before skipped.  With a checkpoint file an interrupted search picks up after the last window
+        that was completed.  A window is completed once its rows have been handed back, or with by_window once the
+        caller says so, which a caller that stores the rows later, e.g. through an ingestPipeline, needs.
+        :param range_begin: datetime or ISO-8601 string - start of the range.
+        :param range_end: datetime or ISO-8601 string - end of the range, exclusive. Defaults to now.
+        :param by_finish: boolean - search on session finish times rather than start times.
+        :param max_workers: int - windows searched at once, defaults to search_workers.
+        :param checkpoint_file: string - file recording the progress of the search.
+        :param by_window: boolean - yield (rows, checkpoint) per window, calling checkpoint() completes the window.
+        :param filters: the other result_search_hosted parameters, e.g. host_cust_id, league_id.
+        :return: generator of result rows, or of (rows, checkpoint) with by_window.
+        """
+        prefix = "finish_range" if by_finish else "start_range"
+        range_begin = self._as_utc(range_begin)
+        range_end = self._as_utc(range_end) if range_end else datetime.datetime.now(datetime.timezone.utc)
+
+        checkpoint_key = json.dumps({"prefix": prefix, "filters": filters}, sort_keys=True, default=str)
+        resume = self._read_checkpoint(checkpoint_file, checkpoint_key)
+        if resume is not None and resume > range_begin:
+            self.printData("result_search_hosted_range - Resuming from " + resume.isoformat())
+            range_begin = resume
+
+        windows = self._search_windows(range_begin, range_end)
+        if not windows:
+            return
+
+        def search(window):
+            search_filters = dict(filters)
+            search_filters[prefix + "_begin"] = self._iso_minute(window[0])
+            search_filters[prefix + "_end"] = self._iso_minute(window[1])
+            # One chunk download per window keeps the calls in flight down to the number of windows.
+            results = self.result_search_hosted(max_workers=1, **search_filters)
+            if results is None:
+                raise RuntimeError("Search failed for window", search_filters[prefix + "_begin"])
+            return sorted(results, key=lambda x: x["subsession_id"])
+
+        # Only a few windows are held ahead of the consumer, so a long backfill stays light on memory.
+        workers = max(1, min(max_workers or self.search_workers, len(windows)))
+        search = self.carry_context(search)
+        seen = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = [executor.submit(search, window) for window in windows[:workers]]
+            try:
+                for idx, window in enumerate(windows):
+                    results = pending.pop(0).result()
+                    if idx + workers < len(windows):
+                        pending.append(executor.submit(search, windows[idx + workers]))
+
+                    rows = []
+                    for row in results:
+                        if row["subsession_id"] in seen:
+                            continue
+                        seen.add(row["subsession_id"])
+                        rows.append(row)
+
+                    checkpoint = functools.partial(self._write_checkpoint, checkpoint_file, checkpoint_key, window[1])
+                    if by_window:
+                        yield rows, checkpoint
+                    else:
+                        yield from rows
+                        checkpoint()
+            finally:
+                # Stopped early or a window failed, so the searches not yet started are dropped.
+                for future in pending:
+                    future.cancel()
+
+    def _as_utc(self, value):
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.astimezone(datetime.timezone.utc)
+
+    def _iso_minute(self, value):
+        """ Formats a datetime the way the search endpoints want it, 2022-04-01T15:45Z. """
+        return self._as_utc(value).strftime("%Y-%m-%dT%H:%MZ")
+
+    def _search_windows(self, range_begin, range_end):
+        """ Splits the range into whole minute windows no longer than search_window_days. """
+        begin = range_begin.replace(second=0, microsecond=0)
+        step = datetime.timedelta(days=self.search_window_days)
+        windows = []
+        while begin < range_end:
+            end = min(begin + step, range_end)
+            if end.second or end.microsecond:
+                end = end.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+            windows.append((begin, end))
+            begin = end
+        return windows
+
+    def _read_checkpoint(self, checkpoint_file, key):
+        if not checkpoint_file or not os.path.exists(checkpoint_file):
+            return None
+        try:
+            with open(checkpoint_file, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Unreadable checkpoint", checkpoint_file, e)
+            return None
+        # A checkpoint from a different search is ignored rather than skipping part of this one.
+        if checkpoint.get("key") != key:
+            return None
+        return self._as_utc(checkpoint["completed_until"])
+
+    def _write_checkpoint(self, checkpoint_file, key, completed_until):
+        if not checkpoint_file:
+            return
+        temp_file = checkpoint_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "completed_until": completed_until.isoformat()}, f)
+        os.replace(temp_file, checkpoint_file)
+
     # search_series
     """
         Official series. Maximum time frame of 90 days. Results split into one or more files with chunks of results. 
@@ -760,22 +1536,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            payload = {"season_year": season_year, "season_quarter": season_quarter}
-            raw_data = self._get_resource("/data/season/list", payload=payload)
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        except ConnectionError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            filename = "season_list_%d_%d.json" % (season_year, season_quarter)
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("get_season_list", export=export, season_year=season_year, season_quarter=season_quarter)
 
     # race_guide
 
@@ -790,16 +1551,7 @@ class iRacingClient():
         :param export: boolean - export to json
         :return: dictionary
         """
-        try:
-            raw_data = self._get_resource("/data/series/assets")
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('series_assets.json', raw_data)
-        return raw_data
+        return self.fetch("get_series_assets", export=export)
 
     # get
     def get_series(self, export=False):
@@ -809,16 +1561,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            raw_data = self._get_resource("/data/series/get")
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('series.json', raw_data)
-        return raw_data
+        return self.fetch("get_series", export=export)
 
     # past_seasons
 
@@ -831,21 +1574,7 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        try:
-            payload = {"include_series": include_series}
-            raw_data = self._get_resource("/data/series/seasons", payload=payload)
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        except ConnectionError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('series_seasons.json', raw_data)
-        return raw_data
+        return self.fetch("series_seasons", export=export, include_series=include_series)
 
     # stats_series
 
@@ -865,40 +1594,16 @@ class iRacingClient():
         :param export: boolean should the file be exported to JSON
         :return: dict All data retrieved is returned.
         """
-        """ """
-
         cust_id = self.getCustID(cust_id)
-        try:
-            payload = {"cust_id": cust_id}
-            raw_data = self._get_resource("/data/stats/member_career", payload=payload)
-
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
-
-        if export:
-            filename = "member_stats_career_" + str(cust_id) + ".json"
-            self.rawToJson(filename, raw_data['stats'])
-        return raw_data
+        return self.fetch("stats_member_career", export=export, cust_id=cust_id)
 
     # member_division
 
     # recent_races
     def member_recent_races(self, cust_id=None, export=False):
         """ Returns a summary dictionary of the member stats for each year category."""
-
         cust_id = self.getCustID(cust_id)
-        try:
-            payload = {"cust_id": cust_id}
-            raw_data = self._get_resource("/data/stats/member_recent_races", payload=payload)
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
-
-        if export:
-            filename = "member_recent_races_" + str(cust_id) + ".json"
-            self.rawToJson(filename, raw_data['races'])
-        return raw_data
+        return self.fetch("member_recent_races", export=export, cust_id=cust_id)
 
     # member_summary
     def stats_member_summary(self, cust_id=None, export=False):
@@ -907,36 +1612,13 @@ class iRacingClient():
         :returns dictionary {'this_year': {'num_official_sessions': x, 'num_league_sessions': x, 'num_official_wins': x, 'num_league_wins': x}, 'cust_id': cust_id}
         """
         cust_id = self.getCustID(cust_id)
-        try:
-            payload = {"cust_id": cust_id}
-            raw_data = self._get_resource("/data/stats/member_summary", payload=payload)
-
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
-
-        if export:
-            filename = "member_stats_summary_" + str(cust_id) + ".json"
-            self.rawToJson(filename, raw_data)
-        return raw_data
+        return self.fetch("stats_member_summary", export=export, cust_id=cust_id)
 
     # member_yearly
     def stats_member_yearly(self, cust_id=None, export=False):
         """ Returns a summary dictionary of the member stats for each year category."""
-
         cust_id = self.getCustID(cust_id)
-        try:
-            payload = {"cust_id": cust_id}
-            raw_data = self._get_resource("/data/stats/member_yearly", payload=payload)
-
-        except RuntimeError as e:
-            print("Check User ID")
-            return None
-
-        if export:
-            filename = "member_stats_yearly_" + str(cust_id) + ".json"
-            self.rawToJson(filename, raw_data['stats'])
-        return raw_data
+        return self.fetch("stats_member_yearly", export=export, cust_id=cust_id)
 
     # season_driver_standings
 
@@ -971,16 +1653,7 @@ class iRacingClient():
         :param export: boolean - export to json
         :return: dictionary
         """
-        try:
-            raw_data = self._get_resource("/data/track/assets")
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('track_assets.json', raw_data)
-        return raw_data
+        return self.fetch("get_track_assets", export=export)
 
     # get
     def get_tracks(self, export=False):
@@ -990,15 +1663,8 @@ class iRacingClient():
         :param export: boolean export to json.
         :return:
         """
-        try:
-            raw_data = self._get_resource("/data/track/get")
+        raw_data = self.fetch("get_tracks", export=export)
+        if raw_data is not None:
             self.get_track_assets(export)
-
-        except RuntimeError as e:
-            print("Check Resource call", str(e))
-            return None
-
-        if export:
-            self.rawToJson('track_get.json', raw_data)
         return raw_data
 
@@ -0,0 +1,160 @@
+"""
+Process wide pool of logged in iRacingClients.
+
+Every view builds a fresh irstatsDataClient, so without the pool each one pays for an /auth POST before its first
+API call.  The pool hands back the same client, and with it the same requests.Session and cookie jar, for an
+account and cust_id pair.  Cookies are saved through the LWPCookieJar support in iRacingClient._login so a
+restarted worker can pick the session straight back up.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from includes.apiMetrics import apiMetrics
+from includes.archiveStore import archiveStore
+from includes.circuitBreaker import circuitBreaker
+from includes.iRacingClient import iRacingClient
+from includes.rateLimiter import rateLimiter
+from includes.responseCache import responseCache
+from includes.singleFlight import singleFlight
+
+
+class iRacingClientPool():
+
+    _clients = {}
+    _cache = None
+    _limiter = None
+    _flights = None
+    _archive = None
+    _metrics = None
+    _breaker = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def getCache(cls, cache_folder=None, max_bytes=256 * 1024 * 1024, max_memory_bytes=32 * 1024 * 1024):
+        """ Returns the response cache shared by every pooled client, creating it on first use. """
+        with cls._lock:
+            if cls._cache is None:
+                cls._cache = responseCache(_cache_folder=cache_folder, _max_bytes=max_bytes,
+                                           _max_memory_bytes=max_memory_bytes)
+            return cls._cache
+
+    @classmethod
+    def getLimiter(cls):
+        """ Returns the rate limiter shared by every pooled client. They all draw on the same account budget. """
+        with cls._lock:
+            if cls._limiter is None:
+                cls._limiter = rateLimiter()
+            return cls._limiter
+
+    @classmethod
+    def getFlights(cls, lock_folder=None):
+        """ Returns the in-flight request tracker shared by every pooled client, so they share identical calls too.
+        :param lock_folder: string folder for the lock files that extend this across processes, None for in process
+        """
+        with cls._lock:
+            if cls._flights is None:
+                cls._flights = singleFlight(_lock_folder=lock_folder)
+            return cls._flights
+
+    @classmethod
+    def getArchive(cls, path=None, legacy_folder=None, max_bytes=None, ttls=None, keep=()):
+        """ Returns the archive store shared by every pooled client and the data client.
+        :param path: string SQLite file for the archive, None to keep plain JSON files
+        :param legacy_folder: string folder of the JSON files written before the archive
+        :param max_bytes: int size budget for the archive, None for no limit
+        :param ttls: dict of kind: seconds entries of that kind are kept
+        :param keep: list of kinds that are never evicted
+        """
+        with cls._lock:
+            if cls._archive is None:
+                cls._archive = archiveStore(_path=path, _legacy_folder=legacy_folder, _max_bytes=max_bytes,
+                                            _ttls=ttls, _keep=keep)
+            return cls._archive
+
+    @classmethod
+    def getMetrics(cls):
+        """ Returns the metrics every pooled client and the page middleware record to, shown on /metrics. """
+        with cls._lock:
+            if cls._metrics is None:
+                cls._metrics = apiMetrics()
+            return cls._metrics
+
+    @classmethod
+    def getBreaker(cls, failure_threshold=5, open_seconds=30):
+        """ Returns the circuit breaker shared by every pooled client, so one failing view backs them all off.
+        :param failure_threshold: int failures in a row that open the circuit
+        :param open_seconds: float seconds the circuit stays open before a probe
+        """
+        with cls._lock:
+            if cls._breaker is None:
+                cls._breaker = circuitBreaker(_failure_threshold=failure_threshold, _open_seconds=open_seconds)
+            return cls._breaker
+
+    @classmethod
+    def getClient(cls, username, password, cust_id, hive_root=None, files_folder=None, cookie_folder=None, cache=None,
+                  limiter=None, flights=None, archive=None, metrics=None, base_url=None, breaker=None):
+        """ Returns the shared client for the account and cust_id, creating and warming it if required.
+        :param username: string iRacing login
+        :param password: string iRacing password
+        :param cust_id: number default cust_id for the client's calls
+        :param hive_root: string root folder for exports
+        :param files_folder: string export folder inside hive_root
+        :param cookie_folder: string folder for the saved cookie jars, None disables persistence
+        :param cache: responseCache shared response cache, None disables caching
+        :param limiter: rateLimiter shared request scheduler, None disables rate limiting
+        :param flights: singleFlight shared in-flight request tracker, None gives the client its own
+        :param archive: archiveStore for exports, None writes JSON files to files_folder
+        :param metrics: apiMetrics shared metrics, None gives the client its own
+        :param base_url: string data API to call, None for members-ng
+        :param breaker: circuitBreaker shared circuit breaker, None gives the client its own
+        :return: iRacingClient
+        """
+        key = (username, str(cust_id), base_url)
+        with cls._lock:
+            client = cls._clients.get(key)
+
+            # A changed password in settings means the old session is no longer ours to reuse.
+            if client is not None and client.encoded_password != client._encode_password(username, password):
+                client = None
+
+            if client is None:
+                cookie_file = cls.cookieFile(cookie_folder, username, cust_id)
+                client = iRacingClient(username, password, cust_id, hive_root, files_folder, _cookie_file=cookie_file,
+                                       _cache=cache, _limiter=limiter, _flights=flights,
+                                       _archive=archive, _metrics=metrics, _base_url=base_url,
+                                       _breaker=breaker)
+                if client.restore_session():
+                    client.printData("Restored iRacing session from " + cookie_file)
+                cls._clients[key] = client
+
+            return client
+
+    @classmethod
+    def stats(cls):
+        """ Returns the stats of the shared cache, limiter, in-flight tracker and archive, those that exist. """
+        stats = {"clients": {"pooled": len(cls._clients)}}
+        for name, shared in (("cache", cls._cache), ("limiter", cls._limiter), ("flights", cls._flights),
+                             ("breaker", cls._breaker)):
+            if shared is not None:
+                stats[name] = shared.stats()
+        if cls._archive is not None:
+            report = cls._archive.report()
+            stats["archive"] = {"entries": report["entries"], "bytes": report["bytes"], "evicted": report["evicted"],
+                                "expired": report["expired"]}
+        return stats
+
+    @classmethod
+    def cookieFile(cls, cookie_folder, username, cust_id):
+        if not cookie_folder:
+            return None
+        Path(cookie_folder).mkdir(parents=True, exist_ok=True)
+        account = hashlib.sha1(username.lower().encode('utf-8')).hexdigest()[:12]
+        return os.path.join(cookie_folder, "cookies_%s_%s.txt" % (account, cust_id))
+
+    @classmethod
+    def clear(cls):
+        """ Drops every pooled client, forcing a fresh login on next use. """
+        with cls._lock:
+            cls._clients = {}
@@ -0,0 +1,115 @@
+"""
+Producer/consumer pipeline for ingesting iRacing data.
+
+The producer (usually a streaming iRacingClient call) runs in a background thread and hands batches of records to a
+bounded queue while the calling thread drains it and writes to the database.  Downloads and inserts overlap instead of
+adding up, and the bounded queue stops a fast download from piling up in memory ahead of a slow writer.  Database
+work stays on the calling thread because Django connections are per thread.
+"""
+import queue
+import threading
+import time
+
+
+class ingestPipeline():
+
+    _DONE = object()
+
+    def __init__(self, _queue_size=4, _batch_size=500, _name="ingest"):
+        """
+        :param _queue_size: int batches buffered between producer and consumer
+        :param _batch_size: int records per batch handed to the consumer
+        :param _name: string label used when printing the stats
+        """
+        self.queue_size = _queue_size
+        self.batch_size = _batch_size
+        self.name = _name
+        self._stats = {}
+
+    def run(self, producer, consumer, wrap=None):
+        """ Runs the producer in a background thread and feeds its records to the consumer in batches.
+        :param producer: iterable of records, iterated in the background thread
+        :param consumer: callable taking a list of records, called on this thread
+        :param wrap: callable that wraps the producer thread's function, e.g. iRacingClient.carry_context
+        :return: dict the stage counters, see stats()
+        """
+        batches = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        self._stats = {
+            "produced": 0, "produce_seconds": 0.0, "produce_blocked_seconds": 0.0,
+            "consumed": 0, "consume_seconds": 0.0, "consume_waiting_seconds": 0.0,
+            "batches": 0, "elapsed_seconds": 0.0,
+        }
+
+        def put(item):
+            # Blocks while the queue is full but gives up if the consumer has failed.
+            start = time.monotonic()
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            self._stats["produce_blocked_seconds"] += time.monotonic() - start
+
+        def produce():
+            started = time.monotonic()
+            batch = []
+            try:
+                for record in producer:
+                    if stop.is_set():
+                        return
+                    batch.append(record)
+                    self._stats["produced"] += 1
+                    if len(batch) >= self.batch_size:
+                        put(batch)
+                        batch = []
+                if batch:
+                    put(batch)
+                put(self._DONE)
+            except Exception as e:
+                put(e)
+            finally:
+                self._stats["produce_seconds"] = time.monotonic() - started - self._stats["produce_blocked_seconds"]
+
+        worker = threading.Thread(target=wrap(produce) if wrap else produce, name=self.name + "-producer", daemon=True)
+        started = time.monotonic()
+        worker.start()
+
+        try:
+            while True:
+                wait_start = time.monotonic()
+                item = batches.get()
+                self._stats["consume_waiting_seconds"] += time.monotonic() - wait_start
+
+                if item is self._DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                consume_start = time.monotonic()
+                consumer(item)
+                self._stats["consume_seconds"] += time.monotonic() - consume_start
+                self._stats["consumed"] += len(item)
+                self._stats["batches"] += 1
+        finally:
+            stop.set()
+            worker.join()
+            self._stats["elapsed_seconds"] = time.monotonic() - started
+
+        return self.stats()
+
+    def stats(self):
+        """ Returns the counters for each stage with records per second worked out for each. """
+        stats = dict(self._stats)
+        stats["produce_rate"] = stats["produced"] / stats["produce_seconds"] if stats.get("produce_seconds") else 0.0
+        stats["consume_rate"] = stats["consumed"] / stats["consume_seconds"] if stats.get("consume_seconds") else 0.0
+        stats["overall_rate"] = stats["consumed"] / stats["elapsed_seconds"] if stats.get("elapsed_seconds") else 0.0
+        return stats
+
+    def printStats(self):
+        stats = self.stats()
+        print("%s: %d records in %.2fs | fetch %.1f/s (blocked %.2fs) | write %.1f/s (waiting %.2fs)" % (
+            self.name, stats["consumed"], stats["elapsed_seconds"],
+            stats["produce_rate"], stats["produce_blocked_seconds"],
+            stats["consume_rate"], stats["consume_waiting_seconds"]))
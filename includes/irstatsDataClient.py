@@ -1,13 +1,26 @@
 from django.conf import settings
+from django.db import transaction
 
-from pathlib import Path
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+import datetime
 import os
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
 
+from includes.archiveStore import archiveStore
+from includes.bulkUpsert import bulkUpsert
+from includes.ingestPipeline import ingestPipeline
+from includes.referenceMaps import referenceMaps
 from includes.scoringClient import scoringClient
-from includes.iRacingClient import iRacingClient
-from irstats.models import Member, Career, Category, Tracks, Cars, Series, Races, Laps, Leagues, LeagueSeasons
+from includes.iRacingClientPool import iRacingClientPool
+from irstats.models import Update, Member, Career, Category, Tracks, Cars, Series, Races, Laps, FieldLapEntries
+from irstats.models import Leagues, LeagueSeasons
 from irstats.models import LeagueRoster, LeagueSessions, LeaguePoints, LeagueSessionResults
+from irstats.models import HostedResultWatermark, HostedResults
 
 
 class irstatsDataClient():
@@ -15,14 +28,69 @@ class irstatsDataClient():
     irclient = None
     cust_id = None
 
-    def __init__(self, request):
+    # Licence fields stored for each of the first four categories on the roster.
+    roster_license_fields = ['license_level', 'irating', 'safety_rating', 'cpi', 'mpr_num_races', 'tt_rating',
+                             'mpr_num_tts', 'group_id']
+
+    # Reference data refreshed by warmReferenceData, the Update type and the endpoints fetched for each.
+    reference_data = {
+        "Cars": {"data": "get_cars", "assets": "get_cars_assets", "classes": "get_carclass"},
+        "Tracks": {"data": "get_tracks", "assets": "get_track_assets"},
+        "Series": {"data": "get_series", "assets": "get_series_assets"},
+    }
+
+    def __init__(self, request=None, custid=None):
+
+        # Get the iRacing Customer ID of the logged in user, background jobs have no request and pass it in.
+        if request is not None:
+            current_user = request.user
+            self.custid = current_user.custid.custid
+        else:
+            self.custid = custid
+
+        # Get the shared, already logged in irclient for the iracing api calls.
+        # Identical requests from other workers wait on lock files next to the disk cache they share.
+        cookie_folder = self.settingsFolder('COOKIE_FOLDER')
+        cache_folder = self.settingsFolder('API_CACHE_FOLDER')
+        cache = iRacingClientPool.getCache(cache_folder, getattr(settings, 'API_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+                                           getattr(settings, 'API_CACHE_MEMORY_BYTES', 32 * 1024 * 1024))
+        flights = iRacingClientPool.getFlights(os.path.join(cache_folder, 'inflight') if cache_folder else None)
+
+        # Exported data lives in the compressed archive, the JSON files from before it are still read.
+        self.archive = iRacingClientPool.getArchive(self.settingsFolder('ARCHIVE_DATABASE'),
+                                                    os.path.join(settings.BASE_DIR, settings.FILE_FOLDER),
+                                                    getattr(settings, 'ARCHIVE_MAX_BYTES', None),
+                                                    getattr(settings, 'ARCHIVE_TTLS', None),
+                                                    getattr(settings, 'ARCHIVE_KEEP', ()))
+        self.irclient = iRacingClientPool.getClient(settings.USERNAME, settings.PASSWORD, self.custid,
+                                                    settings.BASE_DIR, settings.FILE_FOLDER, cookie_folder, cache,
+                                                    iRacingClientPool.getLimiter(), flights, self.archive,
+                                                    iRacingClientPool.getMetrics(),
+                                                    getattr(settings, 'IRACING_API_URL', None), self.apiBreaker())
 
-        # Get the iRacing Customer ID of the logged in user
-        current_user = request.user
-        self.custid = current_user.custid.custid
+    @staticmethod
+    def apiBreaker():
+        """ The circuit breaker shared by every client, set up from the API_BREAKER settings. """
+        return iRacingClientPool.getBreaker(getattr(settings, 'API_BREAKER_FAILURES', 5),
+                                            getattr(settings, 'API_BREAKER_OPEN_SECONDS', 30))
 
-        # Create a irclient for the iracing api call.
-        self.irclient = iRacingClient(settings.USERNAME, settings.PASSWORD, self.custid, settings.BASE_DIR, settings.FILE_FOLDER)
+    @staticmethod
+    def apiAvailable():
+        """ False while iRacing is failing and the circuit is open, views then serve what is in the database. """
+        return irstatsDataClient.apiBreaker().available()
+
+    def settingsFolder(self, name):
+        """ Returns the optional folder setting as a full path or None if it is not configured. """
+        folder = getattr(settings, name, None)
+        if folder:
+            return os.path.join(settings.BASE_DIR, folder)
+        return None
+
+    def deadline(self, seconds=None):
+        """ Bounds the iRacing calls made inside the with block, by default to settings.API_DEADLINE seconds. """
+        if seconds is None:
+            seconds = getattr(settings, 'API_DEADLINE', None)
+        return self.irclient.deadline(seconds)
 
     def printRawData(self, title, raw_data):
         if raw_data is not None:
@@ -32,71 +100,158 @@ class irstatsDataClient():
             print(title, "No Data Provided")
 
     def getJsonFile(self, file_name):
-        try:
-            file_path = os.path.join(settings.BASE_DIR, settings.FILE_FOLDER, file_name)
-            f = open(file_path, encoding='utf-8')
-            return json.load(f)
-        except FileNotFoundError as e:
-            print("getJsonFile", e)
-        return None
+        """ Reads an exported payload by its export file name, e.g. result_123.json, from the archive. """
+        kind, id = archiveStore.splitName(file_name)
+        raw_data = self.archive.get(kind, id)
+        if raw_data is None:
+            print("getJsonFile - Not archived", file_name)
+        return raw_data
 
     ##### GENERAL FUNCTIONS #####
-    def updateCars(self, _export=False):
-        """ Updates the cars database table """
-        cars = self.irclient.get_cars(export=_export)
+
+    def warmReferenceData(self, force=False):
+        """ Fetches the cars, tracks and series along with their assets all at once, stores them and marks them fresh
+        so the views find nothing to update.  Run by the warmup command and, with WARMUP_ON_STARTUP, at start up.
+        :param force: boolean refresh even the data that is not due an update
+        :return: dict of Update type: the sync's diff summary, see syncDiff, None where the fetch failed
+        """
+        types = [x for x in self.reference_data if force or self.isUpdateDue(x)]
+        if not types:
+            print("warmReferenceData - Nothing due an update")
+            return {}
+
+        calls = {}
+        for type in types:
+            for part, name in self.reference_data[type].items():
+                calls[(type, part)] = (name, {"export": True})
+
+        with self.irclient.background():
+            data = self.irclient.fetch_many(calls, max_workers=len(calls))
+
+        updaters = {"Cars": self.updateCars, "Tracks": self.updateTracks, "Series": self.updateSeries}
+        summary = {}
+        for type in types:
+            raw_data = data[(type, "data")]
+            if raw_data is None or any(data[(type, part)] is None for part in self.reference_data[type]):
+                summary[type] = None
+                continue
+            summary[type] = updaters[type](True, raw_data) if type in updaters else {"rows": len(raw_data)}
+            self.markUpdated(type)
+
+        print("warmReferenceData", summary)
+        return summary
+
+    def syncDiff(self, name, upserted, hidden=None):
+        """ Prints what a reference data sync changed and returns the counts.
+        :param name: string the sync function, used in the message
+        :param upserted: dict returned by bulkUpsert.run
+        :param hidden: list ids hidden because they are no longer listed
+        :return: dict inserted, updated, unchanged, and hidden when given
+        """
+        diff = {"inserted": upserted['inserted'], "updated": upserted['updated'], "unchanged": upserted['unchanged']}
+        message = "%s - %d inserted, %d updated, %d unchanged" % (name, diff['inserted'], diff['updated'],
+                                                                   diff['unchanged'])
+        if hidden is not None:
+            diff['hidden'] = len(hidden)
+            message += ", %d hidden" % diff['hidden']
+        print(message, "in %.2fs" % upserted['seconds'])
+        for label, keys in (("inserted", upserted['inserted_keys']), ("updated", upserted['updated_keys']),
+                            ("hidden", hidden or [])):
+            if keys:
+                ids = [x[0] if isinstance(x, tuple) else x for x in keys]
+                print("%s - %s %s%s" % (name, label, ids[:20], " ..." if len(ids) > 20 else ""))
+        return diff
+
+    def isUpdateDue(self, type):
+        """ True if the Update record for the type says the data is stale, or there is no record to say otherwise. """
+        type_update = Update.objects.filter(type=type).first()
+        if type_update is None or type_update.last_update is None:
+            return True
+        return (timezone.now() - type_update.last_update).total_seconds() > type_update.interval
+
+    def markUpdated(self, type):
+        """ Records a refresh in the Update table the way checkUpdateInterval does. """
+        type_update = Update.objects.filter(type=type).first()
+        if type_update is None:
+            return
+        type_update.last_update = timezone.now()
+        type_update.next_update = type_update.last_update + datetime.timedelta(seconds=type_update.interval)
+        type_update.save()
+
+    def updateCars(self, _export=False, raw_data=None):
+        """ Updates the cars database table, from raw_data when the caller has already fetched it """
+        cars = raw_data if raw_data is not None else self.irclient.get_cars(export=_export)
+        if cars is None:
+            print("updateCars - No data from iRacing, keeping the stored cars")
+            return
+        rows = []
         for car in cars:
             try:
                 if car.get("forum_url") is None:
                     car['forum_url'] = ""
                 if car.get("price_display") is None:
                     car['price_display'] = ""
-                new_car, created = Cars.objects.update_or_create(
-                    car_id=car['car_id'],
-                    defaults={
-                        "ai_enabled": car['ai_enabled'],
-                        "allow_number_colors": car['allow_number_colors'],
-                        "allow_number_font": car['allow_number_font'],
-                        "allow_sponsor1": car['allow_sponsor1'],
-                        "allow_sponsor2": car['allow_sponsor2'],
-                        "allow_wheel_color": car['allow_wheel_color'],
-                        "award_exempt": car['award_exempt'],
-                        "car_dirpath": car['car_dirpath'],
-                        "car_id": car['car_id'],
-                        "car_name": car['car_name'],
-                        "car_name_abbreviated": car['car_name_abbreviated'],
-                        "car_types": car['car_types'],
-                        "car_weight": car['car_weight'],
-                        "categories": car['categories'],
-                        "created": car['created'],
-                        "first_sale": car['first_sale'],
-                        "forum_url": car['forum_url'],
-                        "free_with_subscription": car['free_with_subscription'],
-                        "has_headlights": car['has_headlights'],
-                        "has_multiple_dry_tire_types": car['has_multiple_dry_tire_types'],
-                        "hp": car['hp'],
-                        "is_ps_purchasable": car['is_ps_purchasable'],
-                        "max_power_adjust_pct": car['max_power_adjust_pct'],
-                        "max_weight_penalty_kg": car['max_weight_penalty_kg'],
-                        "min_power_adjust_pct": car['min_power_adjust_pct'],
-                        "package_id": car['package_id'],
-                        "price": car['price'],
-                        "price_display": car['price_display'],
-                        "retired": car['retired'],
-                        "search_filters": car['search_filters'],
-                        "sku": car['sku'],
-                    }
-                )
+                rows.append({
+                    "ai_enabled": car['ai_enabled'],
+                    "allow_number_colors": car['allow_number_colors'],
+                    "allow_number_font": car['allow_number_font'],
+                    "allow_sponsor1": car['allow_sponsor1'],
+                    "allow_sponsor2": car['allow_sponsor2'],
+                    "allow_wheel_color": car['allow_wheel_color'],
+                    "award_exempt": car['award_exempt'],
+                    "car_dirpath": car['car_dirpath'],
+                    "car_id": car['car_id'],
+                    "car_name": car['car_name'],
+                    "car_name_abbreviated": car['car_name_abbreviated'],
+                    "car_types": car['car_types'],
+                    "car_weight": car['car_weight'],
+                    "categories": car['categories'],
+                    "created": car['created'],
+                    "first_sale": car['first_sale'],
+                    "forum_url": car['forum_url'],
+                    "free_with_subscription": car['free_with_subscription'],
+                    "has_headlights": car['has_headlights'],
+                    "has_multiple_dry_tire_types": car['has_multiple_dry_tire_types'],
+                    "hp": car['hp'],
+                    "is_ps_purchasable": car['is_ps_purchasable'],
+                    "max_power_adjust_pct": car['max_power_adjust_pct'],
+                    "max_weight_penalty_kg": car['max_weight_penalty_kg'],
+                    "min_power_adjust_pct": car['min_power_adjust_pct'],
+                    "package_id": car['package_id'],
+                    "price": car['price'],
+                    "price_display": car['price_display'],
+                    "retired": car['retired'],
+                    "search_filters": car['search_filters'],
+                    "sku": car['sku'],
+                })
             except KeyError as ke:
                 print("updateCars: Missing Keys", ke)
 
-        self.irclient.get_cars_assets(_export)
+        upserted = bulkUpsert(Cars, ['car_id'], _hash_field='content_hash').run(rows)
+        diff = self.syncDiff("updateCars", upserted)
+        if upserted['inserted'] or upserted['updated']:
+            referenceMaps.invalidate("Cars")
+
+        if raw_data is None:
+            self.irclient.get_cars_assets(_export)
+        return diff
 
     def updateMember(self, _export=False):
         """ Updates the member's basics, career stats and recent races """
         try:
+            # All of the member's reads go out together rather than one after another.
+            params = {"export": _export}
+            data = self.irclient.fetch_many({
+                "info": ("member_info", params),
+                "summary": ("stats_member_summary", params),
+                "career": ("stats_member_career", params),
+                "yearly": ("stats_member_yearly", params),
+                "recent_races": ("member_recent_races", params),
+            })
+
             # Get basic member info
-            member_info = self.irclient.member_info(export=_export)
-            member_summary = self.irclient.stats_member_summary(export=_export)
+            member_info = data['info']
+            member_summary = data['summary']
             member_obj, created = Member.objects.update_or_create(
                 custid=member_info['cust_id'],
                 defaults={
@@ -108,14 +263,18 @@ class irstatsDataClient():
                     'num_official_sessions': member_summary['this_year']['num_official_sessions'],
                     'num_league_sessions': member_summary['this_year']['num_league_sessions'],
                     'num_official_wins': member_summary['this_year']['num_official_wins'],
-                    'num_league_wins': member_summary['this_year']['num_league_wins']
+                    'num_league_wins': member_summary['this_year']['num_league_wins'],
+                    'placeholder': False
                 }
             )
 
             # Get Member's Career in each category
-            careers = self.irclient.stats_member_career(export=_export)
+            refs = referenceMaps()
+            careers = data['career']
             for career in careers['stats']:
-                category = Category.objects.get(id=int(career['category_id']))
+                category = refs.get("Category", career['category_id'])
+                if category is None:
+                    continue
                 new_member_career, created = Career.objects.update_or_create(
                     member=member_obj,
                     category=category,
@@ -138,117 +297,176 @@ class irstatsDataClient():
                     }
                 )
 
-                # Get Member's Career in each category
-                careers = self.irclient.stats_member_yearly(export=_export)
-                for career in careers['stats']:
-                    category = Category.objects.get(id=int(career['category_id']))
-                    new_member_career, created = Career.objects.update_or_create(
-                        member=member_obj,
-                        category=category,
-                        year=career['year'],
-                        defaults={
-                            'starts': career['starts'],
-                            'wins': career['wins'],
-                            'top5': career['top5'],
-                            'poles': career['poles'],
-                            'avg_start_position': career['avg_start_position'],
-                            'avg_finish_position': career['avg_finish_position'],
-                            'laps': career['laps'],
-                            'laps_led': career['laps_led'],
-                            'avg_incidents': career['avg_incidents'],
-                            'avg_points': career['avg_points'],
-                            'win_percentage': career['win_percentage'],
-                            'top5_percentage': career['top5_percentage'],
-                            'laps_led_percentage': career['laps_led_percentage'],
-                            'total_club_points': career['total_club_points'],
-                        }
-                    )
-
-            # Update Recent Races
-            recent_races = self.irclient.member_recent_races(export=_export)
-            for race in recent_races['races']:
-                member = member_obj
-                track = Tracks.objects.get(track_id=int(race['track']['track_id']))
-                car = Cars.objects.get(car_id=int(race['car_id']))
-                series = Series.objects.get(series_id=int(race['series_id']))
-
-                new_race, created = Races.objects.update_or_create(
-                    subsession_id=race['subsession_id'],
+            # Get Member's Career in each category for each year
+            careers = data['yearly']
+            for career in careers['stats']:
+                category = refs.get("Category", career['category_id'])
+                if category is None:
+                    continue
+                new_member_career, created = Career.objects.update_or_create(
+                    member=member_obj,
+                    category=category,
+                    year=career['year'],
                     defaults={
-                        'member': member,
-                        'track': track,
-                        'car': car,
-                        'series': series,
-                        'license_level': race['license_level'],
-                        'session_start_time': race['session_start_time'],
-                        'winner_group_id': race['winner_group_id'],
-                        'winner_name': race['winner_name'],
-                        'winner_license_level': race['winner_license_level'],
-                        'start_position': race['start_position'],
-                        'finish_position': race['finish_position'],
-                        'qualifying_time': race['qualifying_time'],
-                        'laps': race['laps'],
-                        'laps_led': race['laps_led'],
-                        'incidents': race['incidents'],
-                        'club_points': race['club_points'],
-                        'points': race['points'],
-                        'strength_of_field': race['strength_of_field'],
-                        'old_sub_level': race['old_sub_level'],
-                        'new_sub_level': race['new_sub_level'],
-                        'oldi_rating': race['oldi_rating'],
-                        'newi_rating': race['newi_rating']
+                        'starts': career['starts'],
+                        'wins': career['wins'],
+                        'top5': career['top5'],
+                        'poles': career['poles'],
+                        'avg_start_position': career['avg_start_position'],
+                        'avg_finish_position': career['avg_finish_position'],
+                        'laps': career['laps'],
+                        'laps_led': career['laps_led'],
+                        'avg_incidents': career['avg_incidents'],
+                        'avg_points': career['avg_points'],
+                        'win_percentage': career['win_percentage'],
+                        'top5_percentage': career['top5_percentage'],
+                        'laps_led_percentage': career['laps_led_percentage'],
+                        'total_club_points': career['total_club_points'],
                     }
                 )
 
-                #If the race has just been created then we also get the lap data.
-                if created:
-                    self.updateSessionResult(race['subsession_id'], True)
-                    self.updateSessionEventLog(race['subsession_id'], simsession_number=0, _export=True)
-                    self.updateSessionLapChartData(race['subsession_id'], True)
-                    self.updateSessionLapData(race['subsession_id'], _export)
+            if refs.missing().get("Category"):
+                print("updateMember - Unknown categories, skipped their careers", refs.missing()["Category"])
+
+            # Update Recent Races.  Races pointing at a track, car or series not stored yet are retried after syncing
+            # just that reference data.
+            recent_races = data['recent_races']
+            refs = referenceMaps()
+            unresolved = [race for race in recent_races['races']
+                          if not self.saveRecentRace(member_obj, race, refs, _export)]
+            if unresolved:
+                print("updateMember - Unknown reference ids", refs.missing())
+                self.refreshReferenceData(refs.missing())
+                refs = referenceMaps()
+                for race in unresolved:
+                    if not self.saveRecentRace(member_obj, race, refs, _export):
+                        print("updateMember - Skipping race", race['subsession_id'], refs.missing())
 
         except TypeError as e:
             print("updateMember - TypeError", e)
             return False
 
+    def saveRecentRace(self, member_obj, race, refs, _export=False):
+        """ Stores one of the member's recent races, and the session data for a race seen for the first time.
+        :param member_obj: Member the race belongs to
+        :param race: dict the race from member_recent_races
+        :param refs: referenceMaps the track, car and series are resolved from
+        :return: boolean False if the track, car or series is not stored
+        """
+        track = refs.get("Tracks", race['track']['track_id'])
+        car = refs.get("Cars", race['car_id'])
+        series = refs.get("Series", race['series_id'])
+        if track is None or car is None or series is None:
+            return False
+
+        new_race, created = Races.objects.update_or_create(
+            subsession_id=race['subsession_id'],
+            defaults={
+                'member': member_obj,
+                'track': track,
+                'car': car,
+                'series': series,
+                'license_level': race['license_level'],
+                'session_start_time': race['session_start_time'],
+                'winner_group_id': race['winner_group_id'],
+                'winner_name': race['winner_name'],
+                'winner_license_level': race['winner_license_level'],
+                'start_position': race['start_position'],
+                'finish_position': race['finish_position'],
+                'qualifying_time': race['qualifying_time'],
+                'laps': race['laps'],
+                'laps_led': race['laps_led'],
+                'incidents': race['incidents'],
+                'club_points': race['club_points'],
+                'points': race['points'],
+                'strength_of_field': race['strength_of_field'],
+                'old_sub_level': race['old_sub_level'],
+                'new_sub_level': race['new_sub_level'],
+                'oldi_rating': race['oldi_rating'],
+                'newi_rating': race['newi_rating']
+            }
+        )
+
+        #If the race has just been created then we also get the lap data.
+        #This is follow on sync work so it queues behind other users' page views.
+        if created:
+            with self.irclient.background():
+                self.updateSessionResult(race['subsession_id'], True)
+                self.updateSessionEventLog(race['subsession_id'], simsession_number=0, _export=True)
+                self.updateSessionLapChartData(race['subsession_id'], True)
+                self.updateSessionLapData(race['subsession_id'], _export)
+        return True
+
+    def refreshReferenceData(self, missing):
+        """ Syncs the reference data that ingested rows point at but is not stored yet, e.g. a car released since the
+        last Cars update, instead of waiting for its update interval.
+        :param missing: dict of Update type: ids, as returned by referenceMaps.missing
+        """
+        updaters = {"Cars": self.updateCars, "Tracks": self.updateTracks, "Series": self.updateSeries}
+        for type, ids in missing.items():
+            if type in updaters and referenceMaps.shouldRefresh(type, ids):
+                updaters[type](True)
+                self.markUpdated(type)
+
     def updateSeasons(self, season_year, season_quarter, _export=False):
         series = self.irclient.get_season_list(season_year, season_quarter, export=_export)
 
-    def updateSeries(self, _export=False):
+    def updateSeries(self, _export=False, raw_data=None):
 
-        Series.objects.all().update(show=False)
-        series = self.irclient.get_series(export=_export)
+        series = raw_data if raw_data is not None else self.irclient.get_series(export=_export)
+        if series is None:
+            print("updateSeries - No data from iRacing, keeping the stored series")
+            return
+        categories = Category.objects.in_bulk()
+        rows = []
         for serie in series:
             try:
                 if serie.get("forum_url") is None:
                     serie['forum_url'] = ""
 
-                category = Category.objects.get(id=serie['category_id'])
-                new_serie, created = Series.objects.update_or_create(
-                    series_id = serie['series_id'],
-                    defaults={
-                        "category": category,
-                        "eligible": serie['eligible'],
-                        "forum_url": serie['forum_url'],
-                        "max_starters": serie['max_starters'],
-                        "min_starters": serie['min_starters'],
-                        "oval_caution_type": serie['oval_caution_type'],
-                        "road_caution_type": serie['road_caution_type'],
-                        "series_name": serie['series_name'],
-                        "series_short_name": serie['series_short_name'],
-                        "allowed_licenses": serie['allowed_licenses'],
-                        "show": True
-                    }
-                )
+                rows.append({
+                    "series_id": serie['series_id'],
+                    "category": categories[serie['category_id']],
+                    "eligible": serie['eligible'],
+                    "forum_url": serie['forum_url'],
+                    "max_starters": serie['max_starters'],
+                    "min_starters": serie['min_starters'],
+                    "oval_caution_type": serie['oval_caution_type'],
+                    "road_caution_type": serie['road_caution_type'],
+                    "series_name": serie['series_name'],
+                    "series_short_name": serie['series_short_name'],
+                    "allowed_licenses": serie['allowed_licenses'],
+                    "show": True
+                })
             except KeyError as ke:
                 print("updateSeries: Missing Keys", ke)
 
-        self.irclient.get_series_assets(export=True)
+        # Only the series that have dropped off the list are hidden, the listed ones are stored with show set.
+        with transaction.atomic():
+            upserted = bulkUpsert(Series, ['series_id'], _hash_field='content_hash').run(rows)
+            listed = {x['series_id'] for x in rows}
+            shown = set(Series.objects.filter(show=True).values_list('series_id', flat=True))
+            dropped = shown - listed
+            if dropped:
+                # The hash covers show, so a series that comes back is written again.
+                Series.objects.filter(series_id__in=dropped).update(show=False, content_hash=None)
+        diff = self.syncDiff("updateSeries", upserted, hidden=sorted(dropped))
+        if upserted['inserted'] or upserted['updated'] or dropped:
+            referenceMaps.invalidate("Series")
+
+        if raw_data is None:
+            self.irclient.get_series_assets(export=True)
+        return diff
 
-    def updateTracks(self, _export=False):
-        """ Updates the tracks database table """
+    def updateTracks(self, _export=False, raw_data=None):
+        """ Updates the tracks database table, from raw_data when the caller has already fetched it """
 
-        tracks = self.irclient.get_tracks(export=_export)
+        tracks = raw_data if raw_data is not None else self.irclient.get_tracks(export=_export)
+        if tracks is None:
+            print("updateTracks - No data from iRacing, keeping the stored tracks")
+            return
+        categories = Category.objects.in_bulk()
+        rows = []
         for track in tracks:
             try:
                 if track.get("config_name") is None:
@@ -261,133 +479,297 @@ class irstatsDataClient():
                     track['pit_road_speed_limit'] = -1
                 if track.get("site_url") is None:
                     track['site_url'] = "Pending"
-                category = Category.objects.get(id=track['category_id'])
-                new_track, created = Tracks.objects.update_or_create(
-                    track_id=track['track_id'],
-                    defaults={
-                        "ai_enabled": track['ai_enabled'],
-                        "allow_pitlane_collisions": track['allow_pitlane_collisions'],
-                        "allow_rolling_start": track['allow_rolling_start'],
-                        "allow_standing_start": track['allow_standing_start'],
-                        "award_exempt": track['award_exempt'],
-                        "category": category,
-                        "closes": track['closes'],
-                        "config_name": track['config_name'],
-                        "corners_per_lap": track['corners_per_lap'],
-                        "created": track['created'],
-                        "first_sale": track['first_sale'],
-                        "free_with_subscription": track['free_with_subscription'],
-                        "fully_lit": track['fully_lit'],
-                        "grid_stalls": track['grid_stalls'],
-                        "has_opt_path": track['has_opt_path'],
-                        "has_short_parade_lap": track['has_short_parade_lap'],
-                        "has_start_zone": track['has_start_zone'],
-                        "has_svg_map": track['has_svg_map'],
-                        "is_dirt": track['is_dirt'],
-                        "is_oval": track['is_oval'],
-                        "is_ps_purchasable": track['is_ps_purchasable'],
-                        "lap_scoring": track['lap_scoring'],
-                        "latitude": track['latitude'],
-                        "location": track['location'],
-                        "longitude": track['longitude'],
-                        "max_cars": track['max_cars'],
-                        "night_lighting": track['night_lighting'],
-                        "nominal_lap_time": track['nominal_lap_time'],
-                        "number_pitstalls": track['number_pitstalls'],
-                        "opens": track['opens'],
-                        "package_id": track['package_id'],
-                        "pit_road_speed_limit": track['pit_road_speed_limit'],
-                        "price": track['price'],
-                        "price_display": track['price_display'],
-                        "priority": track['priority'],
-                        "purchasable": track['purchasable'],
-                        "qualify_laps": track['qualify_laps'],
-                        "restart_on_left": track['restart_on_left'],
-                        "retired": track['retired'],
-                        "search_filters": track['search_filters'],
-                        "site_url": track['site_url'],
-                        "sku": track['sku'],
-                        "solo_laps": track['solo_laps'],
-                        "start_on_left": track['start_on_left'],
-                        "supports_grip_compound": track['supports_grip_compound'],
-                        "tech_track": track['tech_track'],
-                        "time_zone": track['time_zone'],
-                        "track_config_length": track['track_config_length'],
-                        "track_dirpath": track['track_dirpath'],
-                        "track_name": track['track_name'],
-                        "track_types": track['track_types'],
-                    }
-                )
+                rows.append({
+                    "track_id": track['track_id'],
+                    "ai_enabled": track['ai_enabled'],
+                    "allow_pitlane_collisions": track['allow_pitlane_collisions'],
+                    "allow_rolling_start": track['allow_rolling_start'],
+                    "allow_standing_start": track['allow_standing_start'],
+                    "award_exempt": track['award_exempt'],
+                    "category": categories[track['category_id']],
+                    "closes": track['closes'],
+                    "config_name": track['config_name'],
+                    "corners_per_lap": track['corners_per_lap'],
+                    "created": track['created'],
+                    "first_sale": track['first_sale'],
+                    "free_with_subscription": track['free_with_subscription'],
+                    "fully_lit": track['fully_lit'],
+                    "grid_stalls": track['grid_stalls'],
+                    "has_opt_path": track['has_opt_path'],
+                    "has_short_parade_lap": track['has_short_parade_lap'],
+                    "has_start_zone": track['has_start_zone'],
+                    "has_svg_map": track['has_svg_map'],
+                    "is_dirt": track['is_dirt'],
+                    "is_oval": track['is_oval'],
+                    "is_ps_purchasable": track['is_ps_purchasable'],
+                    "lap_scoring": track['lap_scoring'],
+                    "latitude": track['latitude'],
+                    "location": track['location'],
+                    "longitude": track['longitude'],
+                    "max_cars": track['max_cars'],
+                    "night_lighting": track['night_lighting'],
+                    "nominal_lap_time": track['nominal_lap_time'],
+                    "number_pitstalls": track['number_pitstalls'],
+                    "opens": track['opens'],
+                    "package_id": track['package_id'],
+                    "pit_road_speed_limit": track['pit_road_speed_limit'],
+                    "price": track['price'],
+                    "price_display": track['price_display'],
+                    "priority": track['priority'],
+                    "purchasable": track['purchasable'],
+                    "qualify_laps": track['qualify_laps'],
+                    "restart_on_left": track['restart_on_left'],
+                    "retired": track['retired'],
+                    "search_filters": track['search_filters'],
+                    "site_url": track['site_url'],
+                    "sku": track['sku'],
+                    "solo_laps": track['solo_laps'],
+                    "start_on_left": track['start_on_left'],
+                    "supports_grip_compound": track['supports_grip_compound'],
+                    "tech_track": track['tech_track'],
+                    "time_zone": track['time_zone'],
+                    "track_config_length": track['track_config_length'],
+                    "track_dirpath": track['track_dirpath'],
+                    "track_name": track['track_name'],
+                    "track_types": track['track_types'],
+                })
             except KeyError as ke:
                 print(ke)
 
-        self.irclient.get_track_assets(export=True)
+        upserted = bulkUpsert(Tracks, ['track_id'], _hash_field='content_hash').run(rows)
+        diff = self.syncDiff("updateTracks", upserted)
+        if upserted['inserted'] or upserted['updated']:
+            referenceMaps.invalidate("Tracks")
+
+        if raw_data is None:
+            self.irclient.get_track_assets(export=True)
+        return diff
 
     ##### SESSION FUNCTIONS #####
 
     def updateSessionResult(self, subsession_id, _export=True):
-        result_file = Path(settings.BASE_DIR, settings.FILE_FOLDER, "result_" + str(subsession_id) + ".json")
-        if not result_file.is_file():
-            print("UpdateSessionResult - Getting Data for ", result_file)
+        raw_data = self.archive.get("result", subsession_id)
+        if raw_data is None:
+            print("UpdateSessionResult - Getting Data for ", subsession_id)
             raw_data = self.irclient.result(subsession_id, include_licenses=False, export=_export)
-        else:
-            raw_data = self.getJsonFile(result_file)
         return raw_data
 
     def updateSessionEventLog(self, subsession_id, simsession_number=0, _export=False):
+        """ The event log from the archive, or from iRacing. """
 
-        # Build the file path
+        # Build the archive key, simsessions other than the main event have their number appended.
         if simsession_number == 0:
-            result_file = Path(settings.BASE_DIR, settings.FILE_FOLDER,
-                               "result_event_log_" + str(subsession_id) + ".json")
+            result_id = str(subsession_id)
         else:
-            result_file = Path(settings.BASE_DIR, settings.FILE_FOLDER,
-                               "result_event_log_" + str(subsession_id) + str(simsession_number) + ".json")
+            result_id = str(subsession_id) + str(simsession_number)
 
-        if not result_file.is_file():
-            print("UpdateSessionEventLog - Getting Data for ", result_file)
-            raw_data = self.irclient.result_event_log(subsession_id=subsession_id, simsession_number=simsession_number, export=_export, result_file=result_file)
-        else:
-           raw_data = self.getJsonFile(result_file)
+        raw_data = self.archive.get("result_event_log", result_id)
+        if raw_data is None:
+            print("UpdateSessionEventLog - Getting Data for ", result_id)
+            result_file = archiveStore.fileName("result_event_log", result_id)
+            raw_data = self.irclient.result_event_log(subsession_id=subsession_id, simsession_number=simsession_number,
+                                                      export=_export, result_file=result_file)
         return raw_data
 
     def updateSessionLapChartData(self, subsession_id, _export=True):
-        result_file = Path(settings.BASE_DIR, settings.FILE_FOLDER, "result_lap_chart_data_" + str(subsession_id) + ".json")
-        if not result_file.is_file():
-            print("updateSessionLapChartData - Getting Data for ", result_file)
+        if not self.archive.exists("result_lap_chart_data", subsession_id):
+            print("updateSessionLapChartData - Getting Data for ", subsession_id)
             raw_data = self.irclient.result_lap_chart_data(subsession_id, export=_export)
 
     def updateSessionLapData(self, subsession_id, _export=False):
         """ updateLapData is used by updateMember.
         If a new race is created then we will also get the lap data. """
 
-        lap_data = self.irclient.result_lap_data(subsession_id, export=_export)
-        for lap in lap_data:
+        # The race and member are looked up once for all the laps, and before downloading anything.
+        race = Races.objects.filter(subsession_id=subsession_id).first()
+        member = Member.objects.filter(custid=self.custid).first()
+        if race is None or member is None:
+            print("updateSessionLapData - Race or member not stored", subsession_id, self.custid)
+            return
+
+        # Laps are parsed as they download and written in batches while the rest are still arriving.
+        lap_data = self.irclient.result_lap_data(subsession_id, export=_export, stream=True)
+        if lap_data is None:
+            return
+        totals = {"inserted": 0, "updated": 0}
+
+        def save(laps):
+            upserted = self.saveSessionLaps(subsession_id, laps, race, member)
+            totals["inserted"] += upserted["inserted"]
+            totals["updated"] += upserted["updated"]
+
+        # Each batch is committed as it is written, a transaction held open while chunks download would lock the
+        # SQLite database against every other writer until the last chunk arrived.
+        pipeline = ingestPipeline(_name="updateSessionLapData " + str(subsession_id))
+        try:
+            stats = pipeline.run(lap_data, save, wrap=self.irclient.carry_context)
+        except (RuntimeError, requests.RequestException) as e:
+            # The chunks are downloaded as the laps are read, so their failures and the deadline surface here.
+            # The batches already written are kept.
+            print("updateSessionLapData - Lap download failed", subsession_id, str(e))
+            return
+        pipeline.printStats()
+        print("updateSessionLapData - %d laps inserted, %d updated, %.0f rows/s" % (
+            totals["inserted"], totals["updated"], stats["overall_rate"]))
+
+    def saveSessionLaps(self, subsession_id, laps, race=None, member=None):
+        """ Stores a batch of laps, replacing any already stored for the same race, member and lap number.
+        :param subsession_id: int the race the laps are from
+        :param laps: list of laps from result_lap_data
+        :param race: Races of the subsession, looked up when not given
+        :param member: Member who drove the laps, looked up when not given
+        :return: dict inserted and updated counts, see bulkUpsert.run
+        """
+        if race is None:
+            race = Races.objects.get(subsession_id=subsession_id)
+        if member is None:
+            member = Member.objects.get(custid=self.custid)
+
+        rows = []
+        for lap in laps:
             try:
-                race = Races.objects.get(subsession_id=subsession_id)
-                member = Member.objects.get(custid=self.custid)
-                new_lap, created = Laps.objects.update_or_create(
-                    race=race,
-                    lap_number=lap['lap_number'],
-                    member=member,
-                    defaults={
-                        "group_id": lap['group_id'],
-                        "flags": lap['flags'],
-                        "incident": lap['incident'],
-                        "session_time": lap['session_time'],
-                        "session_start_time": lap['session_start_time'],
-                        "lap_time": lap['lap_time'],
-                        "team_fastest_lap": lap['team_fastest_lap'],
-                        "personal_best_lap": lap['personal_best_lap'],
-                        "license_level": lap['license_level'],
-                        "car_number": lap['car_number'],
-                        "lap_events": lap['lap_events'],
-                        "ai": lap['ai'],
-                    }
-                )
+                rows.append({
+                    "race": race,
+                    "member": member,
+                    "lap_number": lap['lap_number'],
+                    "group_id": lap['group_id'],
+                    "flags": lap['flags'],
+                    "incident": lap['incident'],
+                    "session_time": lap['session_time'],
+                    "session_start_time": lap['session_start_time'],
+                    "lap_time": lap['lap_time'],
+                    "team_fastest_lap": lap['team_fastest_lap'],
+                    "personal_best_lap": lap['personal_best_lap'],
+                    "license_level": lap['license_level'],
+                    "car_number": lap['car_number'],
+                    "lap_events": lap['lap_events'],
+                    "ai": lap['ai'],
+                })
             except KeyError as ke:
                 print("updateLaps: Missing Keys", ke)
 
+        return bulkUpsert(Laps, ['race', 'member', 'lap_number']).run(rows)
+
+    def updateSessionFieldLaps(self, subsession_id, max_workers=None):
+        """ Stores the laps of every driver in the race, not just the member's, so drivers can be compared with the
+        field.  The lap data is fetched per driver, or per team in team events, several at once within the rate limit.
+        Each entry fetched is recorded, with or without laps, and skipped after that, so running it again only fetches
+        what is missing.  It makes a call per car, so it is run by manage.py fieldlaps rather than from a page view.
+        :param subsession_id: int the race
+        :param max_workers: int lap data calls at once, defaults to settings.FIELD_LAPS_WORKERS
+        :return: dict drivers, fetched, skipped and failed entries, and the laps inserted and updated
+        """
+        race = Races.objects.filter(subsession_id=subsession_id).first()
+        if race is None:
+            print("updateSessionFieldLaps - Race not stored", subsession_id)
+            return None
+        result = self.updateSessionResult(subsession_id)
+        if result is None:
+            return None
+
+        # One entry per car in the main event, a team event lists the team's drivers under driver_results.
+        # Each entry is (team, team_id or cust_id, cust_ids of its drivers).
+        entries = []
+        drivers = {}
+        for session in result['session_results']:
+            if session['simsession_number'] != 0:
+                continue
+            for entry in session['results']:
+                if entry.get('driver_results'):
+                    team = [(x['cust_id'], x.get('display_name')) for x in entry['driver_results']]
+                    entries.append((True, entry['team_id'], [x[0] for x in team]))
+                else:
+                    team = [(entry['cust_id'], entry.get('display_name'))]
+                    entries.append((False, entry['cust_id'], [entry['cust_id']]))
+                drivers.update(team)
+
+        # Drivers the site has not seen are stored as placeholders with just their name so their laps have a member
+        # to point at.  The index view treats a placeholder as missing and reads the profile when that driver logs in.
+        Member.objects.bulk_create([Member(custid=k, display_name=v, placeholder=True) for k, v in drivers.items()],
+                                   ignore_conflicts=True)
+        members = {x.custid: x for x in Member.objects.filter(custid__in=list(drivers))}
+
+        # Entries fetched before they were recorded count as done when every driver has laps stored.
+        done = set(FieldLapEntries.objects.filter(race=race).values_list('team', 'entry_id'))
+        stored = set(Laps.objects.filter(race=race).values_list('member__custid', flat=True).distinct())
+        pending = [x for x in entries if x[:2] not in done and not set(x[2]) <= stored]
+        summary = {"drivers": len(drivers), "fetched": 0, "skipped": len(entries) - len(pending), "failed": 0,
+                   "inserted": 0, "updated": 0}
+        if not pending:
+            print("updateSessionFieldLaps - All laps stored for", subsession_id)
+            return summary
+
+        start = time.monotonic()
+        workers = max(1, min(max_workers or getattr(settings, 'FIELD_LAPS_WORKERS', 4), len(pending)))
+
+        def fetch(team, entry_id):
+            if team:
+                return self.irclient.result_lap_data(subsession_id, team_id=entry_id)
+            return self.irclient.result_lap_data(subsession_id, cust_id=entry_id)
+
+        fetch = self.irclient.carry_context(fetch)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch, team, entry_id): (team, entry_id, custids)
+                       for team, entry_id, custids in pending}
+            # The laps are written here as each call completes, database work stays on this thread.  Each entry is
+            # its own short transaction, so the write lock is never held while waiting on the other calls.
+            for future in as_completed(futures):
+                team, entry_id, custids = futures[future]
+                try:
+                    laps = future.result()
+                except (RuntimeError, requests.RequestException) as e:
+                    print("updateSessionFieldLaps - Lap data failed", subsession_id, entry_id, str(e))
+                    laps = None
+                if laps is None:
+                    summary["failed"] += 1
+                    continue
+                summary["fetched"] += 1
+                by_driver = {}
+                for lap in laps:
+                    by_driver.setdefault(lap.get('cust_id', custids[0]), []).append(lap)
+                with transaction.atomic():
+                    for custid, driver_laps in by_driver.items():
+                        if custid not in members:
+                            print("updateSessionFieldLaps - Laps for a driver not in the result", custid)
+                            continue
+                        upserted = self.saveSessionLaps(subsession_id, driver_laps, race, members[custid])
+                        summary["inserted"] += upserted["inserted"]
+                        summary["updated"] += upserted["updated"]
+                    FieldLapEntries.objects.get_or_create(race=race, team=team, entry_id=entry_id)
+
+        elapsed = time.monotonic() - start
+        rows = summary["inserted"] + summary["updated"]
+        print("updateSessionFieldLaps %s - %d of %d entries fetched, %d skipped, %d failed | %d laps in %.2fs, %.0f "
+              "rows/s" % (subsession_id, summary["fetched"], len(entries), summary["skipped"], summary["failed"], rows,
+                          elapsed, rows / elapsed if elapsed else 0))
+        return summary
+
+    def updateFieldLaps(self, subsession_ids=None, limit=None, max_workers=None):
+        """ Fills in the laps of the whole field for the stored races, newest first.  Races are checked against what
+        is stored rather than only when they are first seen, so entries that failed or ran out of time before are
+        fetched on the next run.
+        :param subsession_ids: list races to fill in, all the stored races by default
+        :param limit: int most races to check
+        :param max_workers: int lap data calls at once, see updateSessionFieldLaps
+        :return: dict totals of the summaries of updateSessionFieldLaps, and the races checked
+        """
+        races = Races.objects.order_by('-session_start_time')
+        if subsession_ids:
+            races = races.filter(subsession_id__in=subsession_ids)
+        subsession_ids = list(races.values_list('subsession_id', flat=True)[:limit])
+
+        totals = {"races": 0, "fetched": 0, "skipped": 0, "failed": 0, "inserted": 0, "updated": 0}
+        with self.irclient.background():
+            for subsession_id in subsession_ids:
+                summary = self.updateSessionFieldLaps(subsession_id, max_workers=max_workers)
+                totals["races"] += 1
+                if summary is None:
+                    totals["failed"] += 1
+                    continue
+                for name in ("fetched", "skipped", "failed", "inserted", "updated"):
+                    totals[name] += summary[name]
+        return totals
+
     def updateLapDataPostInsert(self, subsession_id):
         self.updateSessionResult(subsession_id, True)
         self.updateSessionEventLog(subsession_id, True)
@@ -399,6 +781,9 @@ class irstatsDataClient():
     # Called by Leagues View
     def updateLeagueRegister(self, _export=False):
         raw_data = self.irclient.get_league_directory(restrict_to_member=True, export=_export)
+        if raw_data is None:
+            print("updateLeagueRegister - No data from iRacing")
+            return
 
         for league in raw_data['results_page']:
             try:
@@ -426,65 +811,62 @@ class irstatsDataClient():
                 print("updateLeagueRegister: Missing Keys", ke)
 
     # Called by updateLeagueData 1
-    def updateLeagueRoster(self, league, _export=False):
-        raw_data = self.irclient.league_get(league.league_id, include_licenses=False, export=_export)
+    def updateLeagueRoster(self, league, _export=False, raw_data=None):
+        if raw_data is None:
+            raw_data = self.irclient.league_get(league.league_id, include_licenses=False, export=_export)
+        if raw_data is None:
+            return
+
+        # Licences for the whole roster come from batched member/get calls. Only drivers
+        # missing from those, or missing licence fields, cost a member_profile call each.
+        members = self.irclient.member_get_batch([driver['cust_id'] for driver in raw_data['roster']], include_licenses=True)
 
         for driver in raw_data['roster']:
-            driver_stats = self.irclient.member_profile(driver['cust_id'], export=_export)
+            licenses = self.rosterLicenses(members.get(driver['cust_id']))
+            if licenses is None:
+                driver_stats = self.irclient.member_profile(driver['cust_id'], export=_export)
+                licenses = self.rosterLicenses(driver_stats['member_info'] if driver_stats else None)
 
             try:
+                if licenses is None:
+                    raise KeyError("licenses for " + str(driver['cust_id']))
+                defaults = {
+                    "display_name": driver['display_name'],
+                    "owner": driver['owner'],
+                    "admin": driver['admin'],
+                    "league_mail_opt_out": driver['league_mail_opt_out'],
+                    "league_pm_opt_out": driver['league_pm_opt_out'],
+                    "league_member_since": driver['league_member_since'],
+                    "car_number": driver['car_number'],
+                    "nick_name": driver['nick_name'],
+                }
+                defaults.update(licenses)
                 new_roster, created = LeagueRoster.objects.update_or_create(
                     league=league,
                     cust_id=driver['cust_id'],
-                    defaults={
-                        "display_name": driver['display_name'],
-                        "owner": driver['owner'],
-                        "admin": driver['admin'],
-                        "league_mail_opt_out": driver['league_mail_opt_out'],
-                        "league_pm_opt_out": driver['league_pm_opt_out'],
-                        "league_member_since": driver['league_member_since'],
-                        "car_number": driver['car_number'],
-                        "nick_name": driver['nick_name'],
-                        "category1_license_level": driver_stats['member_info']['licenses'][0]['license_level'],
-                        "category1_irating": driver_stats['member_info']['licenses'][0]['irating'],
-                        "category1_safety_rating": driver_stats['member_info']['licenses'][0]['safety_rating'],
-                        "category1_cpi": driver_stats['member_info']['licenses'][0]['cpi'],
-                        "category1_mpr_num_races": driver_stats['member_info']['licenses'][0]['mpr_num_races'],
-                        "category1_tt_rating": driver_stats['member_info']['licenses'][0]['tt_rating'],
-                        "category1_mpr_num_tts": driver_stats['member_info']['licenses'][0]['mpr_num_tts'],
-                        "category1_group_id": driver_stats['member_info']['licenses'][0]['group_id'],
-                        "category2_license_level": driver_stats['member_info']['licenses'][1]['license_level'],
-                        "category2_irating": driver_stats['member_info']['licenses'][1]['irating'],
-                        "category2_safety_rating": driver_stats['member_info']['licenses'][1]['safety_rating'],
-                        "category2_cpi": driver_stats['member_info']['licenses'][1]['cpi'],
-                        "category2_mpr_num_races": driver_stats['member_info']['licenses'][1]['mpr_num_races'],
-                        "category2_tt_rating": driver_stats['member_info']['licenses'][1]['tt_rating'],
-                        "category2_mpr_num_tts": driver_stats['member_info']['licenses'][1]['mpr_num_tts'],
-                        "category2_group_id": driver_stats['member_info']['licenses'][1]['group_id'],
-                        "category3_license_level": driver_stats['member_info']['licenses'][2]['license_level'],
-                        "category3_irating": driver_stats['member_info']['licenses'][2]['irating'],
-                        "category3_safety_rating": driver_stats['member_info']['licenses'][2]['safety_rating'],
-                        "category3_cpi": driver_stats['member_info']['licenses'][2]['cpi'],
-                        "category3_mpr_num_races": driver_stats['member_info']['licenses'][2]['mpr_num_races'],
-                        "category3_tt_rating": driver_stats['member_info']['licenses'][2]['tt_rating'],
-                        "category3_mpr_num_tts": driver_stats['member_info']['licenses'][2]['mpr_num_tts'],
-                        "category3_group_id": driver_stats['member_info']['licenses'][2]['group_id'],
-                        "category4_license_level": driver_stats['member_info']['licenses'][3]['license_level'],
-                        "category4_irating": driver_stats['member_info']['licenses'][3]['irating'],
-                        "category4_safety_rating": driver_stats['member_info']['licenses'][3]['safety_rating'],
-                        "category4_cpi": driver_stats['member_info']['licenses'][3]['cpi'],
-                        "category4_mpr_num_races": driver_stats['member_info']['licenses'][3]['mpr_num_races'],
-                        "category4_tt_rating": driver_stats['member_info']['licenses'][3]['tt_rating'],
-                        "category4_mpr_num_tts": driver_stats['member_info']['licenses'][3]['mpr_num_tts'],
-                        "category4_group_id": driver_stats['member_info']['licenses'][3]['group_id'],
-                    }
+                    defaults=defaults
                 )
             except KeyError as ke:
                 print("updateLeagueData: Missing Roster Keys", ke)
 
-    # Called by updateLeagueSeasons 1
+    def rosterLicenses(self, member_info):
+        """ Maps a member's first four licences onto the category1..4 roster columns.
+        Works with member/get and member/profile records. Returns None if any field is missing. """
+        try:
+            licenses = sorted(member_info['licenses'], key=lambda x: x.get('category_id', 0))
+            fields = {}
+            for idx in range(4):
+                for field in self.roster_license_fields:
+                    fields["category%d_%s" % (idx + 1, field)] = licenses[idx][field]
+            return fields
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    # Single season refresh, updateLeagueSeasons pipelines the same work for every season.
     def updateLeagueSeasonSessions(self, league, season, _export=False):
         raw_data = self.irclient.league_season_sessions(league.league_id, season.season_id, results_only=False, export=_export)
+        if raw_data is None:
+            return
         for session in raw_data['sessions']:
             self.createOrUpdateLeagueSession(league, season, session)
 
@@ -540,15 +922,31 @@ class irstatsDataClient():
         except KeyError as ke:
             print("createOrUpdateLeagueSession: Missing Session Keys", ke)
 
-    # Called by updateLeagueSeasons 2
+    # Single season standings, updateLeagueSeasons fetches these in its pipeline.
     def updateLeagueSeasonStandings(self, league, season, _export=True):
         raw_data = self.irclient.league_season_standings(league.league_id, season.season_id, export=_export)
         # self.printRawData("updateSeasonStandings", raw_data)
 
     # Called by updateLeagueData 2
-    def updateLeagueSeasons(self, league, _export=False):
-        raw_data = self.irclient.league_seasons(league.league_id, retired=False, export=_export)
-        for season in raw_data['seasons']:
+    def updateLeagueSeasons(self, league, _export=False, raw_data=None):
+        if raw_data is None:
+            raw_data = self.irclient.league_seasons(league.league_id, retired=False, export=_export)
+        if raw_data is None:
+            return
+
+        # Fetch each season's sessions and standings in the background while the previous season is written.
+        def fetchSeasons():
+            for season in raw_data['seasons']:
+                sessions = self.irclient.league_season_sessions(league.league_id, season['season_id'], results_only=False, export=True)
+                self.irclient.league_season_standings(league.league_id, season['season_id'], export=_export)
+                yield season, sessions
+
+        pipeline = ingestPipeline(_batch_size=1, _name="updateLeagueSeasons " + str(league.league_id))
+        pipeline.run(fetchSeasons(), lambda seasons: self.saveLeagueSeasons(league, seasons), wrap=self.irclient.carry_context)
+        pipeline.printStats()
+
+    def saveLeagueSeasons(self, league, seasons):
+        for season, sessions in seasons:
             try:
                 new_season, created = LeagueSeasons.objects.update_or_create(
                     league=league,
@@ -565,14 +963,18 @@ class irstatsDataClient():
                         "points_system_desc": season['points_system_desc'],
                     }
                 )
-                self.updateLeagueSeasonSessions(league, new_season, True)
-                self.updateLeagueSeasonStandings(league, new_season, _export)
+                if sessions is not None:
+                    for session in sessions['sessions']:
+                        self.createOrUpdateLeagueSession(league, new_season, session)
             except KeyError as ke:
                 print("updateLeagueData: Missing Session Keys", ke)
 
     # Called by updateLeagueData 3
-    def updateLeaguePointSystem(self, league, _export=False):
-        raw_data = self.irclient.league_get_points_systems(league.league_id, season_id=None, export=_export)
+    def updateLeaguePointSystem(self, league, _export=False, raw_data=None):
+        if raw_data is None:
+            raw_data = self.irclient.league_get_points_systems(league.league_id, season_id=None, export=_export)
+        if raw_data is None:
+            return
         for system in raw_data['points_systems']:
 
             if system['league_id'] != league.league_id:
@@ -596,41 +998,186 @@ class irstatsDataClient():
 
     # Called by league season view to update standings.
     def updateLeagueSeason(self, season):
-        scoring = scoringClient()
+        scoring = scoringClient(_archive=self.archive)
         scoring.calculateSeasonStandings(season)
 
     # Called by league detail view
     def updateLeagueData(self, league, _export=False):
-        self.updateLeagueRoster(league, False)
-        self.updateLeagueSeasons(league, _export)
-        self.updateLeaguePointSystem(league, _export)
+        # The league's top level reads go out together, the per season reads follow in updateLeagueSeasons.
+        data = self.irclient.fetch_many({
+            "roster": ("league_get", {"league_id": league.league_id, "include_licenses": False}),
+            "seasons": ("league_seasons", {"league_id": league.league_id, "retired": False, "export": _export}),
+            "points": ("league_get_points_systems", {"league_id": league.league_id, "export": _export}),
+        })
+        # Parts that failed keep what is stored, they are not fetched again one at a time.
+        if data['roster'] is not None:
+            self.updateLeagueRoster(league, False, data['roster'])
+        if data['seasons'] is not None:
+            self.updateLeagueSeasons(league, _export, data['seasons'])
+        if data['points'] is not None:
+            self.updateLeaguePointSystem(league, _export, data['points'])
+
+    # Called by updateLeagueSession
+    def scrapeHostedResults(self, host_cust_id, league_id=None, min_interval=None):
+        """ Fetches the hosted results finished since the last scrape for the host and league.
+        The watermark is the latest end_time seen, which is passed back as finish_range_begin next time as the
+        search_hosted docs suggest.  Results are de-duplicated by subsession_id so the overlap is harmless.
+        :param host_cust_id: number host of the sessions
+        :param league_id: number league to limit the search to, None for all of the host's sessions
+        :param min_interval: int seconds between searches, defaults to settings.HOSTED_SCRAPE_INTERVAL
+        :return: list new HostedResults rows, None if the search was skipped or failed
+        """
+        if min_interval is None:
+            min_interval = getattr(settings, 'HOSTED_SCRAPE_INTERVAL', 300)
+
+        watermark, created = HostedResultWatermark.objects.get_or_create(host_cust_id=host_cust_id, league_id=league_id)
+        now = timezone.now()
+        if watermark.last_checked and (now - watermark.last_checked).total_seconds() < min_interval:
+            return None
+
+        # The first scrape looks back as far as the default search, later ones carry on from the watermark.
+        # An old watermark can be more than one search window behind, which the range search splits up.
+        try:
+            if watermark.finish_range_begin:
+                raw_data = list(self.irclient.result_search_hosted_range(watermark.finish_range_begin, by_finish=True,
+                                                                         host_cust_id=host_cust_id, league_id=league_id))
+            else:
+                raw_data = self.irclient.result_search_hosted(host_cust_id=host_cust_id, league_id=league_id, export=False)
+        except RuntimeError as e:
+            print("scrapeHostedResults", host_cust_id, league_id, e)
+            return None
+        if raw_data is None:
+            return None
+
+        new_results = self.saveHostedResults(host_cust_id, league_id, raw_data)
+
+        latest = watermark.finish_range_begin
+        for item in raw_data:
+            end_time = parse_datetime(item['end_time']) if item.get('end_time') else None
+            if end_time and (latest is None or end_time > latest):
+                latest = end_time
+        watermark.finish_range_begin = latest
+        watermark.last_checked = now
+        watermark.save()
+
+        print("scrapeHostedResults", host_cust_id, league_id, len(raw_data), "found", len(new_results), "new")
+        return new_results
+
+    # Loads a league's history, too many searches for a page view so it is meant for background jobs
+    def backfillHostedResults(self, league, range_begin, range_end=None):
+        """ Searches the league's hosted results over any range, e.g. every season since league.created.
+        Progress is checkpointed so an interrupted backfill resumes where it stopped, and the watermark is moved on
+        so the incremental scrape carries on from the newest result found.
+        :param league: Leagues
+        :param range_begin: datetime or ISO-8601 string start of the backfill
+        :param range_end: datetime or ISO-8601 string end of the backfill, defaults to now
+        :return: int number of new results stored
+        """
+        # Checkpoints are kept out of FILE_FOLDER, where every JSON file is archive data that can be evicted or imported.
+        checkpoint_folder = self.settingsFolder('CHECKPOINT_FOLDER') or os.path.join(settings.BASE_DIR, "checkpoints")
+        os.makedirs(checkpoint_folder, exist_ok=True)
+        checkpoint_name = "backfill_%s_%s.json" % (league.owner_id, league.league_id)
+        checkpoint_file = os.path.join(checkpoint_folder, checkpoint_name)
+        old_checkpoint = os.path.join(settings.BASE_DIR, settings.FILE_FOLDER, checkpoint_name)
+        if os.path.exists(old_checkpoint) and not os.path.exists(checkpoint_file):
+            os.replace(old_checkpoint, checkpoint_file)
+        windows = self.irclient.result_search_hosted_range(range_begin, range_end, checkpoint_file=checkpoint_file,
+                                                           by_window=True, host_cust_id=league.owner_id,
+                                                           league_id=league.league_id)
+
+        # The pipeline hands over one search window at a time.  A window is checkpointed only once its rows are
+        # stored, the search runs ahead of the database and a resumed backfill must not skip rows still queued.
+        saved = []
+
+        def save(batch):
+            for rows, checkpoint in batch:
+                saved.extend(self.saveHostedResults(league.owner_id, league.league_id, rows))
+                checkpoint()
+
+        pipeline = ingestPipeline(_batch_size=1, _name="backfillHostedResults " + str(league.league_id))
+        pipeline.run(windows, save, wrap=self.irclient.carry_context)
+        pipeline.printStats()
+
+        latest = max([parse_datetime(x.end_time) for x in saved if x.end_time], default=None)
+        watermark, created = HostedResultWatermark.objects.get_or_create(host_cust_id=league.owner_id, league_id=league.league_id)
+        if latest and (watermark.finish_range_begin is None or latest > watermark.finish_range_begin):
+            watermark.finish_range_begin = latest
+            watermark.save()
+
+        self.linkLeagueSessions(league)
+        return len(saved)
+
+    def saveHostedResults(self, host_cust_id, league_id, raw_data):
+        """ Stores the search rows we have not seen before.
+        :return: list the new HostedResults rows
+        """
+        results = {}
+        for item in raw_data:
+            results[item['subsession_id']] = item
+
+        known = set(HostedResults.objects.filter(subsession_id__in=list(results.keys())).values_list('subsession_id', flat=True))
+        new_results = []
+        for subsession_id, item in results.items():
+            if subsession_id in known:
+                continue
+            new_results.append(HostedResults(
+                subsession_id=subsession_id,
+                host_cust_id=host_cust_id,
+                league_id=item.get('league_id', league_id),
+                league_season_id=item.get('league_season_id', None),
+                private_session_id=item.get('private_session_id', None),
+                session_name=item.get('session_name', None),
+                heat_race=bool(item.get('heat_race', False)),
+                track_id=item.get('track', {}).get('track_id', None),
+                start_time=item.get('start_time', None),
+                end_time=item.get('end_time', None),
+            ))
+        HostedResults.objects.bulk_create(new_results, ignore_conflicts=True)
+        return new_results
+
+    # Called by updateLeagueSession
+    def linkLeagueSessions(self, league):
+        """ Sets the subsession_id of every unlinked league session that has a scraped result.
+        :return: list the LeagueSessions that were linked
+        """
+        unlinked = list(LeagueSessions.objects.filter(league=league, subsession_id__isnull=True, private_session_id__isnull=False))
+        if not unlinked:
+            return []
+
+        # Match on the private session ID and take the heat race, as the search returns every simsession.
+        found = HostedResults.objects.filter(private_session_id__in=[x.private_session_id for x in unlinked], heat_race=True)
+        subsessions = {x.private_session_id: x.subsession_id for x in found}
+
+        linked = []
+        for leaguesession in unlinked:
+            if leaguesession.private_session_id in subsessions:
+                leaguesession.subsession_id = subsessions[leaguesession.private_session_id]
+                linked.append(leaguesession)
+        LeagueSessions.objects.bulk_update(linked, ['subsession_id'])
+        return linked
 
     # Called by Session detail view
     def updateLeagueSession(self, leaguesession):
 
-        # Get all the hosted races for the league from iRacing
-        result_hosted = self.irclient.result_search_hosted(host_cust_id=leaguesession.league.owner_id, league_id=leaguesession.league.league_id, track_id=leaguesession.track_id, export=False)
-
-        # Find the race that matches the private session ID and has a heat race as true
-        session = next((item for item in result_hosted if item["private_session_id"] == leaguesession.private_session_id and item['heat_race'] == True), None)
+        # One incremental search links every unscored session of the league, not just this one.
+        if not leaguesession.subsession_id:
+            self.scrapeHostedResults(leaguesession.league.owner_id, leaguesession.league.league_id)
+            self.linkLeagueSessions(leaguesession.league)
+            leaguesession.refresh_from_db(fields=['subsession_id'])
 
-        if session == None:
+        if not leaguesession.subsession_id:
             return None
 
-        # Update the League Session in our database
-        leaguesession.subsession_id = session['subsession_id']
-        leaguesession.save()
-
         # Update the Session Result in our database
-        result_data = self.updateSessionResult(session['subsession_id'])
+        result_data = self.updateSessionResult(leaguesession.subsession_id)
         #self.printRawData("Result Data", result_data)
 
         #Store the data processing the scores.
-        scoring = scoringClient(result_data)
+        scoring = scoringClient(result_data, self.archive)
         results = scoring.updateScores()
 
         # Return the Sub Session ID
-        return session['subsession_id']
+        return leaguesession.subsession_id
 
     # Test Function
     def testFunction(self, _export=False):
@@ -0,0 +1,171 @@
+"""
+Rate limit aware scheduler for the iRacing data API.
+
+members-ng reports its budget on every response in the x-ratelimit-limit, x-ratelimit-remaining and
+x-ratelimit-reset (epoch seconds) headers.  The limiter keeps a bucket of the remaining requests, lets calls through
+freely while there is plenty of headroom and then spaces them evenly across what is left of the window so the budget
+is used up without tripping it.  Waiting calls are served interactive first, then background, then in arrival order.
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class rateLimiter():
+
+    # Priorities, lower is served first.
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    def __init__(self, _burst=10, _reserve=1, _cooldown=60):
+        """
+        :param _burst: int requests allowed without spacing while remaining is above burst + reserve
+        :param _reserve: int requests held back from every window as a safety margin
+        :param _cooldown: float seconds to hold off when the budget is spent but no reset time is known
+        """
+        self.burst = _burst
+        self.reserve = _reserve
+        self.cooldown = _cooldown
+
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.last_grant = 0.0
+
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._local = threading.local()
+        self._stats = {"granted": 0, "waited": 0, "total_wait": 0.0, "max_wait": 0.0, "throttled": 0,
+                       "granted_interactive": 0, "granted_background": 0}
+
+    @contextmanager
+    def priority(self, priority):
+        """ Sets the priority of calls made by this thread inside the with block. """
+        previous = self.currentPriority()
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def currentPriority(self):
+        return getattr(self._local, "priority", self.INTERACTIVE)
+
+    def acquire(self, priority=None, timeout=None):
+        """ Blocks until the request may be sent.
+        :param priority: int INTERACTIVE or BACKGROUND, defaults to the thread's current priority
+        :param timeout: float longest wait in seconds, RuntimeError is raised when it runs out
+        :return: float seconds spent waiting
+        """
+        if priority is None:
+            priority = self.currentPriority()
+
+        start = time.monotonic()
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiting[0] == ticket:
+                        wait = self._delay()
+                        if wait <= 0:
+                            break
+                    if timeout is not None:
+                        left = start + timeout - time.monotonic()
+                        if left <= 0:
+                            raise RuntimeError("Rate limit wait exceeded deadline")
+                        wait = left if wait is None else min(wait, left)
+                    self._condition.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+            self._grant(priority, time.monotonic() - start)
+
+        return time.monotonic() - start
+
+    def update(self, headers, status_code=200):
+        """ Refreshes the bucket from a members-ng response. """
+        limit = self._header(headers, "x-ratelimit-limit")
+        remaining = self._header(headers, "x-ratelimit-remaining")
+        reset = self._header(headers, "x-ratelimit-reset")
+        retry_after = self._header(headers, "retry-after")
+
+        with self._condition:
+            if limit is not None:
+                self.limit = limit
+            if remaining is not None:
+                self.remaining = remaining
+            if reset is not None:
+                self.reset = reset
+            if status_code == 429:
+                # Throttled anyway, so nothing more goes out until the window resets.  Without a reset time to wait
+                # for, Retry-After or the cooldown gives one, otherwise no request would ever go out to bring one.
+                self.remaining = 0
+                if self.reset is None or self.reset <= time.time():
+                    self.reset = time.time() + (retry_after if retry_after is not None else self.cooldown)
+                self._stats["throttled"] += 1
+            self._condition.notify_all()
+
+    def stats(self):
+        """ Returns queue depth, wait times and the current view of the budget. """
+        with self._condition:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._waiting)
+            stats["queue_interactive"] = len([x for x in self._waiting if x[0] == self.INTERACTIVE])
+            stats["queue_background"] = len(self._waiting) - stats["queue_interactive"]
+            stats["limit"] = self.limit
+            stats["remaining"] = self.remaining
+            stats["reset"] = self.reset
+        stats["average_wait"] = stats["total_wait"] / stats["granted"] if stats["granted"] else 0.0
+        return stats
+
+    ##### PRIVATE #####
+
+    def _header(self, headers, name):
+        try:
+            return int(float(headers.get(name)))
+        except (TypeError, ValueError):
+            return None
+
+    def _delay(self):
+        """ Seconds until the next request may go out. Called with the condition held. """
+        now = time.time()
+
+        # The window has rolled over so the full budget is available again.
+        if self.reset is not None and now >= self.reset:
+            self.remaining = self.limit
+            self.reset = None
+
+        if self.remaining is None:
+            return 0
+        available = self.remaining - self.reserve
+        if available <= 0:
+            if self.reset is None:
+                self.reset = now + self.cooldown
+            return self.reset - now
+        if available > self.burst or self.reset is None:
+            return 0
+
+        spacing = (self.reset - now) / available
+        return self.last_grant + spacing - now
+
+    def _grant(self, priority, waited):
+        self.last_grant = time.time()
+        if self.remaining is not None:
+            self.remaining -= 1
+
+        self._stats["granted"] += 1
+        if priority == self.INTERACTIVE:
+            self._stats["granted_interactive"] += 1
+        else:
+            self._stats["granted_background"] += 1
+        if waited > 0.001:
+            self._stats["waited"] += 1
+        self._stats["total_wait"] += waited
+        self._stats["max_wait"] = max(self._stats["max_wait"], waited)
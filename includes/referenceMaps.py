@@ -0,0 +1,81 @@
+"""
+In memory lookup of the reference rows that ingested data points at.
+
+Races, careers and results refer to tracks, cars, series and categories by their iRacing ids.  Looking each one up with
+objects.get costs a query per row, so a referenceMaps loads an id to row map per kind once and resolves the ids from
+it.  The maps are kept for the whole process and reloaded when a reference sync calls invalidate(), or when they are
+older than max_age as another process may have synced.  Ids that are not found are collected rather than raised so
+the caller can refresh just the reference data that is missing and retry those rows.
+"""
+import threading
+import time
+
+from irstats.models import Category, Tracks, Cars, Series
+
+
+class referenceMaps():
+
+    # Kind: (model, iRacing id field).
+    kinds = {
+        "Tracks": (Tracks, "track_id"),
+        "Cars": (Cars, "car_id"),
+        "Series": (Series, "series_id"),
+        "Category": (Category, "id"),
+    }
+
+    # Seconds a loaded map is used before it is read again.
+    max_age = 300
+
+    _maps = {}
+    _refreshed = {}
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.misses = {}
+
+    @classmethod
+    def invalidate(cls, kind=None):
+        """ Drops the loaded map of a kind, or all of them, so the next lookup reads the table again. """
+        with cls._lock:
+            if kind is None:
+                cls._maps.clear()
+            else:
+                cls._maps.pop(kind, None)
+
+    @classmethod
+    def shouldRefresh(cls, kind, ids):
+        """ Whether a sync of the kind is worth running for the missing ids.  An id that a sync within max_age did not
+        bring in is not asked for again until then, so a row pointing at something iRacing does not list does not
+        cause a sync on every page.
+        """
+        now = time.monotonic()
+        with cls._lock:
+            new = [x for x in ids if now - cls._refreshed.get((kind, x), -cls.max_age) >= cls.max_age]
+            for id in new:
+                cls._refreshed[(kind, id)] = now
+        return bool(new)
+
+    def get(self, kind, id):
+        """ Returns the row of the kind with the iRacing id, or None after noting the id as missing. """
+        row = self._map(kind).get(int(id))
+        if row is None:
+            self.misses.setdefault(kind, set()).add(int(id))
+        return row
+
+    def missing(self):
+        """ Returns the ids not found so far, as a dict of kind: sorted list. """
+        return {kind: sorted(ids) for kind, ids in self.misses.items()}
+
+    ##### PRIVATE #####
+
+    def _map(self, kind):
+        with self._lock:
+            loaded = self._maps.get(kind)
+            if loaded is not None and time.monotonic() - loaded[0] < self.max_age:
+                return loaded[1]
+
+        model, field = self.kinds[kind]
+        rows = {getattr(x, field): x for x in model.objects.all()}
+        with self._lock:
+            self._maps[kind] = (time.monotonic(), rows)
+        return rows
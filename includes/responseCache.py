@@ -0,0 +1,241 @@
+"""
+Response cache for the iRacing data API.
+
+Two tiers: an in memory LRU and an optional folder of gzipped JSON files, both with size based eviction.  Entries
+carry their own expiry so each endpoint can use the expirationSeconds iRacing documents for it; a ttl of None keeps the
+entry until it is evicted and a ttl of 0 means do not cache.
+
+The memory tier holds the compact JSON of each entry rather than the data itself, which gives its size and means every
+get returns a fresh copy that callers may change, as updateCars does, without changing what is cached.  Entries too big
+for the memory budget are only kept on disk.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class responseCache():
+
+    def __init__(self, _max_entries=128, _cache_folder=None, _max_bytes=256 * 1024 * 1024,
+                 _max_memory_bytes=32 * 1024 * 1024):
+        """
+        :param _max_entries: int entries held in the memory tier
+        :param _cache_folder: string folder for the disk tier, None keeps the cache in memory only
+        :param _max_bytes: int size budget for the disk tier
+        :param _max_memory_bytes: int size budget for the memory tier, counted in bytes of JSON
+        """
+        self.max_entries = _max_entries
+        self.cache_folder = _cache_folder
+        self.max_bytes = _max_bytes
+        self.max_memory_bytes = _max_memory_bytes
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if self.cache_folder:
+            Path(self.cache_folder).mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(size for path, size, mtime in self._diskEntries())
+
+    ##### KEYS #####
+
+    @staticmethod
+    def makeKey(endpoint, payload=None):
+        """ Builds a stable key from the endpoint and payload so 1, "1" and dict ordering do not split entries. """
+        normalised = {}
+        for name, value in (payload or {}).items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ",".join(str(x) for x in value)
+            normalised[name] = str(value)
+        return endpoint + "?" + json.dumps(normalised, sort_keys=True)
+
+    ##### ACCESS #####
+
+    def get(self, key):
+        """ Looks the key up in memory then on disk.
+        :return: tuple (found, data) where data is the caller's own copy
+        """
+        now = time.time()
+        raw = None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] is None or entry[0] > now:
+                    raw = entry[1]
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                else:
+                    self._memoryPop(key)
+        if raw is not None:
+            return True, json.loads(raw)
+
+        entry = self._diskGet(key, now)
+        if entry is not None:
+            raw = self._encode(entry[1])
+            with self._lock:
+                self._stats["disk_hits"] += 1
+                if raw is not None:
+                    self._memoryPut(key, entry[0], raw)
+            return True, entry[1]
+        with self._lock:
+            self._stats["misses"] += 1
+        return False, None
+
+    def set(self, key, data, ttl=None):
+        """ Stores data under the key.
+        :param ttl: int seconds to keep the entry, None for no expiry and 0 to skip caching
+        """
+        if ttl == 0:
+            return
+        raw = self._encode(data)
+        if raw is None:
+            return
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._memoryPut(key, expires, raw)
+            self._stats["stores"] += 1
+        self._diskPut(key, expires, raw)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for path, size, mtime in self._diskEntries():
+            self._removeFile(path, size)
+
+    def stats(self):
+        """ Returns the hit and miss counts along with the current size of each tier. """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["disk_bytes"] = self._disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    ##### MEMORY TIER #####
+
+    def _encode(self, data):
+        """ The compact JSON of the data as bytes, or None if it cannot be cached. """
+        try:
+            return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            print("responseCache - Unable to cache data", e)
+            return None
+
+    def _memoryPut(self, key, expires, raw):
+        """ Called with the lock held. """
+        self._memoryPop(key)
+        if len(raw) > self.max_memory_bytes:
+            return
+        self._memory[key] = (expires, raw)
+        self._memory_bytes += len(raw)
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_memory_bytes:
+            self._memoryPop(next(iter(self._memory)))
+            self._stats["evictions"] += 1
+
+    def _memoryPop(self, key):
+        """ Called with the lock held. """
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[1])
+
+    ##### DISK TIER #####
+
+    def _diskPath(self, key):
+        return os.path.join(self.cache_folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".json.gz")
+
+    def _diskEntries(self):
+        entries = []
+        if not self.cache_folder:
+            return entries
+        for entry in os.scandir(self.cache_folder):
+            if entry.is_file() and entry.name.endswith(".json.gz"):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _diskGet(self, key, now):
+        if not self.cache_folder:
+            return None
+        path = self._diskPath(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print("responseCache - Unreadable cache file", path, e)
+            return None
+
+        # The stored key guards against hash collisions and files from an older key format.
+        if entry.get("key") != key:
+            return None
+        expires = entry.get("expires")
+        if expires is not None and expires <= now:
+            self._removeFile(path)
+            return None
+
+        # Touch the file so eviction sees it as recently used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return expires, entry.get("data")
+
+    def _diskPut(self, key, expires, raw):
+        if not self.cache_folder:
+            return
+        path = self._diskPath(key)
+        temp_path = path + ".%d.tmp" % threading.get_ident()
+        try:
+            # The data is already JSON, only the key and expiry around it are encoded here.
+            head = json.dumps({"key": key, "expires": expires}, ensure_ascii=False, separators=(',', ':'))
+            with gzip.open(temp_path, 'wb') as f:
+                f.write(head[:-1].encode('utf-8') + b',"data":' + raw + b'}')
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+            new_size = os.path.getsize(path)
+        except (OSError, TypeError, ValueError) as e:
+            print("responseCache - Unable to write cache file", path, e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            self._disk_bytes += new_size - old_size
+            over_budget = self._disk_bytes > self.max_bytes
+        if over_budget:
+            self._evictDisk()
+
+    def _evictDisk(self):
+        """ Removes the least recently used files until the disk tier is back under budget. """
+        entries = sorted(self._diskEntries(), key=lambda entry: entry[2])
+        with self._lock:
+            self._disk_bytes = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            with self._lock:
+                if self._disk_bytes <= self.max_bytes:
+                    return
+            self._removeFile(path, size)
+
+    def _removeFile(self, path, size=None):
+        try:
+            if size is None:
+                size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+            self._stats["evictions"] += 1
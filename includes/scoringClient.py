@@ -41,8 +41,9 @@ class scoringClient():
 
     finalSessionID = 99
 
-    def __init__(self, _results=None):
+    def __init__(self, _results=None, _archive=None):
         self.results = _results
+        self.archive = _archive
         self.hive_root = settings.BASE_DIR
         self.files_folder = settings.FILE_FOLDER
 
@@ -55,7 +56,12 @@ class scoringClient():
 
     def rawToJson(self):
 
-        filename = self.filename.replace(".json", "_complete.json")
+        # Scored results are archived next to the raw result they came from.
+        if self.archive is not None:
+            self.archive.put("result_complete", self.results['subsession_id'], self.results)
+            return
+
+        filename = "result_complete_" + str(self.results['subsession_id']) + ".json"
         export_path = os.path.join(self.hive_root, self.files_folder, filename)
 
         try:
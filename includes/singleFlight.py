@@ -0,0 +1,155 @@
+"""
+Single flight de-duplication of identical in-flight requests.
+
+When several callers ask for the same endpoint and payload at once only the first, the leader, makes the request.
+The others wait for it and are handed the same result, or the same exception.  Within a process the followers wait on
+an event.  Across processes the leader holds a lock file for the key, created with O_EXCL so it works on Windows too,
+and the other processes wait for the file to go and then read the result the leader left in the shared disk cache.
+"""
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class singleFlight():
+
+    def __init__(self, _lock_folder=None, _lock_timeout=120, _poll_interval=0.1):
+        """
+        :param _lock_folder: string folder for the cross process lock files, None keeps de-duplication in process
+        :param _lock_timeout: int seconds after which a lock file is treated as left behind by a dead process
+        :param _poll_interval: float seconds between checks on another process's lock file
+        """
+        self.lock_folder = _lock_folder
+        self.lock_timeout = _lock_timeout
+        self.poll_interval = _poll_interval
+
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0, "process_waits": 0, "process_shared": 0, "stale_locks": 0}
+
+        if self.lock_folder:
+            Path(self.lock_folder).mkdir(parents=True, exist_ok=True)
+
+    def do(self, key, func, recheck=None, timeout=None):
+        """ Runs func once for all the concurrent callers with the same key.
+        :param key: string identity of the request, e.g. the response cache key
+        :param func: callable that makes the request
+        :param recheck: callable returning (found, data) from the shared cache, enables the cross process lock
+        :param timeout: float longest wait in seconds for another caller's request, RuntimeError when it runs out
+        :return: the result of func, from this caller or the one that got there first
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = {"done": threading.Event(), "result": None, "error": None}
+                self._flights[key] = flight
+                self._stats["leaders"] += 1
+            else:
+                self._stats["followers"] += 1
+
+        if not leader:
+            if not flight["done"].wait(timeout):
+                raise RuntimeError("Timed out waiting for in-flight request", key)
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+
+        try:
+            flight["result"] = self._processFlight(key, func, recheck, timeout)
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight["done"].set()
+
+    def stats(self):
+        """ Returns how many requests were made and how many were shared, in process and across processes. """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        return stats
+
+    ##### CROSS PROCESS #####
+
+    def _processFlight(self, key, func, recheck, timeout):
+        """ Runs func under the lock file for the key, or picks up the result of the process holding it. """
+        if not self.lock_folder or recheck is None:
+            return func()
+
+        path = os.path.join(self.lock_folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".lock")
+        start = time.monotonic()
+        waited = False
+        while True:
+            acquired = self._acquireFile(path)
+            if acquired is None:
+                # Lock files cannot be used here so carry on as if this process were on its own.
+                return func()
+            if acquired:
+                break
+
+            if not waited:
+                waited = True
+                with self._lock:
+                    self._stats["process_waits"] += 1
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise RuntimeError("Timed out waiting for another process's request", key)
+            while os.path.exists(path) and not self._isStale(path):
+                time.sleep(self.poll_interval)
+                if timeout is not None and time.monotonic() - start > timeout:
+                    raise RuntimeError("Timed out waiting for another process's request", key)
+
+            found, data = recheck()
+            if found:
+                with self._lock:
+                    self._stats["process_shared"] += 1
+                return data
+
+        try:
+            # The other process may have finished between our cache miss and taking the lock.
+            if waited:
+                found, data = recheck()
+                if found:
+                    with self._lock:
+                        self._stats["process_shared"] += 1
+                    return data
+            return func()
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _acquireFile(self, path):
+        """ Creates the lock file.
+        :return: True if this process now holds it, False if another does, None if lock files do not work here
+        """
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self._isStale(path):
+                with self._lock:
+                    self._stats["stale_locks"] += 1
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return False
+        except OSError as e:
+            print("singleFlight - Unable to create lock file", path, e)
+            return None
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        return True
+
+    def _isStale(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) > self.lock_timeout
+        except OSError:
+            return False
@@ -1,6 +1,31 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class IrstatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'irstats'
+
+    def ready(self):
+        # Optionally load the reference data in the background so no page view has to wait for it.
+        if getattr(settings, 'WARMUP_ON_STARTUP', False) and self.isServing():
+            threading.Thread(target=self.warmup, name="irstats-warmup", daemon=True).start()
+
+    def isServing(self):
+        """ False for manage.py commands other than runserver, and for the runserver process that only reloads. """
+        if os.path.basename(sys.argv[0]) == "manage.py":
+            command = sys.argv[1] if len(sys.argv) > 1 else None
+            reloader = os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
+            return command == "runserver" and reloader
+        return True
+
+    def warmup(self):
+        from includes.irstatsDataClient import irstatsDataClient
+        try:
+            irstatsDataClient().warmReferenceData()
+        except Exception as e:
+            print("Reference data warmup failed", e)
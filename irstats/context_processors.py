@@ -0,0 +1,7 @@
+from includes.irstatsDataClient import irstatsDataClient
+
+
+def api_status(request):
+    """ Adds api_stale to every page, true while iRacing is failing and pages show only what is stored. """
+    breaker = irstatsDataClient.apiBreaker()
+    return {'api_stale': not breaker.isClosed()}
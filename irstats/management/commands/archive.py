@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from includes.irstatsDataClient import irstatsDataClient
+
+
+class Command(BaseCommand):
+    help = "Reports what the data archive holds by kind and applies its retention policy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enforce', action='store_true',
+                            help="Remove expired entries and evict the least recently used ones beyond the budget")
+        parser.add_argument('--import-legacy', action='store_true',
+                            help="Move the JSON files in FILE_FOLDER into the archive")
+
+    def handle(self, *args, **options):
+        archive = irstatsDataClient().archive
+
+        if options['import_legacy']:
+            self.stdout.write("Imported %d files" % archive.importLegacy())
+        if options['enforce']:
+            result = archive.enforce()
+            self.stdout.write(self.style.SUCCESS("Expired %d, evicted %d, freed %s" % (
+                result['expired'], result['evicted'], self.size(result['freed_bytes']))))
+
+        report = archive.report()
+        self.stdout.write("%-28s %8s %8s %10s %17s %17s %8s" % ("kind", "entries", "files", "size", "oldest",
+                                                             "last used", "ttl"))
+        for kind, usage in sorted(report['kinds'].items(), key=lambda x: -x[1]['bytes']):
+            ttl = "keep" if usage['kept'] else ("%dd" % (usage['ttl'] / 86400) if usage['ttl'] else "-")
+            self.stdout.write("%-28s %8d %8d %10s %17s %17s %8s" % (
+                kind, usage['entries'], usage['files'], self.size(usage['bytes']), self.date(usage['oldest']),
+                self.date(usage['last_used']), ttl))
+
+        budget = self.size(report['max_bytes']) if report['max_bytes'] is not None else "no limit"
+        self.stdout.write("Total: %d entries, %s of %s" % (report['entries'], self.size(report['bytes']), budget))
+
+    def size(self, value):
+        for unit in ("B", "KB", "MB", "GB"):
+            if value < 1024 or unit == "GB":
+                return "%.1f%s" % (value, unit) if unit != "B" else "%d%s" % (value, unit)
+            value /= 1024
+
+    def date(self, value):
+        return datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M")
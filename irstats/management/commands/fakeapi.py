@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from includes.fakeApiServer import fakeApiServer
+
+
+class Command(BaseCommand):
+    help = "Runs a local stand in for the iRacing data API that serves, or records, fixture files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', default=os.path.join(settings.BASE_DIR, "archive", "fakeapi"),
+                            help="Folder of the fixture files")
+        parser.add_argument('--host', default="127.0.0.1")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many random seconds more")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of data and chunk requests that fail, e.g. 0.05")
+        parser.add_argument('--error-status', type=int, default=503)
+        parser.add_argument('--rate-limit', type=int, default=None, help="Requests allowed per window")
+        parser.add_argument('--rate-window', type=int, default=60, help="Seconds in a rate limit window")
+        parser.add_argument('--session-lifetime', type=int, default=None, help="Seconds a login lasts")
+        parser.add_argument('--no-compress', action='store_true', help="Never gzip responses")
+        parser.add_argument('--record', action='store_true',
+                            help="Pass requests on to members-ng and save the answers as fixtures")
+
+    def handle(self, *args, **options):
+        server = fakeApiServer(options['fixtures'], _host=options['host'], _port=options['port'],
+                               _latency=options['latency'], _jitter=options['jitter'],
+                               _error_rate=options['error_rate'], _error_status=options['error_status'],
+                               _rate_limit=options['rate_limit'], _rate_window=options['rate_window'],
+                               _session_lifetime=options['session_lifetime'], _record=options['record'],
+                               _compress=not options['no_compress'])
+
+        self.stdout.write("Serving %d fixtures from %s on %s%s" % (
+            server.loadFixtures(), options['fixtures'], server.url, " (recording)" if options['record'] else ""))
+        self.stdout.write("Set IRACING_API_URL = \"%s\" in settings.py to use it" % server.url)
+        try:
+            server.serveForever()
+        except KeyboardInterrupt:
+            pass
+        for name, count in sorted(server.stats().items()):
+            self.stdout.write("%s: %d" % (name, count))
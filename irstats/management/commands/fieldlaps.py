@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from includes.irstatsDataClient import irstatsDataClient
+
+
+class Command(BaseCommand):
+    help = "Stores the laps of every driver in the stored races, fetching only the drivers whose laps are missing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('subsession_ids', nargs='*', type=int, help="Races to fill in, all stored races by default")
+        parser.add_argument('--limit', type=int, default=None, help="Check at most this many races, newest first")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Lap data calls at once, defaults to FIELD_LAPS_WORKERS")
+
+    def handle(self, *args, **options):
+        ir_stats = irstatsDataClient()
+        totals = ir_stats.updateFieldLaps(options['subsession_ids'], limit=options['limit'],
+                                          max_workers=options['workers'])
+
+        self.stdout.write(self.style.SUCCESS(
+            "%(races)d races checked: %(fetched)d entries fetched, %(skipped)d already stored, %(failed)d failed, "
+            "%(inserted)d laps inserted, %(updated)d updated" % totals))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from includes.irstatsDataClient import irstatsDataClient
+
+
+class Command(BaseCommand):
+    help = "Fetches the cars, tracks and series reference data from iRacing concurrently and stores it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Refresh the data even if it is not due an update")
+
+    def handle(self, *args, **options):
+        ir_stats = irstatsDataClient()
+        summary = ir_stats.warmReferenceData(force=options['force'])
+
+        for type, diff in summary.items():
+            if diff is None:
+                self.stdout.write(self.style.ERROR("%s: fetch failed" % type))
+            else:
+                changes = ", ".join("%d %s" % (count, name) for name, count in diff.items())
+                self.stdout.write(self.style.SUCCESS("%s: %s" % (type, changes)))
+        if not summary:
+            self.stdout.write("Reference data is up to date")
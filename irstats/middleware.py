@@ -0,0 +1,38 @@
+import time
+
+from django.db import connection
+
+from includes.iRacingClientPool import iRacingClientPool
+
+
+class PageMetricsMiddleware:
+    """ Records how long each page took and how much of that went on database queries and on the iRacing API.
+    What is left over is mostly template rendering.  The numbers are shown on /metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = iRacingClientPool.getMetrics()
+        metrics.resetPage()
+        db_seconds = [0.0]
+
+        def timeQuery(execute, sql, params, many, context):
+            start = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db_seconds[0] += time.monotonic() - start
+
+        start = time.monotonic()
+        with connection.execute_wrapper(timeQuery):
+            response = self.get_response(request)
+        elapsed = time.monotonic() - start
+
+        match = getattr(request, "resolver_match", None)
+        labels = {"view": match.url_name if match is not None and match.url_name else "other"}
+        metrics.observe("irstats_view_seconds", elapsed, labels)
+        metrics.observe("irstats_view_db_seconds", db_seconds[0], labels)
+        metrics.observe("irstats_view_api_seconds", metrics.pageApiSeconds(), labels)
+        return response
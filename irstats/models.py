@@ -59,12 +59,13 @@ class Series(models.Model):
     min_starters = models.IntegerField(null=True)
     oval_caution_type = models.IntegerField(null=True)
     road_caution_type = models.IntegerField(null=True)
-    series_id = models.IntegerField(null=True)
+    series_id = models.IntegerField(null=True, unique=True)
     series_name = models.CharField(max_length=100, blank=True, null=True)
     series_short_name = models.CharField(max_length=100, blank=True, null=True)
     allowed_licenses = models.CharField(max_length=255, blank=True, null=True)
     date_modified = models.DateTimeField(auto_now=True)
     show = models.BooleanField(default=True)
+    content_hash = models.CharField(max_length=40, blank=True, null=True)
 
     class Meta:
         managed = True
@@ -88,7 +89,7 @@ class Cars(models.Model):
     allow_wheel_color = models.BooleanField()
     award_exempt = models.BooleanField()
     car_dirpath = models.CharField(max_length=100, blank=True, null=True)
-    car_id = models.IntegerField(null=True)
+    car_id = models.IntegerField(null=True, unique=True)
     car_name = models.CharField(max_length=100, blank=True, null=True)
     car_name_abbreviated = models.CharField(max_length=100, blank=True, null=True)
     car_types = models.CharField(max_length=100, blank=True, null=True)
@@ -112,6 +113,7 @@ class Cars(models.Model):
     retired = models.BooleanField()
     search_filters = models.CharField(max_length=100, blank=True, null=True)
     sku = models.IntegerField(null=True)
+    content_hash = models.CharField(max_length=40, blank=True, null=True)
     date_modified = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -180,6 +182,7 @@ class Tracks(models.Model):
     track_id = models.IntegerField(null=True, unique=True)
     track_name = models.CharField(max_length=100, blank=True, null=True)
     track_types = models.CharField(max_length=100, blank=True, null=True)
+    content_hash = models.CharField(max_length=40, blank=True, null=True)
     date_modified = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -205,6 +208,8 @@ class Member(models.Model):
     num_league_sessions = models.IntegerField(null=True)
     num_official_wins = models.IntegerField(null=True)
     num_league_wins = models.IntegerField(null=True)
+    # Drivers only seen in another member's race, stored so their laps have a member, until their own profile is read.
+    placeholder = models.BooleanField(default=False)
     date_modified = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -315,11 +320,31 @@ class Laps(models.Model):
         verbose_name = 'Lap'
         verbose_name_plural = 'Laps'
         ordering = ['lap_number']
+        unique_together = ('race', 'member', 'lap_number')
 
     def __str__(self):
         return str(self.lap_number) + " (" + str(self.id) + ")"
 
 
+class FieldLapEntries(models.Model):
+    """ Entries of a race whose laps have been fetched for the whole field, a driver or team may have no laps to store """
+
+    race = models.ForeignKey(Races, on_delete=models.DO_NOTHING)
+    team = models.BooleanField(default=False)
+    entry_id = models.IntegerField()
+    date_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'irstats_field_lap_entries'
+        verbose_name = 'Field Lap Entry'
+        verbose_name_plural = 'Field Lap Entries'
+        unique_together = ('race', 'team', 'entry_id')
+
+    def __str__(self):
+        return str(self.race_id) + " | " + ("team " if self.team else "") + str(self.entry_id)
+
+
 class Leagues(models.Model):
     league_id = models.IntegerField(null=True)
     owner_id = models.IntegerField(null=True)
@@ -579,4 +604,49 @@ class LeagueSeasonStandings(models.Model):
         ordering = ['points', 'display_name']
 
     def __str__(self):
-        return str(self.simsession_type_name) + " (" + str(self.subsession_id) + ")"
\ No newline at end of file
+        return str(self.simsession_type_name) + " (" + str(self.subsession_id) + ")"
+
+class HostedResultWatermark(models.Model):
+    """ How far the hosted results search has got for a host and league, so each scrape only asks for new results """
+
+    host_cust_id = models.IntegerField(null=False)
+    league_id = models.IntegerField(null=True)
+    finish_range_begin = models.DateTimeField(null=True)
+    last_checked = models.DateTimeField(null=True)
+    date_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'irstats_hosted_result_watermarks'
+        verbose_name = 'Hosted Result Watermark'
+        verbose_name_plural = 'Hosted Result Watermarks'
+        unique_together = ('host_cust_id', 'league_id')
+
+    def __str__(self):
+        return str(self.host_cust_id) + " | " + str(self.league_id) + " (" + str(self.finish_range_begin) + ")"
+
+
+class HostedResults(models.Model):
+    """ Subsessions found by the hosted results search, kept so sessions can be linked after the watermark moves on """
+
+    subsession_id = models.IntegerField(unique=True)
+    host_cust_id = models.IntegerField(null=True)
+    league_id = models.IntegerField(null=True)
+    league_season_id = models.IntegerField(null=True)
+    private_session_id = models.IntegerField(null=True)
+    session_name = models.CharField(max_length=255, blank=True, null=True)
+    heat_race = models.BooleanField(default=False)
+    track_id = models.IntegerField(null=True)
+    start_time = models.DateTimeField(null=True)
+    end_time = models.DateTimeField(null=True)
+    date_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'irstats_hosted_results'
+        verbose_name = 'Hosted Result'
+        verbose_name_plural = 'Hosted Results'
+        ordering = ['subsession_id']
+
+    def __str__(self):
+        return str(self.session_name) + " (" + str(self.subsession_id) + ")"
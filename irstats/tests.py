@@ -1,3 +1,888 @@
-from django.test import TestCase
+import contextlib
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+import requests
+from django.db import models
+from django.test import SimpleTestCase, TestCase
+
+from includes.archiveStore import archiveStore
+from includes.bulkUpsert import bulkUpsert
+from includes.circuitBreaker import circuitBreaker
+from includes.fakeApiServer import fakeApiServer
+from includes.iRacingClient import iRacingClient
+from includes.ingestPipeline import ingestPipeline
+from includes.rateLimiter import rateLimiter
+from includes.responseCache import responseCache
+from includes.irstatsDataClient import irstatsDataClient
+from includes.singleFlight import singleFlight
+from irstats.models import Cars, Category, FieldLapEntries, Laps, Member, Races, Series, Tracks
+
+
+class RateLimiterTests(SimpleTestCase):
+
+    def test_spends_freely_with_headroom(self):
+        limiter = rateLimiter(_burst=10)
+        limiter.update({"x-ratelimit-limit": "240", "x-ratelimit-remaining": "200",
+                        "x-ratelimit-reset": str(time.time() + 60)})
+        self.assertLess(limiter.acquire(timeout=1), 0.05)
+        self.assertEqual(limiter.remaining, 199)
+
+    def test_waits_for_reset_when_spent(self):
+        limiter = rateLimiter()
+        limiter.update({"x-ratelimit-limit": "240", "x-ratelimit-remaining": "0",
+                        "x-ratelimit-reset": str(time.time() + 60)})
+        with self.assertRaises(RuntimeError):
+            limiter.acquire(timeout=0.1)
+
+    def test_429_without_reset_uses_cooldown(self):
+        limiter = rateLimiter(_cooldown=0.2)
+        limiter.update({"x-ratelimit-limit": "240"}, 429)
+        with self.assertRaises(RuntimeError):
+            limiter.acquire(timeout=0.05)
+        # Once the cooldown has passed the budget is assumed full again rather than held at zero for good.
+        self.assertLess(limiter.acquire(timeout=2), 2)
+        self.assertEqual(limiter.remaining, 239)
+
+    def test_429_uses_retry_after(self):
+        limiter = rateLimiter(_cooldown=60)
+        limiter.update({"x-ratelimit-limit": "240", "retry-after": "0"}, 429)
+        self.assertLess(limiter.acquire(timeout=2), 2)
+
+    def test_429_after_reset_has_passed(self):
+        limiter = rateLimiter(_cooldown=0.2)
+        limiter.update({"x-ratelimit-limit": "240", "x-ratelimit-reset": str(time.time() - 5)}, 429)
+        self.assertLess(limiter.acquire(timeout=2), 2)
+
+    def test_interactive_served_before_background(self):
+        limiter = rateLimiter(_cooldown=0.2)
+        limiter.update({"x-ratelimit-limit": "240"}, 429)
+        order = []
+
+        def call(priority):
+            limiter.acquire(priority=priority, timeout=5)
+            order.append(priority)
+
+        threads = [threading.Thread(target=call, args=(rateLimiter.BACKGROUND,))]
+        threads[0].start()
+        time.sleep(0.05)
+        threads.append(threading.Thread(target=call, args=(rateLimiter.INTERACTIVE,)))
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [rateLimiter.INTERACTIVE, rateLimiter.BACKGROUND])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_opens_after_failures_in_a_row(self):
+        breaker = circuitBreaker(_failure_threshold=3, _open_seconds=60)
+        for x in range(2):
+            self.assertTrue(breaker.allow())
+            breaker.record(False, "HTTP 503")
+        breaker.record(True)
+        self.assertEqual(breaker.state, circuitBreaker.CLOSED)
+
+        for x in range(3):
+            breaker.record(False, "HTTP 503")
+        self.assertEqual(breaker.state, circuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertFalse(breaker.available())
+        self.assertEqual(breaker.stats()["trips"], 1)
+        self.assertEqual(breaker.stats()["last_error"], "HTTP 503")
+
+    def test_probe_closes_on_success(self):
+        breaker = circuitBreaker(_failure_threshold=1, _open_seconds=0.05)
+        breaker.record(False, "Timeout")
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.available())
+        # Only one caller becomes the probe.
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, circuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, circuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens_for_longer(self):
+        breaker = circuitBreaker(_failure_threshold=1, _open_seconds=0.1, _max_open_seconds=0.3)
+        breaker.record(False, "Timeout")
+        time.sleep(0.12)
+        self.assertTrue(breaker.allow())
+        breaker.record(False, "Timeout")
+        self.assertEqual(breaker.state, circuitBreaker.OPEN)
+        self.assertEqual(breaker.wait, 0.2)
+        time.sleep(0.1)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.15)
+        self.assertTrue(breaker.allow())
+        breaker.record(False, "Timeout")
+        self.assertEqual(breaker.wait, 0.3)
+
+    def test_4xx_is_not_a_failure(self):
+        client = stubClient(lambda method, url, kwargs: response(404))
+        client.breaker = circuitBreaker(_failure_threshold=1)
+        for x in range(3):
+            client._request("get", "https://members.example/data/a")
+        self.assertEqual(client.breaker.state, circuitBreaker.CLOSED)
+
+    def test_errors_and_5xx_trip_the_client(self):
+        client = stubClient(lambda method, url, kwargs: response(503))
+        client.max_retries = 0
+        client.breaker = circuitBreaker(_failure_threshold=2)
+        for x in range(2):
+            client._request("get", "https://members.example/data/a")
+        with self.assertRaisesMessage(RuntimeError, "iRacing API unavailable"):
+            client._request("get", "https://members.example/data/a")
+        self.assertEqual(len(client.session.calls), 2)
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def test_key_ignores_order_types_and_none(self):
+        self.assertEqual(responseCache.makeKey("/data/a", {"b": 1, "a": "2", "c": None}),
+                         responseCache.makeKey("/data/a", {"a": 2, "b": "1"}))
+
+    def test_memory_hit_and_expiry(self):
+        cache = responseCache()
+        cache.set("k", {"x": 1}, ttl=0.1)
+        self.assertEqual(cache.get("k"), (True, {"x": 1}))
+        time.sleep(0.15)
+        self.assertEqual(cache.get("k"), (False, None))
+
+    def test_ttl_zero_is_not_stored(self):
+        cache = responseCache()
+        cache.set("k", 1, ttl=0)
+        self.assertEqual(cache.get("k"), (False, None))
+
+    def test_disk_tier_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as folder:
+            responseCache(_cache_folder=folder).set("k", [1, 2], ttl=60)
+            cache = responseCache(_cache_folder=folder)
+            self.assertEqual(cache.get("k"), (True, [1, 2]))
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    def test_memory_tier_is_bounded(self):
+        cache = responseCache(_max_entries=2)
+        for key in "abc":
+            cache.set(key, key)
+        self.assertEqual(cache.stats()["memory_entries"], 2)
+        self.assertEqual(cache.get("a"), (False, None))
+
+
+    def test_memory_tier_is_bounded_by_size(self):
+        cache = responseCache(_max_memory_bytes=100)
+        for key in "abc":
+            cache.set(key, "x" * 40)
+        self.assertEqual(cache.stats()["memory_entries"], 2)
+        self.assertLessEqual(cache.stats()["memory_bytes"], 100)
+        self.assertEqual(cache.get("a"), (False, None))
+
+        # Too big for memory on its own, so only kept on disk.
+        with tempfile.TemporaryDirectory() as folder:
+            cache = responseCache(_cache_folder=folder, _max_memory_bytes=100)
+            cache.set("big", ["x" * 200])
+            self.assertEqual(cache.stats()["memory_entries"], 0)
+            self.assertEqual(cache.get("big"), (True, ["x" * 200]))
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    def test_callers_get_their_own_copy(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = responseCache(_cache_folder=folder)
+            cars = [{"car_id": 1}]
+            cache.set("k", cars)
+            cars[0]["forum_url"] = "changed before the get"
+            found, data = cache.get("k")
+            data[0]["forum_url"] = "changed by the caller"
+            self.assertEqual(cache.get("k"), (True, [{"car_id": 1}]))
+            self.assertEqual(responseCache(_cache_folder=folder).get("k"), (True, [{"car_id": 1}]))
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = singleFlight()
+        calls = []
+        started = threading.Event()
+
+        def request():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return "data"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do("k", request)))
+        leader.start()
+        started.wait(1)
+        followers = [threading.Thread(target=lambda: results.append(flights.do("k", request))) for x in range(3)]
+        for thread in followers:
+            thread.start()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["data"] * 4)
+        self.assertEqual(flights.stats()["followers"], 3)
+
+    def test_error_reaches_followers(self):
+        flights = singleFlight()
+        started = threading.Event()
+
+        def request():
+            started.set()
+            time.sleep(0.1)
+            raise RuntimeError("failed")
+
+        errors = []
+
+        def call():
+            try:
+                flights.do("k", request)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        started.wait(1)
+        threads.append(threading.Thread(target=call))
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, ["failed", "failed"])
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    def test_other_process_result_is_picked_up(self):
+        with tempfile.TemporaryDirectory() as folder:
+            flights = singleFlight(_lock_folder=folder, _poll_interval=0.01)
+            # A lock file left by another process that finishes while this one waits.
+            key = "k"
+            path = os.path.join(folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".lock")
+            open(path, "w").close()
+            threading.Timer(0.1, os.remove, args=(path,)).start()
+            result = flights.do(key, lambda: "fetched", recheck=lambda: (True, "shared"))
+            self.assertEqual(result, "shared")
+            self.assertEqual(flights.stats()["process_shared"], 1)
+
+
+class IngestPipelineTests(SimpleTestCase):
+
+    def test_batches_reach_consumer_in_order(self):
+        batches = []
+        stats = ingestPipeline(_batch_size=3).run(iter(range(10)), batches.append)
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+        self.assertEqual(stats["consumed"], 10)
+        self.assertEqual(stats["batches"], 4)
+
+    def test_producer_error_is_raised(self):
+        def producer():
+            yield 1
+            raise ValueError("bad chunk")
+
+        with self.assertRaises(ValueError):
+            ingestPipeline(_batch_size=1).run(producer(), lambda batch: None)
+
+    def test_consumer_error_stops_producer(self):
+        produced = []
+
+        def producer():
+            for x in range(1000):
+                produced.append(x)
+                yield x
+
+        def consumer(batch):
+            raise KeyError("bad row")
+
+        with self.assertRaises(KeyError):
+            ingestPipeline(_queue_size=1, _batch_size=1).run(producer(), consumer)
+        self.assertLess(len(produced), 1000)
+
+
+class pieces():
+    """ Stands in for a streamed requests.Response whose body arrives in the given pieces. """
+
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def iter_content(self, chunk_size=None):
+        return iter(self.parts)
+
+
+class brokenBody(io.BytesIO):
+    """ A response body whose connection drops once fail_at bytes have been read. """
+
+    def __init__(self, body, fail_at):
+        super().__init__(body)
+        self.fail_at = fail_at
+
+    def read(self, size=-1):
+        if self.tell() >= self.fail_at:
+            raise requests.ConnectionError("Connection reset")
+        return super().read(self.fail_at - self.tell() if size < 0 else min(size, self.fail_at - self.tell()))
+
+
+def response(status=200, body=b"", headers=None, url="https://data.example/chunk"):
+    r = requests.Response()
+    r.status_code = status
+    r.raw = body if isinstance(body, io.IOBase) else io.BytesIO(
+        body if isinstance(body, bytes) else json.dumps(body).encode("utf-8"))
+    r.headers.update(headers or {})
+    r.url = url
+    return r
+
+
+class stubSession():
+    """ Stands in for a requests.Session, answering each request with handler(method, url, kwargs).
+    The handler returns a response or an exception to raise.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+        self.cookies = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        with self.lock:
+            self.calls.append((method, url))
+        result = self.handler(method, url, kwargs)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def stubClient(handler):
+    client = iRacingClient("user", "password", 1)
+    client.session = client.data_session = stubSession(handler)
+    client.backoff_base = 0.01
+    return client
+
+
+class RequestPolicyTests(SimpleTestCase):
+
+    def sequence(self, *results):
+        """ A handler answering each request with the next of the results, the last one repeated. """
+        results = list(results)
+        return lambda method, url, kwargs: results.pop(0) if len(results) > 1 else results[0]
+
+    def backoffs(self, client, delay=0.0):
+        attempts = []
+
+        def backoff(attempt, r=None):
+            attempts.append(attempt)
+            return delay
+        client._backoff = backoff
+        return attempts
+
+    def test_5xx_and_connection_errors_are_retried_with_backoff(self):
+        client = stubClient(self.sequence(response(503), requests.ConnectionError("refused"), requests.Timeout("slow"),
+                                          response(200, {"a": 1})))
+        attempts = self.backoffs(client)
+        r = client._request("get", "https://members.example/data/a")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(client.session.calls), 4)
+        self.assertEqual(attempts, [0, 1, 2])
+
+    def test_retries_give_up_after_max_retries(self):
+        client = stubClient(self.sequence(requests.ConnectionError("refused")))
+        self.backoffs(client)
+        with self.assertRaises(requests.ConnectionError):
+            client._request("get", "https://members.example/data/a")
+        self.assertEqual(len(client.session.calls), 1 + client.max_retries)
+
+        client = stubClient(self.sequence(response(502)))
+        self.backoffs(client)
+        self.assertEqual(client._request("get", "https://members.example/data/a").status_code, 502)
+        self.assertEqual(len(client.session.calls), 1 + client.max_retries)
+
+    def test_4xx_is_not_retried(self):
+        for status in (400, 401, 404):
+            client = stubClient(self.sequence(response(status)))
+            self.assertEqual(client._request("get", "https://members.example/data/a").status_code, status)
+            self.assertEqual(len(client.session.calls), 1)
+
+    def test_backoff_grows_and_honours_retry_after(self):
+        client = iRacingClient("user", "password", 1)
+        for attempt in range(6):
+            self.assertLessEqual(client._backoff(attempt), min(client.backoff_max, client.backoff_base * 2 ** attempt))
+        self.assertEqual(client._backoff(0, response(429, headers={"retry-after": "3"})), 3.0)
+        self.assertEqual(client._backoff(0, response(429, headers={"retry-after": "600"})), client.backoff_max)
+
+    def test_401_logs_in_once_and_replays(self):
+        def handler(method, url, kwargs):
+            if url.endswith("/auth"):
+                return response(200, {"authcode": "token"})
+            return data.pop(0)
+
+        data = [response(200, {"a": 0}), response(401), response(200, {"a": 1})]
+        client = stubClient(handler)
+        self.assertEqual(client._get_resource("/data/a", use_cache=False), {"a": 0})
+        self.assertEqual(client._get_resource("/data/a", use_cache=False), {"a": 1})
+        self.assertEqual([x[1].rsplit("/", 1)[1] for x in client.session.calls], ["auth", "a", "a", "auth", "a"])
+
+        # A second 401 straight after logging in again is not replayed a second time.
+        data = [response(401), response(401)]
+        with self.assertRaises(RuntimeError):
+            client._get_resource("/data/a", use_cache=False)
+        self.assertEqual([x[1].rsplit("/", 1)[1] for x in client.session.calls[5:]], ["a", "auth", "a"])
+
+    def test_deadline_raises_before_the_next_attempt(self):
+        client = stubClient(self.sequence(response(503)))
+        self.backoffs(client, delay=0.5)
+        started = time.monotonic()
+        with client.deadline(0.2):
+            with self.assertRaisesMessage(RuntimeError, "Deadline exceeded"):
+                client._request("get", "https://members.example/data/a")
+        self.assertEqual(len(client.session.calls), 1)
+        self.assertLess(time.monotonic() - started, 0.2)
+
+    def test_spent_deadline_sends_nothing(self):
+        client = stubClient(self.sequence(response(200)))
+        with client.deadline(0):
+            with self.assertRaisesMessage(RuntimeError, "Deadline exceeded"):
+                client._request("get", "https://members.example/data/a")
+        self.assertEqual(client.session.calls, [])
+
+    def test_nested_deadlines_keep_the_earliest(self):
+        client = iRacingClient("user", "password", 1)
+        with client.deadline(10):
+            outer = client._current_deadline()
+            with client.deadline(60):
+                self.assertEqual(client._current_deadline(), outer)
+            with client.deadline(1):
+                self.assertLess(client._current_deadline(), outer)
+            self.assertEqual(client._current_deadline(), outer)
+        self.assertIsNone(client._current_deadline())
+
+
+class IterJsonArrayTests(SimpleTestCase):
+
+    documents = [
+        [1.5],
+        [-1500.0],
+        [1e5, 2E-3, -0.25, 10, 0],
+        [True, False, None, "", "a,b]"],
+        [{"a": [1, {"b": "c ] ,"}], "d": {}}, [[2], []], {"e": -3.5e-2}],
+        ["héllo", "日本", "🏁 flag", {"ü": "ß"}],
+        [],
+    ]
+
+    def parse(self, response):
+        return list(iRacingClient("user", "password", 1)._iter_json_array(response))
+
+    def test_every_split_point(self):
+        for document in self.documents:
+            for text in (json.dumps(document), json.dumps(document, ensure_ascii=False, indent=1)):
+                body = text.encode("utf-8")
+                for split in range(len(body) + 1):
+                    with self.subTest(body=body, split=split):
+                        self.assertEqual(self.parse(pieces(body[:split], body[split:])), document)
+
+    def test_every_read_size(self):
+        for document in self.documents:
+            body = json.dumps(document, ensure_ascii=False).encode("utf-8")
+            for size in range(1, len(body) + 1):
+                with self.subTest(body=body, size=size):
+                    parts = [body[x:x + size] for x in range(0, len(body), size)]
+                    self.assertEqual(self.parse(pieces(*parts)), document)
+
+    def test_bytes_read_are_counted(self):
+        read_bytes = [0]
+        rows = list(iRacingClient("user", "password", 1)._iter_json_array(pieces(b"[1, ", b"2]"),
+                                                                           read_bytes=read_bytes))
+        self.assertEqual(rows, [1, 2])
+        self.assertEqual(read_bytes, [6])
+
+    def test_bad_bodies_raise(self):
+        for parts in ((b'{"a": 1}',), (b"[1, 2",), (b'[{"a": ', b"1"), (b"[1x]",)):
+            with self.subTest(parts=parts):
+                with self.assertRaises(RuntimeError):
+                    self.parse(pieces(*parts))
+
+
+class ChunkDownloadTests(SimpleTestCase):
+
+    def test_chunks_download_concurrently_and_keep_their_order(self):
+        names = ["%d.json" % x for x in range(6)]
+        failed = []
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def handler(method, url, kwargs):
+            index = int(url.rsplit("/", 1)[1].split(".")[0])
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            # Earlier chunks take longer, so they finish out of order.
+            time.sleep(0.05 * (6 - index))
+            with lock:
+                running[0] -= 1
+                if index == 2 and not failed:
+                    failed.append(index)
+                    return response(403, url=url)
+            return response(200, [index * 10, index * 10 + 1], url=url)
+
+        client = stubClient(handler)
+        rows = client._get_chunks({"base_download_url": "https://data.example/", "chunk_file_names": names},
+                                  max_workers=3)
+        self.assertEqual(rows, [x * 10 + y for x in range(6) for y in range(2)])
+        self.assertEqual(running[1], 3)
+        self.assertEqual(failed, [2])
+        self.assertEqual(len(client.session.calls), 7)
+
+    def test_chunk_that_keeps_failing_raises(self):
+        client = stubClient(lambda method, url, kwargs: response(403, url=url))
+        with self.assertRaises(RuntimeError):
+            client._get_chunks({"base_download_url": "https://data.example/", "chunk_file_names": ["a", "b"]})
+        self.assertEqual(len(client.session.calls), 2 + client.chunk_retries)
+
+    def test_no_chunks(self):
+        client = stubClient(lambda method, url, kwargs: response(200, []))
+        self.assertEqual(client._get_chunks({"base_download_url": "x", "chunk_file_names": []}), [])
+        self.assertEqual(client.session.calls, [])
+
+
+class StreamedChunkTests(SimpleTestCase):
+
+    chunk_info = {"base_download_url": "https://data.example/", "chunk_file_names": ["a.json", "b.json"]}
+
+    def test_failed_chunk_resumes_after_rows_already_read(self):
+        attempts = []
+
+        def handler(method, url, kwargs):
+            attempts.append(url)
+            if url.endswith("a.json"):
+                body = b"[1, 2, 3]"
+                return response(body=brokenBody(body, 5) if len(attempts) == 1 else io.BytesIO(body), url=url)
+            return response(body=[4], url=url)
+
+        rows = list(stubClient(handler)._iter_chunks(self.chunk_info))
+        self.assertEqual(rows, [1, 2, 3, 4])
+        self.assertEqual(len(attempts), 3)
+
+    def test_chunk_that_keeps_failing_raises(self):
+        client = stubClient(lambda method, url, kwargs: response(status=403, url=url))
+        with self.assertRaises(RuntimeError):
+            list(client._iter_chunks(self.chunk_info))
+        self.assertEqual(len(client.session.calls), 1 + client.chunk_retries)
+
+
+class SearchRangeCheckpointTests(SimpleTestCase):
+
+    def searchClient(self, searched):
+        client = iRacingClient("user", "password", 1)
+
+        def search(max_workers=None, **filters):
+            searched.append(filters["start_range_begin"])
+            return [{"subsession_id": filters["start_range_begin"]}]
+
+        client.result_search_hosted = search
+        return client
+
+    def test_window_is_checkpointed_once_its_rows_are_stored(self):
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint_file = os.path.join(folder, "checkpoint.json")
+            stored = []
+
+            def save(batch):
+                for rows, checkpoint in batch:
+                    if stored:
+                        raise KeyError("bad row")
+                    stored.extend(rows)
+                    checkpoint()
+
+            windows = self.searchClient([]).result_search_hosted_range("2024-01-01T00:00Z", "2024-07-01T00:00Z",
+                                                                       checkpoint_file=checkpoint_file, by_window=True)
+            with self.assertRaises(KeyError):
+                ingestPipeline(_batch_size=1).run(windows, save)
+            self.assertEqual(stored, [{"subsession_id": "2024-01-01T00:00Z"}])
+
+            # The windows searched ahead of the failed write are searched again.
+            searched = []
+            rows = list(self.searchClient(searched).result_search_hosted_range(
+                "2024-01-01T00:00Z", "2024-07-01T00:00Z", checkpoint_file=checkpoint_file))
+            self.assertEqual(sorted(searched), ["2024-03-31T00:00Z", "2024-06-29T00:00Z"])
+            self.assertEqual([x["subsession_id"] for x in rows], ["2024-03-31T00:00Z", "2024-06-29T00:00Z"])
+
+
+class FakeApiServerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def server(self, **options):
+        server = fakeApiServer(self.folder.name, **options).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def login(self, server):
+        session = requests.Session()
+        self.assertEqual(session.post(server.url + "/auth", json={"email": "a"}).status_code, 200)
+        return session
+
+    def test_replay_matches_parameters(self):
+        server = self.server()
+        server.addFixture("/data/results/get", {"subsession_id": 1},
+                          params={"subsession_id": 1, "include_licenses": False})
+        server.addFixture("/data/car/get", [{"car_id": 1}])
+        client = iRacingClient("user", "password", 1, _base_url=server.url)
+
+        self.assertEqual(client.fetch("result", subsession_id=1), {"subsession_id": 1})
+        self.assertEqual(client.fetch("get_cars"), [{"car_id": 1}])
+        # Another subsession is not answered with the one recorded.
+        self.assertIsNone(client.fetch("result", subsession_id=2))
+        self.assertEqual(server.stats()["data_404"], 1)
+
+        # Fixtures are found again by a new server on the same folder.
+        replay = fakeApiServer(self.folder.name)
+        params = {"subsession_id": "1", "include_licenses": "False"}
+        self.assertEqual(replay.findFixture("/data/results/get", params)[1]["data"], {"subsession_id": 1})
+        self.assertEqual(replay.findFixture("/data/results/get", {"subsession_id": "1"}), (None, None))
+        self.assertIsNotNone(replay.findFixture("/data/car/get", {"any": "1"})[1])
+
+    def test_chunked_fixture(self):
+        server = self.server()
+        server.addFixture("/data/results/lap_data", {"chunk_info": {"base_download_url": "x", "chunk_file_names": []}},
+                          chunks=[[1, 2], [3]])
+        client = iRacingClient("user", "password", 1, _base_url=server.url)
+        self.assertEqual(client.fetch("result_lap_data", subsession_id=1), [1, 2, 3])
+
+    def test_injected_errors(self):
+        server = self.server(_error_rate=1.0, _error_status=502)
+        server.addFixture("/data/car/get", [], link=False)
+        session = self.login(server)
+        self.assertEqual(session.get(server.url + "/data/car/get").status_code, 502)
+        server.error_rate = 0.0
+        self.assertEqual(session.get(server.url + "/data/car/get").status_code, 200)
+
+    def test_rate_limit_headers(self):
+        server = self.server(_rate_limit=3)
+        server.addFixture("/data/car/get", [], link=False)
+        session = self.login(server)
+        first = session.get(server.url + "/data/car/get")
+        self.assertEqual(first.headers["x-ratelimit-limit"], "3")
+        self.assertEqual(first.headers["x-ratelimit-remaining"], "1")
+        self.assertGreater(float(first.headers["x-ratelimit-reset"]), time.time())
+        self.assertEqual(session.get(server.url + "/data/car/get").headers["x-ratelimit-remaining"], "0")
+        self.assertEqual(session.get(server.url + "/data/car/get").status_code, 429)
+
+    def test_session_expiry(self):
+        server = self.server(_session_lifetime=1)
+        server.addFixture("/data/car/get", [], link=False)
+        session = requests.Session()
+        self.assertEqual(session.get(server.url + "/data/car/get").status_code, 401)
+        token = session.post(server.url + "/auth", json={"email": "a"}).json()["authcode"]
+        # A session would drop the expired cookie itself, the token is sent by hand to check the server refuses it.
+        cookies = {"authtoken_members": token}
+        self.assertEqual(requests.get(server.url + "/data/car/get", cookies=cookies).status_code, 200)
+        time.sleep(1.1)
+        self.assertEqual(requests.get(server.url + "/data/car/get", cookies=cookies).status_code, 401)
+
+
+class ArchiveStoreTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as folder:
+            archive = archiveStore(os.path.join(folder, "archive.sqlite3"), os.path.join(folder, "json"))
+            archive.put("result", 5, {"rows": [1, 2]})
+            self.assertTrue(archive.exists("result", "5"))
+            self.assertEqual(archive.get("result", 5), {"rows": [1, 2]})
+            self.assertIsNone(archive.get("result", 6))
+
+    def test_entry_stored_by_another_process_is_found(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "archive.sqlite3")
+            archive = archiveStore(path, os.path.join(folder, "json"))
+            other = archiveStore(path, os.path.join(folder, "json"))
+            other.put("result", 5, [1])
+            self.assertTrue(archive.exists("result", 5))
+            other.put("result", 6, [2])
+            self.assertEqual(archive.get("result", 6), [2])
+
+    def test_legacy_file_written_later_is_found(self):
+        with tempfile.TemporaryDirectory() as folder:
+            archive = archiveStore(None, folder)
+            archiveStore(None, folder).put("cars", "", [1])
+            self.assertTrue(archive.exists("cars"))
+            self.assertEqual(archive.get("cars"), [1])
+
+    def test_eviction_under_budget(self):
+        with tempfile.TemporaryDirectory() as folder:
+            archive = archiveStore(os.path.join(folder, "archive.sqlite3"), _keep=["cars_assets"])
+            archive.put("cars_assets", "", "x" * 500)
+            for id in range(10):
+                archive.put("result", id, "x" * 500)
+                archive.get("result", 0)
+            size = archive.report()["kinds"]["result"]["bytes"] // 10
+            archive.max_bytes = size * 8
+            archive.enforce()
+
+            report = archive.report()
+            # Evicted down to the low water mark, least recently used first, kept kinds left alone.
+            self.assertLessEqual(report["bytes"], archive.max_bytes * archive.low_water)
+            self.assertTrue(archive.exists("cars_assets"))
+            self.assertTrue(archive.exists("result", 0))
+            self.assertFalse(archive.exists("result", 1))
+            self.assertTrue(archive.exists("result", 9))
+            self.assertEqual(archive._bytes, report["bytes"])
+
+            # With room below the budget a store does not sweep again.
+            sweeps = []
+            archive.enforce = lambda: sweeps.append(1)
+            archive.put("result", 10, "x" * 500)
+            self.assertEqual(sweeps, [])
+
+    def test_legacy_file_moves_into_archive(self):
+        with tempfile.TemporaryDirectory() as folder:
+            legacy = os.path.join(folder, "json")
+            archiveStore(None, legacy).put("result", 7, {"a": 1})
+            archive = archiveStore(os.path.join(folder, "archive.sqlite3"), legacy)
+            self.assertEqual(archive.get("result", 7), {"a": 1})
+            self.assertFalse(os.path.exists(os.path.join(legacy, "result_7.json")))
+            self.assertEqual(archive.get("result", 7), {"a": 1})
+
+
+class BulkUpsertTests(TestCase):
+
+    def car(self, car_id, **fields):
+        row = {name: False for name in ("ai_enabled", "allow_number_colors", "allow_number_font", "allow_sponsor1",
+                                        "allow_sponsor2", "allow_wheel_color", "award_exempt", "free_with_subscription",
+                                        "has_headlights", "has_multiple_dry_tire_types", "retired")}
+        row.update({"car_id": car_id, "car_name": "Car %d" % car_id})
+        row.update(fields)
+        return row
+
+    def test_counts_inserted_and_updated(self):
+        upsert = bulkUpsert(Cars, ['car_id'], _batch_size=2)
+        result = upsert.run([self.car(1), self.car(2), self.car(3)])
+        self.assertEqual((result["inserted"], result["updated"]), (3, 0))
+
+        result = upsert.run([self.car(2, car_name="Renamed"), self.car(3), self.car(4)])
+        self.assertEqual((result["inserted"], result["updated"]), (1, 2))
+        self.assertEqual(result["inserted_keys"], [(4,)])
+        self.assertEqual(Cars.objects.count(), 4)
+        self.assertEqual(Cars.objects.get(car_id=2).car_name, "Renamed")
+
+    def test_last_duplicate_wins(self):
+        result = bulkUpsert(Cars, ['car_id']).run([self.car(1, car_name="First"), self.car(1, car_name="Last")])
+        self.assertEqual(result["inserted"], 1)
+        self.assertEqual(Cars.objects.get(car_id=1).car_name, "Last")
+
+    def test_fields_left_out_keep_stored_value(self):
+        Cars.objects.create(**self.car(1, patterns=7))
+        bulkUpsert(Cars, ['car_id']).run([self.car(1, car_name="New")])
+        car = Cars.objects.get(car_id=1)
+        self.assertEqual((car.car_name, car.patterns), ("New", 7))
+
+    def test_update_fields_include_given_and_auto_now(self):
+        fields = bulkUpsert(Cars, ['car_id'])._updateFields([{"car_id": 1, "car_name": "x"}])
+        self.assertEqual(sorted(fields), ["car_name", "date_modified"])
+        self.assertEqual(bulkUpsert(Cars, ['car_id'], _update_fields=["hp"])._updateFields([]), ["hp"])
+
+    def test_unchanged_rows_are_skipped(self):
+        upsert = bulkUpsert(Cars, ['car_id'], _hash_field='content_hash')
+        upsert.run([self.car(1), self.car(2)])
+        modified = Cars.objects.get(car_id=1).date_modified
+
+        result = upsert.run([self.car(1), self.car(2, hp=500)])
+        self.assertEqual((result["inserted"], result["updated"], result["unchanged"]), (0, 1, 1))
+        self.assertEqual(result["updated_keys"], [(2,)])
+        self.assertEqual(Cars.objects.get(car_id=1).date_modified, modified)
+        self.assertEqual(Cars.objects.get(car_id=2).hp, 500)
+
+
+def stored(model, **fields):
+    """ Creates a row, with False for the required boolean fields not given. """
+    values = {x.name: False for x in model._meta.concrete_fields
+              if isinstance(x, models.BooleanField) and not x.null and not x.has_default()}
+    values.update(fields)
+    return model.objects.create(**values)
+
+
+class stubLapClient():
+    """ Stands in for the iRacingClient, answering result_lap_data from laps keyed by cust_id or team_id.
+    A value that is an exception is raised.
+    """
+
+    def __init__(self, laps):
+        self.laps = laps
+        self.calls = []
+
+    def carry_context(self, func):
+        return func
+
+    def background(self):
+        return contextlib.nullcontext()
+
+    def result_lap_data(self, subsession_id, cust_id=None, team_id=None):
+        key = team_id if team_id is not None else cust_id
+        self.calls.append(key)
+        laps = self.laps.get(key)
+        if isinstance(laps, Exception):
+            raise laps
+        return laps
+
+
+class FieldLapsTests(TestCase):
+
+    result = {"session_results": [{"simsession_number": 0, "results": [
+        {"cust_id": 1, "display_name": "Driver"},
+        {"cust_id": 2, "display_name": "Did not start"},
+        {"cust_id": 3, "display_name": "Failed"},
+        {"team_id": -5, "driver_results": [{"cust_id": 4, "display_name": "Drove"},
+                                           {"cust_id": 5, "display_name": "Did not drive"}]},
+    ]}]}
+
+    def setUp(self):
+        category = Category.objects.create(id=1)
+        self.race = stored(Races, subsession_id=100, member=Member.objects.create(custid=1),
+                           track=stored(Tracks, track_id=1, category=category), car=stored(Cars, car_id=1),
+                           series=stored(Series, series_id=1, category=category))
+
+    def lap(self, cust_id, lap_number):
+        return {"cust_id": cust_id, "lap_number": lap_number, "group_id": 1, "flags": 0, "incident": False,
+                "session_time": lap_number * 900000, "session_start_time": None, "lap_time": 900000,
+                "team_fastest_lap": False, "personal_best_lap": False, "license_level": 1, "car_number": 7,
+                "lap_events": [], "ai": False}
+
+    def dataClient(self, laps):
+        client = irstatsDataClient.__new__(irstatsDataClient)
+        client.custid = 1
+        client.irclient = stubLapClient(laps)
+        client.updateSessionResult = lambda subsession_id: self.result
+        return client
+
+    def test_rerun_only_fetches_missing_entries(self):
+        laps = {1: [self.lap(1, 1), self.lap(1, 2)], 2: [], 3: RuntimeError("Deadline exceeded"),
+                -5: [self.lap(4, 1)]}
+        client = self.dataClient(laps)
+        summary = client.updateSessionFieldLaps(100, max_workers=2)
+        self.assertEqual((summary["fetched"], summary["skipped"], summary["failed"], summary["inserted"]), (3, 0, 1, 3))
+        self.assertEqual(Member.objects.filter(placeholder=True).count(), 4)
+        self.assertEqual(FieldLapEntries.objects.filter(race=self.race).count(), 3)
+
+        # The driver with no laps and the team whose second driver never drove are not fetched again.
+        laps[3] = [self.lap(3, 1)]
+        client.irclient.calls = []
+        summary = client.updateSessionFieldLaps(100)
+        self.assertEqual(client.irclient.calls, [3])
+        self.assertEqual((summary["fetched"], summary["skipped"], summary["failed"]), (1, 3, 0))
+        self.assertEqual(Laps.objects.filter(race=self.race).count(), 4)
+
+        client.irclient.calls = []
+        self.assertEqual(client.updateSessionFieldLaps(100)["skipped"], 4)
+        self.assertEqual(client.irclient.calls, [])
+
+    def test_entries_with_laps_from_before_are_skipped(self):
+        client = self.dataClient({})
+        for custid in (1, 2, 3, 4, 5):
+            member, created = Member.objects.get_or_create(custid=custid)
+            client.saveSessionLaps(100, [self.lap(custid, 1)], self.race, member)
+        self.assertEqual(client.updateSessionFieldLaps(100)["skipped"], 4)
+        self.assertEqual(client.irclient.calls, [])
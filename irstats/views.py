@@ -1,10 +1,11 @@
 from django.shortcuts import render
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.conf import settings
 from django.db.models import Count, Min
 from datetime import datetime, timedelta
 from django.utils.timezone import make_aware
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import F
 
 import pandas as pd
@@ -14,9 +15,15 @@ import os
 from .models import *
 from includes.irstatsDataClient import irstatsDataClient
 from includes.irStatsPlotClient import irStatsPlotClient
+from includes.iRacingClientPool import iRacingClientPool
 
 def checkRecordUpdateInterval(type, next_update):
 
+    # While iRacing is failing serve what we have and leave the update due.
+    if not irstatsDataClient.apiAvailable():
+        print("iRacing unavailable, not updating", type)
+        return False
+
     try:
         # Get the update record and current time
         type_update = Update.objects.get(type=type)
@@ -54,6 +61,11 @@ def checkUpdateInterval(type):
     """ Checks against the update model to see if we should check for updates
         So we are not hitting the iRacing servers too often """
 
+    # While iRacing is failing serve what we have and leave the update due.
+    if not irstatsDataClient.apiAvailable():
+        print("iRacing unavailable, not updating", type)
+        return False
+
     try:
         # Get the update record and our date/times
         type_update = Update.objects.get(type=type)
@@ -96,10 +108,13 @@ def index(request):
         current_user = request.user
         custid = current_user.custid.custid
 
-        # Check it we need to update the members stats based on interval.
-        if checkUpdateInterval("Profile"):
+        # Check it we need to update the members stats based on interval.  A placeholder stored from another member's
+        # race has no profile yet, so it is read straight away whatever the interval says.
+        placeholder = Member.objects.filter(custid=custid, placeholder=True).exists()
+        if (placeholder and irstatsDataClient.apiAvailable()) or checkUpdateInterval("Profile"):
             ir_stats = irstatsDataClient(request)
-            ir_stats.updateMember()
+            with ir_stats.deadline():
+                ir_stats.updateMember()
 
         #Get the member stats & career from the database
         member_stats = Member.objects.get(custid=custid)
@@ -109,6 +124,7 @@ def index(request):
 
     #If the member does not exist the call the update function.
     except Member.DoesNotExist:
+        ir_stats = irstatsDataClient(request)
         context, created = ir_stats.updateMember()
         if not created:
             raise Http404("Member does not exist")
@@ -122,7 +138,8 @@ def cars(request):
     ir_stats = irstatsDataClient(request)
 
     if checkUpdateInterval("Cars"):
-        ir_stats.updateCars(True)
+        with ir_stats.deadline():
+            ir_stats.updateCars(True)
 
     # Get all the cars from the database
     car_listing = Cars.objects.all()
@@ -136,7 +153,8 @@ def leagues(request):
 
     if checkUpdateInterval("Leagues"):
         ir_stats = irstatsDataClient(request)
-        ir_stats.updateLeagueRegister()
+        with ir_stats.deadline():
+            ir_stats.updateLeagueRegister()
 
     # Get all the cars from the database
     league_listing = Leagues.objects.all()
@@ -162,7 +180,8 @@ def league(request, league_id):
             league.save()
 
             ir_stats = irstatsDataClient(request)
-            ir_stats.updateLeagueData(league, True)
+            with ir_stats.deadline():
+                ir_stats.updateLeagueData(league, True)
 
         seasons = LeagueSeasons.objects.all().filter(league=league)
         context = {'league': league, 'seasons': seasons}
@@ -246,10 +265,12 @@ def league_session(request, session_id):
         # Get the league details from the database
         league_session = LeagueSessions.objects.get(id=session_id)
 
-        # Only update the session if we have no subsession ID
-        if not league_session.subsession_id:
+        # Only update the session if we have no subsession ID or it was linked in bulk and not scored yet
+        scored = LeagueSessionSimsession.objects.filter(session_id=league_session.subsession_id).exists()
+        if (not league_session.subsession_id or not scored) and irstatsDataClient.apiAvailable():
             print("Getting subsession ID for ", league_session)
-            subsession_id = ir_stats.updateLeagueSession(league_session)
+            with ir_stats.deadline():
+                subsession_id = ir_stats.updateLeagueSession(league_session)
         else:
             print("We have this subsession ID for ", league_session, str(league_session.subsession_id))
             subsession_id = league_session.subsession_id
@@ -280,7 +301,8 @@ def league_session(request, session_id):
                 ).order_by(F('best_lap_time').asc(nulls_last=True), F('laps_complete').desc(nulls_last=True))
 
             if simsession['simsession_type'] != 99:
-                simsession['events'] = ir_stats.updateSessionEventLog(subsession_id, simsession['simsession_number'], True)
+                with ir_stats.deadline():
+                    simsession['events'] = ir_stats.updateSessionEventLog(subsession_id, simsession['simsession_number'], True)
 
         context = {'subsession_id': subsession_id, 'session': league_session, 'simsessions': simsessions}
 
@@ -296,7 +318,8 @@ def series(request):
     ir_stats = irstatsDataClient(request)
 
     if checkUpdateInterval("Series"):
-        ir_stats.updateSeries(True)
+        with ir_stats.deadline():
+            ir_stats.updateSeries(True)
 
     # Get all the cars from the database
     series_listing = Series.objects.all().filter(show=True)
@@ -326,20 +349,21 @@ def race(request, subsession_id):
         # Get the member stats & career from the database
         race_info = Races.objects.get(subsession_id=subsession_id)
 
-        # TODO - Might need to limit this to the user id
-        laps = Laps.objects.all().filter(race_id=race_info.id)
+        # The laps of the whole field may be stored, the page shows the member's own.
+        laps = Laps.objects.all().filter(race_id=race_info.id, member_id=race_info.member_id)
 
         ir_stats = irstatsDataClient(request)
 
-        file_end = str(subsession_id) + ".json"
-        result = ir_stats.getJsonFile("result_" + file_end)
-        event_log = ir_stats.getJsonFile("result_event_log_" + file_end)
+        # Results evicted from the archive are fetched again.
+        with ir_stats.deadline():
+            result = ir_stats.updateSessionResult(subsession_id)
+        if result is None:
+            raise Http404("Race result is not available")
 
         context = {
             'race_info': race_info,
             'laps': laps,
-            'session_results': result['session_results'],
-            'event_log': event_log
+            'session_results': result['session_results']
         }
 
     #If the race does not exist the call the update function.
@@ -356,7 +380,8 @@ def tracks(request):
 
     # Check it we need to update tracks from iRacing based on interval.
     if checkUpdateInterval("Tracks"):
-        ir_stats.updateTracks(True)
+        with ir_stats.deadline():
+            ir_stats.updateTracks(True)
 
     #Get all the tracks from the database and assets from json.
     track_listing = (Tracks.objects
@@ -397,4 +422,19 @@ def docs(request):
     apidoc = json.load(f)
 
     context = {"apidoc":apidoc}
-    return render(request, 'irstats/status.html', context)
\ No newline at end of file
+    return render(request, 'irstats/status.html', context)
+
+
+@staff_member_required(login_url='/admin/login/')
+def metrics(request):
+    """ API and page metrics for this process in the Prometheus text format. """
+    api_metrics = iRacingClientPool.getMetrics()
+
+    # The shared cache, limiter, in-flight tracker and archive report their current state as gauges.
+    for component, stats in iRacingClientPool.stats().items():
+        for name, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                api_metrics.gauge("irstats_" + component + "_" + name, value,
+                                  help="Shared %s %s" % (component, name.replace("_", " ")))
+
+    return HttpResponse(api_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")